@@ -0,0 +1,229 @@
+import asyncio
+import collections
+import contextlib
+import heapq
+import itertools
+import math
+import time
+import weakref
+
+import metrics
+
+# Admission control for outbound LLM requests: token buckets per endpoint and
+# per learner, then a priority queue for the concurrency slots. A request that
+# cannot start within its endpoint's max_wait is rejected right away (or as soon
+# as that becomes clear) instead of making every request slow.
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # priority: lower is served first; rate/burst: token bucket in requests per
+    # second (rate None - unlimited); max_wait: seconds a request may wait to start
+    "endpoints": {
+        "check_text": {"priority": 0, "rate": 10.0, "burst": 20, "max_wait": 5.0},
+        "generate_text": {"priority": 1, "rate": 5.0, "burst": 10, "max_wait": 20.0},
+        # background refills of the text pool (textpool.py)
+        "text_pool": {"priority": 2, "rate": 1.0, "burst": 2, "max_wait": 60.0}
+    },
+    # endpoints not listed above
+    "default_endpoint": {"priority": 1, "rate": None, "burst": 1, "max_wait": 30.0},
+    # one bucket per learner, shared by all endpoints
+    "user_rate": 0.5,
+    "user_burst": 6,
+    "max_users": 10000
+}
+
+WAIT_SECONDS = metrics.histogram("llm_admission_wait_seconds", "Time LLM requests waited for budget and a slot, by endpoint",
+                                 buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 60.0))
+REJECTED = metrics.counter("llm_admission_rejected_total", "LLM requests rejected by endpoint and reason")
+
+# live schedulers by name, for the gauges below
+_schedulers = weakref.WeakValueDictionary()
+
+
+def _queueDepths():
+    return {(("scheduler", name), ("endpoint", endpoint)): count
+            for name, scheduler in list(_schedulers.items()) for endpoint, count in scheduler.queueDepths().items()}
+
+
+def _activeRequests():
+    return {(("scheduler", name),): scheduler.active for name, scheduler in list(_schedulers.items())}
+
+
+metrics.gauge("llm_admission_queue_depth", "LLM requests waiting for a slot, by scheduler and endpoint", _queueDepths)
+metrics.gauge("llm_admission_active", "LLM requests holding a slot, by scheduler", _activeRequests)
+
+# smoothing of the observed request duration used to predict queue waits
+_SERVICE_ALPHA = 0.2
+
+
+class Rejected(Exception):
+    """
+    Запрос к LLM не может начаться вовремя; retryAfter - через сколько секунд есть смысл повторить.
+    """
+
+    def __init__(self, message, retryAfter=1.0):
+        super().__init__(message)
+        self.retryAfter = retryAfter
+
+
+class TokenBucket:
+    """
+    burst токенов, пополняется со скоростью rate в секунду. Токен можно взять
+    в долг (tokens < 0): следующий запрос ждет дольше, так резервируется очередь.
+    """
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """
+        Через сколько секунд будет доступен токен.
+        """
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class Scheduler:
+    """
+    maxConcurrency одновременных запросов; admit(endpoint, userId) - контекст,
+    внутри которого запрос держит слот. Работает на одном loop (общем, см. eventloop).
+    name - метка в метриках очереди; планировщик с тем же именем заменяет прежний.
+    """
+
+    def __init__(self, maxConcurrency, settings=None, name="llm"):
+        self.name = name
+        self.maxConcurrency = maxConcurrency
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self._active = 0
+        self._queue = []
+        self._order = itertools.count()
+        self._endpointBuckets = {}
+        self._userBuckets = collections.OrderedDict()
+        self._serviceTime = 0.0
+        _schedulers[name] = self
+
+    @property
+    def active(self):
+        return self._active
+
+    def queueDepths(self):
+        """
+        {endpoint: число запросов, ждущих слот}.
+        """
+        return collections.Counter(endpoint for _, _, _, endpoint, future in list(self._queue) if not future.done())
+
+    def endpointSettings(self, endpoint):
+        return self.settings["endpoints"].get(endpoint, self.settings["default_endpoint"])
+
+    def _buckets(self, endpoint, userId, now):
+        # (reason, bucket) that apply to the request
+        settings = self.endpointSettings(endpoint)
+        buckets = []
+        if settings.get("rate"):
+            bucket = self._endpointBuckets.get(endpoint)
+            if bucket is None:
+                bucket = self._endpointBuckets[endpoint] = TokenBucket(settings["rate"], settings["burst"], now)
+            buckets.append(("endpoint_rate", bucket))
+        if userId is not None and self.settings["user_rate"]:
+            bucket = self._userBuckets.get(userId)
+            if bucket is None:
+                bucket = self._userBuckets[userId] = TokenBucket(self.settings["user_rate"], self.settings["user_burst"], now)
+                while len(self._userBuckets) > self.settings["max_users"]:
+                    self._userBuckets.popitem(last=False)
+            self._userBuckets.move_to_end(userId)
+            buckets.append(("user_rate", bucket))
+        return buckets
+
+    @contextlib.asynccontextmanager
+    async def admit(self, endpoint, userId=None):
+        arrived = time.monotonic()
+        if not self.settings["enabled"]:
+            await self._acquire(endpoint, 0, math.inf)
+        else:
+            await self._admit(endpoint, userId, arrived)
+        WAIT_SECONDS.observe(time.monotonic() - arrived, endpoint=endpoint)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._serviceTime = elapsed if not self._serviceTime else \
+                self._serviceTime + _SERVICE_ALPHA * (elapsed - self._serviceTime)
+            self._release()
+
+    async def _admit(self, endpoint, userId, now):
+        settings = self.endpointSettings(endpoint)
+        deadline = now + settings["max_wait"]
+
+        buckets = self._buckets(endpoint, userId, now)
+        for reason, bucket in buckets:
+            delay = bucket.delay(now)
+            if now + delay > deadline:
+                REJECTED.inc(endpoint=endpoint, reason=reason)
+                who = "this user" if reason == "user_rate" else endpoint
+                raise Rejected(f"LLM request budget of {who} is exhausted, retry in {math.ceil(delay)} s", delay)
+        delay = max((bucket.delay(now) for _, bucket in buckets), default=0.0)
+        for _, bucket in buckets:
+            bucket.take()
+
+        try:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._acquire(endpoint, settings["priority"], deadline)
+        except BaseException:
+            for _, bucket in buckets:
+                bucket.refund()
+            raise
+
+    async def _acquire(self, endpoint, priority, deadline):
+        # nobody waits while a slot is free: _release hands slots to waiters first
+        if self._active < self.maxConcurrency:
+            self._active += 1
+            return
+
+        now = time.monotonic()
+        # requests of the same or a higher priority go first; each slot serves
+        # one of them per average request duration
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority and not entry[4].done())
+        expected = (ahead + 1) * self._serviceTime / self.maxConcurrency
+        if now + expected > deadline:
+            REJECTED.inc(endpoint=endpoint, reason="queue")
+            raise Rejected(f"LLM queue for {endpoint} is too long: about {math.ceil(expected)} s of waiting, "
+                           f"the limit is {math.ceil(deadline - now)} s", expected)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), deadline, endpoint, future))
+        try:
+            await asyncio.wait_for(future, None if deadline == math.inf else deadline - now)
+        except asyncio.TimeoutError:
+            REJECTED.inc(endpoint=endpoint, reason="deadline")
+            raise Rejected(f"LLM request for {endpoint} did not start within {math.ceil(deadline - now)} s",
+                           self._serviceTime or 1.0) from None
+        except asyncio.CancelledError:
+            # the slot may have been handed over just as the caller went away
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        # the slot passes straight to the most urgent waiter that is still waiting
+        while self._queue:
+            future = heapq.heappop(self._queue)[4]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
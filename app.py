@@ -1,77 +1,183 @@
+import asyncio
+import dataclasses
 import datetime
 import json
+import logging
+import math
 import random
 import re
-import numpy as np
-from openai import OpenAI
+import time
 
-from flask import Flask, render_template, request
+from quart import Quart, Response, g, render_template, request
 import os.path
-from flask_cors import CORS, cross_origin
-
-import asyncpg
-app = Flask(__name__)
-cors = CORS(app) # allow CORS for all domains on all routes.
-
-with open("config.json", 'r') as config_file:
-    config = json.loads(config_file.read())
-
-def _selectRepeatWords(words : list):
-
-    random.shuffle(words)
-    filtered_words = list(filter(lambda x: x['nextRepeatTime'] < datetime.datetime.now(), words))
+from quart_cors import cors
+import numpy as np
 
-    words2repeat = []
-    for word in filtered_words:
-        for w2r in words2repeat:
-            if w2r['word'] == word['word']: break
-        else:
-            words2repeat.append(word)
-        if len(words2repeat) == config['WordsPerTry']:
-            return words2repeat
-    return words2repeat
+import appconfig
+import database
+import distractors
+import eventloop
+import explaincache
+import fairslots
+import historyqueue
+import historyversions
+import llm
+import logs
+import metrics
+import profiler
+import responses
+import retention
+import scheduler
+import singleflight
+import snapshot
+import textpool
+import wordimport
+import wordquery
+import wordstore
+app = cors(Quart(__name__), allow_origin="*", expose_headers=["ETag"]) # allow CORS for all domains on all routes.
+
+# handlers read the module-level config, replaced by _applyConfig when config.json changes
+config = appconfig.load("config.json")
+
+logs.configure(config)
+database.configure(config)
+llm.configure(config)
+responses.configure(config)
+snapshot.configure(config)
+
+log = logging.getLogger(__name__)
+
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "Time to response headers by route, method and status")
+WORD_SYNC = metrics.counter("word_sync_requests_total", "/getWords?since= requests by result (unchanged, delta, reset)")
+
+wordScheduler = scheduler.create(config)
+
+# sections applied without a restart; the rest are read once when the process starts.
+# text_generation.default_weight is the exception in its section, see _applyConfig
+_RELOADABLE = {"WordsPerTry", "RepeatOrder", "SimilarDistractors", "text_generation", "scheduler", "compression"}
+
+
+def _applyConfig(new, old):
+    global config, wordScheduler
+    # an unknown scheduler raises here and the previous configuration stays
+    wordScheduler = scheduler.create(new)
+    responses.configure(new)
+    pending = [section for section in old.changedSections(new) if section not in _RELOADABLE]
+    if new.textGeneration.defaultWeight != old.textGeneration.defaultWeight:
+        # loaded word stores and snapshots have filled it in for words without a weight;
+        # queries and inserts keep the same value until the restart
+        new.textGeneration = dataclasses.replace(new.textGeneration, defaultWeight=old.textGeneration.defaultWeight)
+        pending.append("text_generation.default_weight")
+    config = new
+    if pending:
+        log.warning("Changes to %s in config.json take effect after a restart", ", ".join(pending))
+
+
+appconfig.subscribe(_applyConfig)
+
+historyQueue = historyqueue.HistoryQueue(config.get('history_queue'))
+
+# identical concurrent requests (the UI fires several at once when it opens) share one query or LLM call
+repeatWordsFlight = singleflight.Group("repeat_words", config.get('single_flight'))
+wordsFlight = singleflight.Group("words", config.get('single_flight'))
+statisticsFlight = singleflight.Group("statistics", config.get('single_flight'))
+textFlight = singleflight.Group("generate_text", config.get('single_flight'))
+
+
+async def _forgetUser(userId):
+    # a learner's own changes show up in the very next response, not after the reuse window
+    for group in (repeatWordsFlight, wordsFlight, statisticsFlight):
+        await group.forget(userId)
+
+
+def _subscribeDistractors(store):
+    store.distractorIndex = distractors.DistractorIndex()
+    store.subscribe(store.distractorIndex)
+
+
+# словарь и индекс вариантов ответа у каждого пользователя свои
+wordStores = wordstore.WordStores(config.textGeneration.defaultWeight, config.get('tenants'),
+                                  onCreate=_subscribeDistractors)
+metrics.gauge("word_store_words", "Words held by the in-memory word stores", wordStores.wordCount)
+metrics.gauge("word_store_users", "Learner dictionaries held in memory", lambda: len(wordStores))
+# versions of the learners' history for /getStatistics ETags, kept current by history_changed
+historyVersions = historyversions.HistoryVersions()
+
+_REPEAT_ORDER = {
+    # случайные слова среди тех, которые пора повторять
+    "random": "random()",
+    # сначала самые "тяжелые", затем самые просроченные
+    "priority": "weight DESC NULLS LAST, nextrepeattime"
+}
+
+
+async def _selectRepeatWords(userId):
+    """
+    Выбирает не более WordsPerTry слов пользователя, которые пора повторять, без повторов по написанию.
+    Фильтрация, дедупликация и LIMIT выполняются в Postgres по индексу на (user_id, nextrepeattime).
+    """
+    order = _REPEAT_ORDER[config.repeatOrder]
+    rows = await database.run(lambda conn: conn.fetch(f"""
+        SELECT * FROM (
+            SELECT DISTINCT ON (word) *
+            FROM words
+            WHERE user_id = $3 AND nextrepeattime < $1
+            ORDER BY word, {order}
+        ) AS due
+        ORDER BY {order}
+        LIMIT $2
+    """, datetime.datetime.now(), config.wordsPerTry, userId))
+    return [wordstore.Word.fromRow(row) for row in rows]
 
 
-def _generateFirstStage(words, words2repeat):
-    wordsrepeat = [w["word"] for w in words2repeat]
-    words = list(filter(lambda x: x["word"] not in wordsrepeat, words))
+async def _getDistractorIndex(userId):
+    """
+    Индекс вариантов ответа подписан на WordStore пользователя и обновляется вместе с ним.
+    """
+    store = await wordStores.ensureLoaded(userId)
+    return store.distractorIndex
 
-    for w in words:
-        w['nextRepeatTime'] = 0
 
-    for w in words2repeat:
-        w['nextRepeatTime'] = 0
+def _generateFirstStage(index, words2repeat):
+    """
+    Задания первого этапа. Слова и варианты ответа ссылаются на wordId,
+    сами варианты отдаются один раз в "options" ответа /repeatWords.
+    Возвращает (задания, {wordId: вариант} для вариантов не из words2repeat).
+    """
+    if len(index) == 0 or len(words2repeat) == 0:
+        return [], {}
 
-    if len(words) == 0 or len(words2repeat) == 0:
-        return []
+    wordsrepeat = {w.word for w in words2repeat}
+    sessionIds = {w.wordId for w in words2repeat}
 
     stage1 = []
+    distractorOptions = {}
     for w in words2repeat:
 
-        options = []
-        if "partOfSpeech" in w:
-            wordsWithSamePartOfSpeech = list(filter(lambda x: "partOfSpeech" in x and x["partOfSpeech"] == w["partOfSpeech"], words))
-            if (w["partOfSpeech"] == "v"
-                or w["partOfSpeech"] == "n"
-                or  w["partOfSpeech"] == "adj"
-                or w["partOfSpeech"] == "adv") and len(wordsWithSamePartOfSpeech) >= 3:
-                options = random.sample(wordsWithSamePartOfSpeech, 3)
-            else:
-                options = random.sample(words, 3)
-        else:
-            options = random.sample(words, 3)
+        options = index.sample(
+            w.word,
+            w.partOfSpeech,
+            3,
+            wordsrepeat,
+            config.similarDistractors
+        )
+        if not options:
+            continue
 
-        insert_index = random.randint(0, 3)
+        optionIds = [int(option["wordId"]) for option in options]
+        for optionId, option in zip(optionIds, options):
+            if optionId not in sessionIds:
+                distractorOptions[optionId] = option
 
-        options.insert(insert_index, w)
+        optionIds.insert(random.randint(0, len(optionIds)), w.wordId)
 
         stage1.append({
-            "translated": w["translation"],
-            "options": options,
-            "word": w
+            "wordId": w.wordId,
+            "translated": w.translation,
+            "options": optionIds
         })
 
-    return stage1
+    return stage1, distractorOptions
 
 
 def _checkDatabase():
@@ -85,54 +191,45 @@ def _createDatabase():
     f.close()
 
 
-async def _loadDatabase():
+async def _loadDatabase(userId):
     """
-    Асинхронная загрузка данных с использованием asyncpg
+    Словарь пользователя из WordStore в памяти процесса; база читается целиком только
+    при первом обращении, дальше store обновляется по LISTEN/NOTIFY.
     """
     try:
-        # Подключение к базе данных
-        conn = await asyncpg.connect(
-            database="English",
-            user="nice",
-            password="nice",
-            host="localhost",
-            port=5432
-        )
-
-        # Выполнение запроса
-        rows = await conn.fetch("SELECT * FROM words")
-
-        # Преобразование в список словарей
-        words = []
-        for row in rows:
-            wordDict = dict(row)
-            words.append({
-                "wordId": wordDict["word_id"],
-                "nextRepeatTime": wordDict["nextrepeattime"],
-                "repeatIndex": wordDict["repeatindex"],
-                "word": wordDict["word"],
-                "translation": wordDict["translation"],
-                "example": json.loads(wordDict["example"]) if wordDict["example"] else None,
-                "partOfSpeech": wordDict["partofspeech"],
-                "weight": wordDict["weight"]
-            })
-
-        await conn.close()
-        return words
+        return await wordStores.ensureLoaded(userId)
 
     except Exception as e:
-        print(f"Ошибка: {e}")
+        log.error("Ошибка: %s", e)
+        return None
+
+
+async def _loadWordsByIds(userId, wordIds):
+    """
+    Строки таблицы words только для указанных слов пользователя (для сохранения результатов повторения)
+    """
+    if not wordIds:
         return []
+    return await database.run(lambda conn: conn.fetch(
+        "SELECT * FROM words WHERE word_id = ANY($1::bigint[]) AND user_id = $2", wordIds, userId))
 
 
-async def _updateWordsInDatabaseAndSave(words2update, wordsInDatabase, doNotChangeRepeatTimes = False, doNotIncreaseRepeatIndex = False):
-    conn = await asyncpg.connect(
-        database="English",
-        user="nice",
-        password="nice",
-        host="localhost",
-        port=5432
-    )
+async def _updateWordsInDatabaseAndSave(userId, words2update, rowsInDatabase, doNotChangeRepeatTimes = False, doNotIncreaseRepeatIndex = False):
+    history = await database.run(_applyWordUpdates, userId, words2update, rowsInDatabase, doNotChangeRepeatTimes, doNotIncreaseRepeatIndex)
+    # history rows are written by the background writer, outside the request's transaction
+    await historyQueue.append(history)
+
+
+async def _applyWordUpdates(conn, userId, words2update, rowsInDatabase, doNotChangeRepeatTimes, doNotIncreaseRepeatIndex):
+    """
+    Сохраняет новое состояние слов и добавляет новые слова.
+    Возвращает строки words_history для historyQueue (пустой список, если
+    очередь выключена и история записана в той же транзакции).
+    """
+    rowsById = {row["word_id"]: row for row in rowsInDatabase}
+    reviewedRows = []
+    results = []
+    newWords = []
 
     for word in words2update:
         val = "someval"
@@ -141,205 +238,161 @@ async def _updateWordsInDatabaseAndSave(words2update, wordsInDatabase, doNotChan
 
         if type(val) == bool:
             # сохранение результата из повторения
-
-            for w in wordsInDatabase:
-                if w["wordId"] == int(word):
-                    wordDb = w
-
-                    # Обновление веса в зависимости от результата
-                    if not val:  # Неудача
-                        wordDb["repeatIndex"] = 1
-                        wordDb["weight"] = min(
-                            1 + wordDb.get("weight", config['text_generation']['default_weight']) *
-                            config['text_generation']['weight_increase_fail'],
-                            config['text_generation']['max_weight']
-                        )
-                    else:  # Успех
-                        if not doNotIncreaseRepeatIndex:
-                            wordDb["repeatIndex"] = int(wordDb["repeatIndex"]) + 1
-                        wordDb["weight"] = max(
-                            wordDb.get("weight", config['text_generation']['default_weight']) *
-                            config['text_generation']['weight_decrease_success'],
-                            config['text_generation']['min_weight'])
-
-                    if not doNotChangeRepeatTimes:
-                        wordDb["nextRepeatTime"] = _getRepeatDateFromRepeatIndex(wordDb["repeatIndex"])
-                    await conn.fetchval(
-                        "UPDATE words SET repeatindex=$1, nextrepeattime=$2 WHERE word_id=$3",
-                        wordDb["repeatIndex"], wordDb["nextRepeatTime"], wordDb["wordId"])
-
-                    await conn.fetchval(
-                        "INSERT INTO words_history (word_id, repeatindex, repeatdate) VALUES ($1, $2, NOW())",
-                        wordDb["wordId"], wordDb["repeatIndex"])
-
-                    break
-
+            row = rowsById.get(int(word))
+            if row is not None:
+                reviewedRows.append(row)
+                results.append(val)
         else:
-            wordsInDatabase.append({
-                "repeatIndex": 0,
-                "translation": word["translation"],
-                "word": word["word"],
-                "nextRepeatTime": 0,
-                "example": word["example"],
-                "partOfSpeech": word["partOfSpeech"].replace(".", "")
-            })
-
-            await conn.fetchval("INSERT INTO words (translation, partofspeech, word, example, nextrepeattime) VALUES ($1, $2, $3, $4, NOW())", word["translation"], word["partOfSpeech"], word["word"], word["example"])
-
-    await conn.close()
-
-
-def _getRepeatDateFromRepeatIndex(repeatIndex):
-    days = 0
-    if repeatIndex == 0:
-        days = 0
-    elif repeatIndex == 1:
-        days = 1
-    elif repeatIndex == 2:
-        days = 2
-    elif repeatIndex == 3:
-        days = 3
-    elif repeatIndex == 4:
-        days = 7
-    elif repeatIndex == 5:
-        days = 14
-    else:
-        days = 14
-
-    # Получаем текущую дату и время
-    current_date = datetime.datetime.now()
-    # Добавляем нужное количество дней
-    repeat_date = current_date + datetime.timedelta(days=days)
-
-    return repeat_date
-
-
-def _checkInput(words):
-    # words_to_add = list()
-    # any_word_added = False
-    #
-    # if not os.path.isfile("database.json"):
-    #     return
-    #
-    # with open("input.txt", encoding="utf-8") as f:
-    #     for l in f:
-    #         splitted = l.split("=")
-    #         if len(splitted) < 2:
-    #             continue
-    #
-    #         word = splitted[0]
-    #
-    #         partOfSpeech = ""
-    #         partOfSpeechMatch = re.search(r'\([A-Za-z]+\)', word)
-    #         if partOfSpeechMatch:
-    #             partOfSpeech = partOfSpeechMatch.group()
-    #             word = word.replace(partOfSpeech, "")
-    #             partOfSpeech = partOfSpeech.replace("(", "").replace(")", "")
-    #
-    #
-    #         word = word.strip()
-    #         word = word.lower()
-    #         transAndExample = splitted[1].split(";")
-    #
-    #         translation = transAndExample[0]
-    #         if len(transAndExample) > 1:
-    #             example = transAndExample[1:]
-    #         else:
-    #             example = []
-    #
-    #         words_to_add.append({
-    #             "word": word,
-    #             "translation": translation,
-    #             "example": example,
-    #             "partOfSpeech": partOfSpeech
-    #         })
-    #         any_word_added = True
-    #
-    # with open("input.txt", "w", encoding="utf-8") as f:
-    #     f.write("")
-    #
-    # if any_word_added:
-    #     _updateWordsInDatabaseAndSave(words_to_add, words)
-    pass
+            newWords.append(word)
+
+    now = datetime.datetime.now()
+    history = []
+    if reviewedRows:
+        # новое состояние и веса всех слов отправки считаются одним вызовом
+        success = np.array(results, dtype=bool)
+        state = wordScheduler.review(
+            scheduler.stateFromRows(reviewedRows),
+            success,
+            np.datetime64(now, "us"),
+            keepDue=doNotChangeRepeatTimes,
+            keepProgress=doNotIncreaseRepeatIndex)
+        weights = scheduler.updateWeights(
+            np.array([row["weight"] for row in reviewedRows], dtype=np.float64), success, config.textGeneration)
+        wordIds = [row["word_id"] for row in reviewedRows]
+        columns = scheduler.toColumns(state)
+        if historyQueue.enabled:
+            history = [(userId, wordId, repeatIndex, now, result)
+                       for wordId, repeatIndex, result in zip(wordIds, columns[0], results)]
+
+    # Whole submission is one transaction with a fixed number of round trips
+    async with conn.transaction():
+        if reviewedRows:
+            # before the rows: the version lock is always taken ahead of words row locks
+            await wordstore.lockVersions(conn, userId)
+            await conn.execute("""
+                UPDATE words AS w
+                SET repeatindex = u.repeatindex,
+                    ease = u.ease,
+                    stability = u.stability,
+                    difficulty = u.difficulty,
+                    lapses = u.lapses,
+                    lastrepeattime = u.lastrepeattime,
+                    nextrepeattime = u.nextrepeattime,
+                    weight = u.weight
+                FROM unnest($1::bigint[], $2::int[], $3::float8[], $4::float8[], $5::float8[], $6::int[],
+                            $7::timestamp[], $8::timestamp[], $9::float8[])
+                    AS u(word_id, repeatindex, ease, stability, difficulty, lapses, lastrepeattime, nextrepeattime, weight)
+                WHERE w.word_id = u.word_id AND w.user_id = $10
+            """, wordIds, *columns, weights.tolist(), userId)
+
+            if not historyQueue.enabled:
+                await conn.execute("""
+                    INSERT INTO words_history (user_id, word_id, repeatindex, repeatdate, success)
+                    SELECT $4, u.word_id, u.repeatindex, $5, u.success
+                    FROM unnest($1::bigint[], $2::int[], $3::bool[]) AS u(word_id, repeatindex, success)
+                """, wordIds, columns[0], results, userId, now)
+
+        if newWords:
+            # new rows reach the word store through the words_changed notifications
+            await conn.executemany(
+                # as in /addWord: a word the learner already has is skipped, a concurrent
+                # submission of the same word is settled by the unique index
+                """
+                INSERT INTO words (user_id, translation, partofspeech, word, example, nextrepeattime)
+                SELECT $1::bigint, $2::text, $3::text, $4::text, $5::text, NOW()
+                WHERE NOT EXISTS (SELECT 1 FROM words WHERE user_id = $1::bigint AND word = $4::text)
+                ON CONFLICT DO NOTHING
+                """,
+                [(userId, w["translation"], w["partOfSpeech"].replace(".", ""), w["word"], w["example"]) for w in newWords])
+
+    store = wordStores.peek(userId)
+    if reviewedRows and store is not None:
+        store.updateState(wordIds, columns[0], state.nextRepeatTime, weights)
+    return history
 
 
 @app.route('/repeatWords', methods=['POST', 'GET'])
 async def repeatWords():  # put application's code here
 
     _checkDatabase()
-    words = await _loadDatabase()
 
     if request.method == 'POST':
-        json_data = json.loads(request.get_data().decode('utf-8'))
+        json_data = json.loads((await request.get_data()).decode('utf-8'))
+        resultState = json_data["resultState"]
+        words = await _loadWordsByIds(g.userId, [int(wordId) for wordId in resultState] if type(resultState) == dict else [])
         await _updateWordsInDatabaseAndSave(
-            json_data["resultState"],
+            g.userId,
+            resultState,
             words,
             json_data["decreaseRepeatIndexOnly"] if "decreaseRepeatIndexOnly" in json_data else False,
             json_data["decreaseRepeatIndexOnly"] if "decreaseRepeatIndexOnly" in json_data else False
         )
+        await _forgetUser(g.userId)
 
-        return json.dumps({"success": True})
-
-    _checkInput(words)
+        return responses.json({"success": True})
 
-    words2repeat = _selectRepeatWords(words)
+    try:
+        words2repeat = await repeatWordsFlight.do((g.userId,), _selectRepeatWords, g.userId)
+        index = await _getDistractorIndex(g.userId)
+    except Exception as e:
+        log.error("Ошибка: %s", e)
+        words2repeat, index = [], distractors.DistractorIndex()
 
-    firstStage = _generateFirstStage(words, words2repeat)
+    firstStage, options = _generateFirstStage(index, words2repeat)
 
-    res = json.dumps({
+    res = responses.dumps({
         "firstStage": firstStage,
-        "words": words2repeat
+        "words": words2repeat,
+        "options": list(options.values())
     })
-    print(res)
-    return res
-
-@app.route('/generate_text', methods=['POST'])
-async def generate_text():  # put application's code here
+    log.debug("repeatWords: %s", res)
+    return Response(res, mimetype='application/json')
 
-    _checkDatabase()
-    words = await _loadDatabase()
 
-    """
-        Генерирует текст с использованием изучаемых слов через DeepSeek API
-        """
-    # Get generation settings from request
-    json_data = json.loads(request.get_data().decode('utf-8'))
+# Поля настроек /generate_text в порядке ключа пула текстов
+_TEXT_SETTINGS = (
+    ('textLength', 250),  # default 250 words
+    ('level', 'B1'),  # default B1
+    ('style', 'повествовательный'),
+    ('textType', 'общий'),
+    ('topic', '')  # optional topic
+)
 
-    text_length = json_data.get('textLength', 250)  # default 250 words
-    level = json_data.get('level', 'B1')  # default B1
-    style = json_data.get('style', 'повествовательный')
-    text_type = json_data.get('textType', 'общий')
-    topic = json_data.get('topic', '')  # optional topic
 
-    # Выбираем слова с наибольшим весом
-    config = dict()
-    with open("config.json") as f:
-        config = json.loads(f.read())
+def _textPoolKey(userId, json_data):
+    # тексты собираются из слов пользователя, поэтому пул у каждого свой
+    return (userId,) + tuple(json_data.get(name, default) for name, default in _TEXT_SETTINGS)
 
-    probabilities = []
-    ids = set()
-    su = 0
-    for w in words:
-        ids.add(w['wordId'])
-        su += w.get('weight', 1.0)
 
-    for w in words:
-        probabilities.append(w.get('weight', 1.0) / (su))
+async def _generateText(key, endpoint="generate_text"):
+    """
+    Генерирует текст с использованием изучаемых слов через DeepSeek API.
+    Возвращает (текст для ответа, {wordId: вес слова на момент генерации})
+    или None, если слов недостаточно. endpoint - бюджет и приоритет запроса к LLM
+    (фоновое пополнение пула идет как "text_pool" и не тратит бюджет пользователя).
+    """
+    userId, text_length, level, style, text_type, topic = key
 
-    selected_words = np.random.choice(words, size=10, p=probabilities, replace=False)
+    # Выбираем слова с наибольшим весом
+    try:
+        store = await wordStores.ensureLoaded(userId)
+        selected_words = store.sampleWords(10)
+    except Exception as e:
+        log.error("Ошибка: %s", e)
+        selected_words = []
     EXACT_MEANING = False
 
     def returnWordString(w):
         res = ''
-        res += w['word']
+        res += w.word
         if EXACT_MEANING:
-            res += w['translation'] + "|"
+            res += w.translation + "|"
         return res
 
     top_words = [returnWordString(w) for w in selected_words]
 
     if not top_words:
-        return json.dumps({"success": False, "error": "Недостаточно слов для генерации текста."}), 400
+        return None
 
     words_formated = ",".join(top_words)
 
@@ -375,23 +428,19 @@ async def generate_text():  # put application's code here
     "RightIndeces": Массив индексов правильных ответов в порядке, в котором они расположены в списке, отчет начинается с нуля. int[]
     """
 
-    print("Prompt:", prompt)
-
-    client = OpenAI(api_key='sk-c2efe9ecf3044357b7c0272efaf39d51', base_url="https://api.deepseek.com")
+    log.debug("Prompt: %s", prompt)
 
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system",
-             "content": "Ты опытный преподаватель английского языка, поэтому ищешь индивидуальный подход к каждому ученику, анализируя его сильные и слабые стороны, предлагаешь такие задание, чтобы изучение английского шло максимально эффективно."},
-            {"role": "user", "content": prompt},
-        ],
+    content = await llm.complete(
+        endpoint,
+        prompt,
+        # refills nobody asked for yet are limited by the text_pool bucket alone,
+        # the learner's own budget is left for their requests
+        userId=None if endpoint == "text_pool" else userId,
         max_tokens=text_length * 2,
-        temperature=config['text_generation']['temperature'],
-        stream=False
+        temperature=config.textGeneration.temperature
     )
 
-    content = response.choices[0].message.content.replace("`", "").replace("json", "").replace("JSON", "")
+    content = content.replace("`", "").replace("json", "").replace("JSON", "")
     parsed = json.loads(content)
 
     text = parsed['Text']
@@ -401,7 +450,7 @@ async def generate_text():  # put application's code here
     for ans in parsed['RightAnswers']:
         text = text.replace(ans, '<>', 1)
         word = selected_words[parsed['RightIndeces'][iteration]]
-        identifiers.append(word['wordId'])
+        identifiers.append(word.wordId)
         iteration += 1
 
     wordsInText = [w for w in parsed['RightAnswers']]
@@ -415,222 +464,557 @@ async def generate_text():  # put application's code here
     del parsed['RightIndeces']
     del parsed['Text']
 
-    return parsed
+    return parsed, {w.wordId: w.weight for w in selected_words}
+
+
+def _currentWeight(key, wordId):
+    # an evicted dictionary counts as changed: its pooled texts are dropped
+    store = wordStores.peek(key[0])
+    slot = None if store is None else store.slotOf(wordId)
+    return None if slot is None else float(store.weights[slot])
+
+
+textPool = textpool.TextPool(lambda key: _generateText(key, "text_pool"), _currentWeight, config.get('text_pool'))
+explanationCache = explaincache.ExplanationCache(config.get('explanation_cache'))
+
+
+@app.route('/generate_text', methods=['POST'])
+async def generate_text():  # put application's code here
+
+    _checkDatabase()
+
+    # Get generation settings from request
+    json_data = json.loads((await request.get_data()).decode('utf-8'))
+    key = _textPoolKey(g.userId, json_data)
+
+    # Готовый текст из пула, иначе генерируем прямо в запросе
+    parsed = await textPool.take(key)
+    if parsed is not None:
+        return responses.json(parsed)
+
+    started = time.perf_counter()
+    # double clicks with the same settings wait for one generation (pool refills are separate)
+    try:
+        generated = await textFlight.do(key, _generateText, key)
+    except llm.Rejected as e:
+        return _rejected(e)
+    textpool.GENERATION_SECONDS.observe(time.perf_counter() - started, source="request")
+    if generated is None:
+        return responses.error("Недостаточно слов для генерации текста.", 400)
+
+    return responses.json(generated[0])
 
 @app.route('/checkText', methods=['POST'])
 async def check_text():
-    json_data = json.loads(request.get_data().decode('utf-8'))
+    json_data = json.loads((await request.get_data()).decode('utf-8'))
     text = json_data['text']
     rightAnswers = json_data['rightAnswers']
     userAnswers = json_data['userAnswers']
 
+    # Объяснение каждой ошибки кешируется отдельно, в LLM уходят только новые
+    mistakes = explaincache.findMistakes(rightAnswers, userAnswers)
+    keys = [explaincache.mistakeKey(text, i, right, user) for i, right, user in mistakes]
+    cached = await explanationCache.getMany(keys)
+    pending = [(mistake, key) for mistake, key in zip(mistakes, keys) if key not in cached]
+
+    prompt = _explainPrompt(text, [mistake for mistake, _ in pending]) if pending else None
+    pendingKeys = [key for _, key in pending]
+
+    if json_data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        chunks = _explainStream(keys, cached, prompt, pendingKeys, g.userId)
+        return Response(_sse(chunks), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+    content = None
+    if prompt is not None:
+        try:
+            content = await llm.complete("check_text", prompt, userId=g.userId,
+                                         temperature=config.textGeneration.temperature)
+        except llm.Rejected as e:
+            return _rejected(e)
+        fresh = _splitExplanations(content, pendingKeys)
+        if fresh is not None:
+            cached.update(fresh)
+            await explanationCache.putMany(fresh)
+            content = None
+
+    explanations = [cached[key] for key in keys if key in cached]
+    if content is not None:
+        explanations.append(content)
+    return {
+        "ai_explain": "\n".join(explanations)
+    }
+
+
+def _rejected(e):
+    # the LLM budget or queue is full: a clear error right away instead of a slow response
+    return responses.error(str(e), 503, {"Retry-After": str(max(1, math.ceil(e.retryAfter)))})
+
+
+def _explainPrompt(text, mistakes):
+    mistakesList = "\n".join(
+        f'{n}. Пропуск {i + 1}: правильный ответ "{right}", ответ пользователя "{user}"'
+        for n, (i, right, user) in enumerate(mistakes, 1))
+
     prompt = f"""
         Тебе нужно проверить тестовое задание по английскому языку, в котором нужно прочитать текст и заполнить пропущенные слова, выбрав правильный вариант из списка слов.
         Вот тестовое задание, пропуски отмечены символами <>: {text}
-        Вот правильные ответы по порядку для каждого пропуска: {",".join(rightAnswers)}
-        Вот ответы, данные пользователем по порядку для каждого пропуска: {",".join(userAnswers)}
-        Проанализируй текст, правильные ответы и ответы пользователя, если пользователь ошибся, то объясни в чем заключается его ошибка. Каждую ошибку отделяй символом \n (начинай обозревать с новой строки.) Если слово в ошибке используется во фразовом глаголе, либо устойчивом выражении обязательно это обозначь, а также объясни смысл этого выражения/фразового глагола. Обращай внимание на грамматику, если вставка слова нелогична из-за грамматических норм, объясняй почему так. Не делай объяснение слишком сухим, не ограничивайся только переводом, в то же время, не делай объяснение слишком громоздким. В твоем ответе не должно быть вводных фраз, похвал, только обзор ошибок.
+        Вот ошибки пользователя (номер пропуска считается с единицы):
+{mistakesList}
+        Объясни каждую ошибку из списка, в чем она заключается. Объяснение каждой ошибки пиши ровно одной строкой, без переносов строки внутри и без нумерации, строки в том же порядке, что и ошибки в списке. Если слово в ошибке используется во фразовом глаголе, либо устойчивом выражении обязательно это обозначь, а также объясни смысл этого выражения/фразового глагола. Обращай внимание на грамматику, если вставка слова нелогична из-за грамматических норм, объясняй почему так. Не делай объяснение слишком сухим, не ограничивайся только переводом, в то же время, не делай объяснение слишком громоздким. В твоем ответе не должно быть вводных фраз, похвал, только обзор ошибок.
 """
 
-    print("Prompt:", prompt)
+    log.debug("Prompt: %s", prompt)
+    return prompt
 
-    client = OpenAI(api_key='sk-c2efe9ecf3044357b7c0272efaf39d51', base_url="https://api.deepseek.com")
 
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system",
-             "content": "Ты опытный преподаватель английского языка, поэтому ищешь индивидуальный подход к каждому ученику, анализируя его сильные и слабые стороны, предлагаешь такие задание, чтобы изучение английского шло максимально эффективно."},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=config['text_generation']['temperature'],
-        stream=False
-    )
+def _splitExplanations(content, pendingKeys):
+    """
+    {ключ ошибки: объяснение}, если модель вернула ровно по строке на ошибку, иначе None.
+    """
+    lines = [line.strip() for line in content.split("\n") if line.strip()]
+    if len(lines) != len(pendingKeys):
+        return None
+    return dict(zip(pendingKeys, lines))
+
+
+async def _explainStream(keys, cached, prompt, pendingKeys, userId):
+    # cached explanations go out immediately, then the model's tokens as they arrive
+    for key in keys:
+        if key in cached:
+            yield cached[key] + "\n"
+    if prompt is None:
+        return
+
+    received = []
+    async for chunk in llm.stream("check_text", prompt, userId=userId,
+                                  temperature=config.textGeneration.temperature):
+        received.append(chunk)
+        yield chunk
+
+    fresh = _splitExplanations("".join(received), pendingKeys)
+    if fresh is not None:
+        await explanationCache.putMany(fresh)
+
+
+async def _sse(chunks):
+    """
+    Server-Sent Events: data-событие на каждый фрагмент ответа, затем event: done.
+    """
+    try:
+        async for chunk in chunks:
+            yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: {}\n\n"
+    except Exception as e:
+        log.error("Error streaming explanation: %s", e)
+        yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+
+async def _jsonArray(store):
+    if store is None:
+        yield b"[]"
+        return
+    separator = b"["
+    for batch in store.iterWords():
+        if batch:
+            yield separator + b",".join(responses.dumps(word) for word in batch)
+            separator = b","
+    yield b"]" if separator == b"," else b"[]"
+
+
+async def _ndjson(rows, fields):
+    lines = []
+    async for row in rows:
+        lines.append(responses.dumps(wordquery.project(row, fields)))
+        if len(lines) >= 500:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def _readWordChanges(conn, userId, since):
+    """
+    (версия, слова, id удаленных, reset) - изменения словаря после версии since одним
+    снимком базы. Если удаленные после since уже вычищены (retention.py), reset=True
+    и отдается весь словарь.
+    """
+    async with conn.transaction(isolation='repeatable_read', readonly=True):
+        version = await wordstore.readVersion(conn, userId)
+        horizon = await conn.fetchval("SELECT version FROM words_deleted_horizon") or 0
+        if since < horizon:
+            rows = await conn.fetch(f"SELECT {wordstore.COLUMNS} FROM words WHERE user_id = $1", userId)
+            return version, rows, [], True
+        rows, deleted = await snapshot.readChanges(conn, userId, since, wordstore.COLUMNS)
+        return version, rows, deleted, False
+
+
+async def _wordChanges(store, since):
+    """
+    /getWords?since=<version>: слова, добавленные или измененные после версии since,
+    и id удаленных; "version" ответа - since для следующего запроса. Если словарь
+    в памяти не новее since, база не читается. Версии пользователя идут в порядке
+    фиксации (schema migration 5), поэтому изменение, не зафиксированное к ответу,
+    получит версию больше "version" и придет в следующем запросе.
+    """
+    userId = g.userId
+    if since >= store.version:
+        WORD_SYNC.inc(result="unchanged")
+        return {"version": since, "reset": False, "words": [], "deleted": []}
 
-    content = response.choices[0].message.content
+    version, rows, deleted, reset = await database.run(_readWordChanges, userId, since)
+    WORD_SYNC.inc(result="reset" if reset else "delta")
     return {
-        "ai_explain": content
+        "version": version,
+        "reset": reset,
+        "words": [wordstore.Word.fromRow(row) for row in rows],
+        "deleted": deleted
     }
 
+
 @app.route('/getWords', methods=['GET'])
 async def get_words():
+    """
+    Без параметров - весь словарь JSON-массивом (как раньше, но потоком).
+    since=<версия> - только изменения после нее: {"version", "reset", "words", "deleted"}.
+    С параметрами - страница {"words", "next"} по keyset-курсору after=word_id
+    с фильтрами due, pos, minWeight/maxWeight, q и проекцией fields;
+    format=ndjson - выгрузка всех подходящих слов построчно через курсор БД.
+    Ответы без due и ndjson несут ETag версии словаря; If-None-Match с ним - 304 без запроса к базе.
+    """
     _checkDatabase()
-    words = await _loadDatabase()
+    if set(request.args) <= {'user_id'}:
+        store = await _loadDatabase(g.userId)
+        if store is None:
+            return Response(_jsonArray(store), mimetype='application/json')
+        tag = responses.etag("words", g.userId, store.version)
+        if request.if_none_match.contains_weak(tag):
+            return responses.notModified(tag)
+        return responses.tagged(Response(_jsonArray(store), mimetype='application/json'), tag)
+
+    if 'since' in request.args:
+        if not set(request.args) <= {'user_id', 'since'}:
+            return responses.error("Parameter 'since' cannot be combined with other parameters", 400)
+        try:
+            since = int(request.args['since'])
+        except ValueError:
+            return responses.error("Parameter 'since' must be a number", 400)
+        store = await _loadDatabase(g.userId)
+        if store is None:
+            return responses.error("Words are not available", 500)
+        tag = responses.etag("words", g.userId, store.version)
+        if request.if_none_match.contains_weak(tag):
+            return responses.notModified(tag)
+        try:
+            changes = await _wordChanges(store, since)
+        except Exception as e:
+            log.error("Error loading word changes: %s", e)
+            return responses.error(str(e), 500)
+        return responses.tagged(responses.json(changes), tag)
 
-    return words
+    try:
+        query = wordquery.parseArgs(request.args)
+    except ValueError as e:
+        return responses.error(str(e), 400)
+    defaultWeight = config.textGeneration.defaultWeight
+
+    if request.args.get('format') == 'ndjson':
+        sql, params = wordquery.build(query, g.userId, defaultWeight, paged=False)
+        return Response(_ndjson(database.cursor(sql, *params), query.fields), mimetype='application/x-ndjson')
+
+    # due pages depend on the time of the request, not only on the dictionary
+    store = wordStores.peek(g.userId)
+    tag = None
+    if not query.due and store is not None and store.loaded:
+        tag = responses.etag("words", g.userId, store.version)
+        if request.if_none_match.contains_weak(tag):
+            return responses.notModified(tag)
+
+    sql, params = wordquery.build(query, g.userId, defaultWeight)
+    try:
+        # the query parameters include "now", so the flight key is the request itself; a page
+        # reused from before the dictionary's version moved on is never sent under the newer ETag
+        key = (g.userId, tag) + tuple(sorted(request.args.items(multi=True)))
+        rows = await wordsFlight.do(key, _fetch, sql, *params)
+    except Exception as e:
+        log.error("Error loading words: %s", e)
+        return responses.error(str(e), 500)
+
+    page = rows[:query.limit]
+    response = responses.json({
+        "words": [wordquery.project(row, query.fields) for row in page],
+        "next": page[-1]["word_id"] if len(rows) > query.limit else None
+    })
+    return response if tag is None else responses.tagged(response, tag)
 
 
 @app.route('/addWord', methods=['POST'])
 async def add_word():
-    json_data = json.loads(request.get_data().decode('utf-8'))
+    json_data = json.loads((await request.get_data()).decode('utf-8'))
 
     word = json_data.get('word', '').strip().lower()
     translation = json_data.get('translation', '').strip()
     examples = json_data.get('examples', [])
 
     if not word or not translation:
-        return json.dumps({"success": False, "error": "Word and translation are required"}), 400
+        return responses.error("Word and translation are required", 400)
+
+    userId = g.userId
+
+    async def insertWord(conn):
+        # existing words are skipped in the same statement, nothing is returned for them
+        return await conn.fetchrow(f"""
+            INSERT INTO words (user_id, word, translation, example, nextrepeattime, repeatindex, weight)
+            SELECT $5::bigint, $1::text, $2::text, $3::text, NOW(), 0, $4::float8
+            WHERE NOT EXISTS (SELECT 1 FROM words WHERE user_id = $5::bigint AND word = $1::text)
+            ON CONFLICT DO NOTHING
+            RETURNING {wordstore.COLUMNS}
+        """, word, translation, json.dumps(examples) if examples else None, config.textGeneration.defaultWeight, userId)
 
     try:
-        conn = await asyncpg.connect(
-            database="English",
-            user="nice",
-            password="nice",
-            host="localhost",
-            port=5432
-        )
+        row = await database.run(insertWord)
+        if row is None:
+            return responses.error("Word already exists", 400)
 
-        # Check if word already exists
-        existing = await conn.fetchrow("SELECT word_id FROM words WHERE word = $1", word)
-        if existing:
-            await conn.close()
-            return json.dumps({"success": False, "error": "Word already exists"}), 400
-
-        # Insert new word
-        await conn.fetchval(
-            "INSERT INTO words (word, translation, example, nextrepeattime, repeatindex, weight) VALUES ($1, $2, $3, NOW(), 0, $4)",
-            word,
-            translation,
-            json.dumps(examples) if examples else None,
-            config['text_generation']['default_weight']
-        )
+        store = wordStores.peek(userId)
+        if store is not None:
+            store.upsertRows([row])
+        await _forgetUser(userId)
 
-        await conn.close()
-        return json.dumps({"success": True})
+        return responses.json({"success": True})
 
     except Exception as e:
-        print(f"Error adding word: {e}")
-        return json.dumps({"success": False, "error": str(e)}), 500
+        log.error("Error adding word: %s", e)
+        return responses.error(str(e), 500)
+
+
+@app.route('/importWords', methods=['POST'])
+async def import_words():
+    """
+    Массовый импорт: тело запроса - CSV, TSV или строки input.txt
+    ("word (pos) = translation; example"), читается и разбирается потоком
+    до того, как занимается соединение с базой.
+    """
+    try:
+        format = wordimport.detectFormat(request.args.get('format'), request.content_type,
+                                         request.args.get('filename', ''))
+    except ValueError as e:
+        return responses.error(str(e), 400)
+
+    upload = await wordimport.read(wordimport.parse(request.body, format))
+    try:
+        report, inserted = await database.run(wordimport.importWords, upload, g.userId,
+                                              config.textGeneration.defaultWeight)
+    except Exception as e:
+        log.error("Error importing words: %s", e)
+        return responses.error(str(e), 500)
+
+    store = wordStores.peek(g.userId)
+    if store is not None:
+        store.upsertRows(inserted)
+    await _forgetUser(g.userId)
+    return responses.json(report)
 
 
 @app.route('/deleteWord/<int:word_id>', methods=['DELETE'])
 async def delete_word(word_id):
-    try:
-        conn = await asyncpg.connect(
-            database="English",
-            user="nice",
-            password="nice",
-            host="localhost",
-            port=5432
-        )
+    userId = g.userId
 
-        # Check if word exists
-        existing = await conn.fetchrow("SELECT word_id FROM words WHERE word_id = $1", word_id)
-        if not existing:
-            await conn.close()
-            return json.dumps({"success": False, "error": "Word not found"}), 404
+    async def removeWord(conn):
+        async with conn.transaction():
+            await wordstore.lockVersions(conn, userId)
+            # History first, including days compacted by retention.py; both are the learner's own rows only
+            await conn.execute("DELETE FROM words_history WHERE user_id = $2 AND word_id = $1", word_id, userId)
+            await conn.execute("DELETE FROM words_history_daily WHERE user_id = $2 AND word_id = $1", word_id, userId)
 
-        # Delete from history first (foreign key constraint)
-        await conn.execute("DELETE FROM words_history WHERE word_id = $1", word_id)
+            # Another learner's word is "not found" as well, and nothing above touched it
+            return await conn.fetchval(
+                "DELETE FROM words WHERE word_id = $1 AND user_id = $2 RETURNING word_id", word_id, userId) is not None
 
-        # Delete word
-        await conn.execute("DELETE FROM words WHERE word_id = $1", word_id)
+    try:
+        if not await database.run(removeWord):
+            return responses.error("Word not found", 404)
+
+        store = wordStores.peek(userId)
+        if store is not None:
+            store.remove(word_id)
+        await _forgetUser(userId)
 
-        await conn.close()
-        return json.dumps({"success": True})
+        return responses.json({"success": True})
 
     except Exception as e:
-        print(f"Error deleting word: {e}")
-        return json.dumps({"success": False, "error": str(e)}), 500
+        log.error("Error deleting word: %s", e)
+        return responses.error(str(e), 500)
+
+
+async def _fetch(query, *args):
+    return await database.run(lambda conn: conn.fetch(query, *args))
+
+
+_STATISTICS = {
+    # concurrent /getStatistics reads of all learners
+    "max_concurrency": 2,
+    # pooled connections one read spreads its queries over; the pool must have more
+    # than max_concurrency * (connections_per_read - 1) connections
+    "connections_per_read": 2,
+    # concurrent reads of one learner; waiting learners get freed slots in turn
+    "max_per_user": 1,
+    # seconds; one learner with a huge history must not hold connections for long
+    "statement_timeout": 5.0
+}
+_STATISTICS.update(config.get('statistics', {}))
+_statisticsSlots = fairslots.FairSlots(_STATISTICS['max_concurrency'], _STATISTICS['max_per_user'])
+metrics.gauge("statistics_reads_waiting", "/getStatistics reads waiting for a connection slot", _statisticsSlots.waiting)
+
+
+# (method, query, whether $2 is today) of every /getStatistics value, in the order
+# of the response tuple; $1 is the learner
+_STATISTICS_QUERIES = [
+    # Versions of the dictionary and the history the statistics are computed from
+    ("fetchval", wordstore.VERSION_QUERY, False),
+    ("fetchval", historyversions.VERSION_QUERY, False),
+
+    # Total repetitions
+    ("fetchval", "SELECT COALESCE(SUM(repetitions), 0)::BIGINT FROM history_daily WHERE user_id = $1", False),
+
+    # Repetitions by day (last 30 days)
+    ("fetch", """
+        SELECT day AS date, repetitions AS count
+        FROM history_daily
+        WHERE user_id = $1 AND day >= (NOW() - INTERVAL '30 days')::date
+        ORDER BY day
+    """, False),
+
+    # Top repeated words
+    ("fetch", """
+        SELECT w.word, w.translation, h.repetitions
+        FROM history_word h
+        JOIN words w ON w.word_id = h.word_id
+        WHERE h.user_id = $1
+        ORDER BY h.repetitions DESC
+        LIMIT 10
+    """, False),
+
+    # Distribution by repeat index
+    ("fetch", """
+        SELECT repeatindex, repetitions AS count
+        FROM history_index
+        WHERE user_id = $1
+        ORDER BY repeatindex
+    """, False),
+
+    # Current streak: consecutive days up to today with at least one repetition
+    ("fetchval", """
+        SELECT COUNT(*)
+        FROM (
+            SELECT day, ROW_NUMBER() OVER (ORDER BY day DESC) AS n
+            FROM history_daily
+            WHERE user_id = $1 AND day <= $2
+        ) AS days
+        WHERE day = $2 - (n - 1)::int
+    """, True),
+
+    # Total unique words practiced
+    ("fetchval", "SELECT COUNT(*) FROM history_word WHERE user_id = $1", False),
+
+    # Average repetitions per day (last 30 days)
+    ("fetchval", """
+        SELECT AVG(repetitions)::FLOAT
+        FROM history_daily
+        WHERE user_id = $1 AND day >= (NOW() - INTERVAL '30 days')::date
+    """, False),
+
+    # Upcoming repetitions by day (next 30 days)
+    ("fetch", """
+        SELECT
+            DATE(CASE WHEN nextrepeattime < NOW() THEN NOW() ELSE nextrepeattime END) as date,
+            COUNT(*) as count,
+            ARRAY_AGG(word ORDER BY word) as words
+        FROM words
+        WHERE user_id = $1 AND nextrepeattime < CURRENT_DATE + INTERVAL '30 days'
+        GROUP BY DATE(CASE WHEN nextrepeattime < NOW() THEN NOW() ELSE nextrepeattime END)
+        ORDER BY date
+    """, False),
+]
+
+
+async def _runStatisticsQueries(conn, indexes, userId, today):
+    results = {}
+    for index in indexes:
+        method, query, withToday = _STATISTICS_QUERIES[index]
+        results[index] = await getattr(conn, method)(query, *((userId, today) if withToday else (userId,)))
+    return results
+
+
+async def _readStatisticsPart(conn, snapshotId, indexes, userId, today):
+    # a helper connection sees exactly the snapshot of the first one
+    async with conn.transaction(isolation='repeatable_read', readonly=True):
+        await conn.execute(f"SET TRANSACTION SNAPSHOT '{snapshotId}'")
+        await conn.execute(f"SET LOCAL statement_timeout = {int(_STATISTICS['statement_timeout'] * 1000)}")
+        return await _runStatisticsQueries(conn, indexes, userId, today)
+
+
+async def _readStatistics(conn, userId, today):
+    # one read-only snapshot, every query bounded by statement_timeout; the queries are
+    # spread over connections_per_read connections that share the snapshot (pg_export_snapshot)
+    async with conn.transaction(isolation='repeatable_read', readonly=True):
+        await conn.execute(f"SET LOCAL statement_timeout = {int(_STATISTICS['statement_timeout'] * 1000)}")
+        connections = max(1, min(_STATISTICS['connections_per_read'], len(_STATISTICS_QUERIES)))
+        parts = [range(part, len(_STATISTICS_QUERIES), connections) for part in range(connections)]
+        helpers = []
+        if connections > 1:
+            snapshotId = await conn.fetchval("SELECT pg_export_snapshot()")
+            helpers = [database.run(_readStatisticsPart, snapshotId, part, userId, today) for part in parts[1:]]
+        # every part is waited for, so no helper is still reading when the snapshot goes away
+        parts = await asyncio.gather(_runStatisticsQueries(conn, parts[0], userId, today), *helpers,
+                                     return_exceptions=True)
+        results = {}
+        for part in parts:
+            if isinstance(part, BaseException):
+                raise part
+            results.update(part)
+        return tuple(results[index] for index in range(len(_STATISTICS_QUERIES)))
+
+
+async def _statistics(userId, today):
+    # At most max_concurrency reads use the pool at once and max_per_user of them
+    # for one learner, the rest wait here
+    async with _statisticsSlots.hold(userId):
+        return await database.run(_readStatistics, userId, today)
+
+
+def _statisticsTag(userId, today):
+    # ETag of the statistics the database would return now, if this worker knows both versions
+    store = wordStores.peek(userId)
+    historyVersion = historyVersions.get(userId)
+    if store is None or not store.loaded or historyVersion is None:
+        return None
+    return responses.etag("statistics", userId, store.version, historyVersion, today)
 
 
 @app.route('/getStatistics', methods=['GET'])
 async def get_statistics():
-    try:
-        conn = await asyncpg.connect(
-            database="English",
-            user="nice",
-            password="nice",
-            host="localhost",
-            port=5432
-        )
-
-        # Total repetitions
-        total_reps = await conn.fetchval("SELECT COUNT(*) FROM words_history")
-
-        # Repetitions by day (last 30 days)
-        reps_by_day = await conn.fetch("""
-            SELECT
-                DATE(repeatdate) as date,
-                COUNT(*) as count
-            FROM words_history
-            WHERE repeatdate >= NOW() - INTERVAL '30 days'
-            GROUP BY DATE(repeatdate)
-            ORDER BY date
-        """)
-
-        # Top repeated words
-        top_words = await conn.fetch("""
-            SELECT
-                w.word,
-                w.translation,
-                COUNT(*) as repetitions
-            FROM words_history wh
-            JOIN words w ON wh.word_id = w.word_id
-            GROUP BY w.word_id, w.word, w.translation
-            ORDER BY repetitions DESC
-            LIMIT 10
-        """)
-
-        # Distribution by repeat index
-        index_distribution = await conn.fetch("""
-            SELECT
-                repeatindex,
-                COUNT(*) as count
-            FROM words_history
-            GROUP BY repeatindex
-            ORDER BY repeatindex
-        """)
-
-        # Current streak (consecutive days)
-        streak_data = await conn.fetch("""
-            SELECT DISTINCT DATE(repeatdate) as date
-            FROM words_history
-            ORDER BY date DESC
-        """)
-
-        # Calculate streak
-        current_streak = 0
-        if streak_data:
-            today = datetime.datetime.now().date()
-            for i, row in enumerate(streak_data):
-                expected_date = today - datetime.timedelta(days=i)
-                if row['date'] == expected_date:
-                    current_streak += 1
-                else:
-                    break
-
-        # Total unique words practiced
-        unique_words = await conn.fetchval("""
-            SELECT COUNT(DISTINCT word_id) FROM words_history
-        """)
-
-        # Average repetitions per day (last 30 days)
-        avg_per_day = await conn.fetchval("""
-            SELECT AVG(daily_count)::FLOAT
-            FROM (
-                SELECT DATE(repeatdate), COUNT(*) as daily_count
-                FROM words_history
-                WHERE repeatdate >= NOW() - INTERVAL '30 days'
-                GROUP BY DATE(repeatdate)
-            ) as daily_stats
-        """)
-
-        # Upcoming repetitions by day (next 30 days)
-        upcoming_reps = await conn.fetch("""
-            SELECT
-                DATE(CASE WHEN nextrepeattime < NOW() THEN NOW() ELSE nextrepeattime END) as date,
-                COUNT(*) as count,
-                ARRAY_AGG(word ORDER BY word) as words
-            FROM words
-            WHERE DATE(nextrepeattime) < CURRENT_DATE + INTERVAL '30 days'
-            GROUP BY DATE(CASE WHEN nextrepeattime < NOW() THEN NOW() ELSE nextrepeattime END)
-            ORDER BY date
-        """)
-
-        await conn.close()
+    """
+    Статистика повторений; ETag - версии словаря и истории и текущий день.
+    If-None-Match с актуальным ETag - 304 без запроса к базе, если версии известны процессу.
+    """
+    today = datetime.datetime.now().date()
+    tag = _statisticsTag(g.userId, today)
+    if tag is not None and request.if_none_match.contains_weak(tag):
+        return responses.notModified(tag)
 
-        return json.dumps({
+    try:
+        # subscribed before the read, so the version read below is kept up to date
+        await historyVersions.listen()
+        # Everything except upcoming repetitions is read from the per-learner history_* rollups
+        (words_version, history_version, total_reps, reps_by_day, top_words, index_distribution,
+         current_streak, unique_words, avg_per_day, upcoming_reps) = await statisticsFlight.do(
+            (g.userId, today), _statistics, g.userId, today)
+        historyVersions.remember(g.userId, history_version)
+
+        tag = responses.etag("statistics", g.userId, words_version, history_version, today)
+        if request.if_none_match.contains_weak(tag):
+            return responses.notModified(tag)
+        return responses.tagged(responses.json({
             "totalRepetitions": total_reps,
             "repetitionsByDay": [{"date": str(row['date']), "count": row['count']} for row in reps_by_day],
             "topWords": [{"word": row['word'], "translation": row['translation'], "repetitions": row['repetitions']} for row in top_words],
@@ -639,12 +1023,110 @@ async def get_statistics():
             "uniqueWords": unique_words,
             "averagePerDay": round(avg_per_day, 1) if avg_per_day else 0,
             "upcomingRepetitions": [{"date": str(row['date']), "count": row['count'], "words": row['words']} for row in upcoming_reps]
-        })
+        }), tag)
 
     except Exception as e:
-        print(f"Error getting statistics: {e}")
-        return json.dumps({"success": False, "error": str(e)}), 500
+        log.error("Error getting statistics: %s", e)
+        return responses.error(str(e), 500)
+
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.before_request
+async def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.before_request
+async def identify_user():
+    """
+    Пользователь запроса: заголовок X-User-Id или параметр user_id, без них - пользователь 1.
+    Проверка, что клиент действительно этот пользователь, - задача прокси перед приложением.
+    """
+    value = request.headers.get('X-User-Id') or request.args.get('user_id')
+    if not value:
+        g.userId = wordstore.DEFAULT_USER_ID
+        return None
+    try:
+        g.userId = int(value)
+    except ValueError:
+        g.userId = 0
+    if g.userId <= 0:
+        return responses.error("User id must be a positive integer", 400)
+    return None
+
+
+@app.after_request
+async def observe_latency(response):
+    started = g.get("started")
+    if started is not None:
+        rule = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                route=rule, method=request.method, status=response.status_code)
+    return response
+
+
+# registered after observe_latency so that it runs first and compression counts in the latency
+@app.after_request
+async def compress_response(response):
+    return await responses.encode(response, request.headers.get('Accept-Encoding'))
+
+
+_PROFILING = dict(profiler.DEFAULT_SETTINGS)
+_PROFILING.update(config.get('profiling', {}))
+
+if _PROFILING['enabled']:
+    _profiling = False
+
+    @app.route('/debug/profile', methods=['GET'])
+    async def get_profile():
+        """
+        Профиль процесса за ?seconds=N (collapsed stacks для flamegraph.pl / speedscope).
+        """
+        global _profiling
+        if _profiling:
+            return responses.error("Profiling is already running", 409)
+
+        # get() returns None for a value that is not a number
+        seconds = request.args.get('seconds', type=float) if 'seconds' in request.args else 10.0
+        if seconds is None or not math.isfinite(seconds) or seconds <= 0:
+            return responses.error("seconds must be a positive number", 400)
+        seconds = min(seconds, _PROFILING['max_seconds'])
+        _profiling = True
+        sampling = profiler.SamplingProfiler(_PROFILING['interval']).start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampling.stop()
+            _profiling = False
+        return sampling.collapsed(), 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+@app.before_serving
+async def startup():
+    # pool, LLM client and background tasks all live on the server's loop
+    eventloop.adopt(asyncio.get_running_loop())
+    database.start()
+    historyQueue.start()
+    retention.start(config)
+    snapshot.start(config)
+    appconfig.start(config)
+    eventloop.spawn(llm.preload())
+
+
+@app.after_serving
+async def shutdown():
+    retention.stop()
+    snapshot.stop()
+    appconfig.stop()
+    # queued history needs the pool, so it is flushed first
+    await historyQueue.close()
+    await database.close()
 
 
 if __name__ == '__main__':
+    # production: hypercorn app:app --workers N
     app.run()
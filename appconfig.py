@@ -0,0 +1,215 @@
+import asyncio
+import collections.abc
+import dataclasses
+import json
+import logging
+import os
+
+import eventloop
+import metrics
+
+# config.json is parsed and validated once; request handlers read the current
+# Config object and never touch the file. A background task stats the file
+# every few seconds and swaps in a new Config when it changes - a file that
+# does not parse or validate is logged and the previous Config stays in use.
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # seconds between checks of the file's modification time
+    "interval": 2.0
+}
+
+REPEAT_ORDERS = ("random", "priority")
+
+RELOADS = metrics.counter("config_reloads_total", "Changes of config.json picked up at runtime, by result (applied, invalid)")
+
+log = logging.getLogger(__name__)
+
+_current = None
+_path = None
+_signature = None
+_listeners = []
+_task = None
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class TextGeneration:
+    """
+    Секция text_generation: длина и температура текстов, изменение весов слов.
+    """
+    maxLength: int = 300
+    temperature: float = 0.7
+    defaultWeight: float = 1.0
+    weightIncreaseFail: float = 2.0
+    weightDecreaseSuccess: float = 0.7
+    minWeight: float = 0.1
+    maxWeight: float = 5.0
+
+    @classmethod
+    def fromSection(cls, section):
+        section = _section(section, "text_generation")
+        values = {
+            "maxLength": _number(section, "max_length", cls.maxLength, int, minimum=1),
+            "temperature": _number(section, "temperature", cls.temperature, float, minimum=0.0),
+            "defaultWeight": _number(section, "default_weight", cls.defaultWeight, float, minimum=0.0),
+            "weightIncreaseFail": _number(section, "weight_increase_fail", cls.weightIncreaseFail, float, minimum=0.0),
+            "weightDecreaseSuccess": _number(section, "weight_decrease_success", cls.weightDecreaseSuccess, float,
+                                             minimum=0.0),
+            "minWeight": _number(section, "min_weight", cls.minWeight, float, minimum=0.0),
+            "maxWeight": _number(section, "max_weight", cls.maxWeight, float, minimum=0.0)
+        }
+        if values["minWeight"] > values["maxWeight"]:
+            raise ConfigError("text_generation.min_weight is greater than max_weight")
+        return cls(**values)
+
+
+def _section(value, name):
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ConfigError(f"{name} must be an object, got {type(value).__name__}")
+    return value
+
+
+def _number(section, key, default, kind, minimum=None):
+    value = section.get(key, default)
+    # bool is an int subclass, but "WordsPerTry": true is a mistake
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and not isinstance(value, int)):
+        raise ConfigError(f"{key} must be {'an integer' if kind is int else 'a number'}, got {value!r}")
+    if minimum is not None and value < minimum:
+        raise ConfigError(f"{key} must be at least {minimum}, got {value!r}")
+    return kind(value)
+
+
+class Config(collections.abc.Mapping):
+    """
+    Разобранный и проверенный config.json. Значения, которые читаются в запросах, -
+    типизированные поля; секции модулей доступны как у словаря (config.get("llm")).
+    """
+
+    def __init__(self, raw):
+        raw = _section(raw, "config.json")
+        self.wordsPerTry = _number(raw, "WordsPerTry", 10, int, minimum=1)
+        self.repeatOrder = raw.get("RepeatOrder", "random")
+        if self.repeatOrder not in REPEAT_ORDERS:
+            raise ConfigError(f"RepeatOrder must be one of {', '.join(REPEAT_ORDERS)}, got {self.repeatOrder!r}")
+        self.similarDistractors = raw.get("SimilarDistractors", False)
+        if not isinstance(self.similarDistractors, bool):
+            raise ConfigError(f"SimilarDistractors must be true or false, got {self.similarDistractors!r}")
+        self.textGeneration = TextGeneration.fromSection(raw.get("text_generation"))
+        self._raw = raw
+
+    def __getitem__(self, key):
+        return self._raw[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def changedSections(self, other):
+        """
+        Ключи верхнего уровня, значения которых в other другие.
+        """
+        return sorted(key for key in set(self) | set(other) if self.get(key) != other.get(key))
+
+
+def _stat(path):
+    # a file replaced by rename keeps neither the inode nor, often, the size
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def parse(path):
+    try:
+        with open(path, "rb") as f:
+            raw = json.loads(f.read())
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{path}: {e}") from None
+    try:
+        return Config(raw)
+    except ConfigError as e:
+        raise ConfigError(f"{path}: {e}") from None
+
+
+def load(path="config.json"):
+    """
+    Читает и проверяет config.json (ConfigError, если он неверный) и делает его текущим.
+    """
+    global _current, _path, _signature
+    signature = _stat(path)
+    _current = parse(path)
+    _path, _signature = path, signature
+    return _current
+
+
+def current():
+    return _current
+
+
+def subscribe(callback):
+    """
+    callback(new, old) вызывается на loop после того, как измененный файл прочитан и проверен.
+    """
+    _listeners.append(callback)
+
+
+def reload():
+    """
+    Перечитывает файл, если он изменился; True, если применена новая версия.
+    """
+    global _current, _signature
+    try:
+        signature = _stat(_path)
+    except OSError as e:
+        log.warning("Cannot stat %s: %s", _path, e)
+        return False
+    if signature == _signature:
+        return False
+    # the same broken file is reported once, not on every check
+    _signature = signature
+    try:
+        new = parse(_path)
+    except (OSError, ConfigError) as e:
+        RELOADS.inc(result="invalid")
+        log.error("Ignoring the changed configuration, the previous one stays in use: %s", e)
+        return False
+
+    old, _current = _current, new
+    RELOADS.inc(result="applied")
+    log.info("Reloaded %s, changed: %s", _path, ", ".join(old.changedSections(new)) or "nothing")
+    for callback in _listeners:
+        try:
+            callback(new, old)
+        except Exception:
+            log.exception("Applying the reloaded configuration failed")
+    return True
+
+
+async def _watchLoop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        reload()
+
+
+def start(config):
+    """
+    Следит за файлом, загруженным load(), по секции "config_reload".
+    """
+    global _task
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("config_reload", {}))
+    if settings["enabled"] and _task is None and _path is not None:
+        _task = eventloop.spawn(_watchLoop(settings["interval"]))
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
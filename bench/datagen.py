@@ -0,0 +1,122 @@
+"""
+Синтетические данные для таблиц words и words_history.
+
+Размеры задаются числом слов (1k, 100k, 1m); истории по умолчанию
+HISTORY_PER_WORD повторений на слово, распределенных по последнему году.
+Генерация детерминирована (seed), строки заливаются через COPY пачками.
+
+    python bench/datagen.py --size 100k    # заполнить базу из BENCH_DSN (см. fixture.py)
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import string
+import time
+
+SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+HISTORY_PER_WORD = 5
+CHUNK = 50000
+
+_PARTS_OF_SPEECH = ("n", "v", "adj", "adv", "phr", "")
+_POS_WEIGHTS = (40, 25, 15, 8, 7, 5)
+_SYLLABLES = [c + v for c in "bcdfghklmnprstvwz" for v in "aeiou"]
+_RU_SYLLABLES = [c + v for c in "бвгдзклмнпрстфх" for v in "аеиоуя"]
+
+
+def parseSize(size):
+    if size.lower() in SIZES:
+        return SIZES[size.lower()]
+    return int(size)
+
+
+def _word(rng, i):
+    # уникальный суффикс из номера, чтобы DISTINCT ON (word) не схлопывал выборку
+    stem = "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 3)))
+    suffix = ""
+    while True:
+        i, rest = divmod(i, 26)
+        suffix = string.ascii_lowercase[rest] + suffix
+        if not i:
+            return stem + suffix
+
+
+def wordRows(count, seed=0, now=None):
+    """
+    (word, translation, partofspeech, example, repeatindex, nextrepeattime, weight)
+    """
+    rng = random.Random(seed)
+    now = now or datetime.datetime.now()
+    for i in range(count):
+        examples = [f"Example sentence number {n} for the word." for n in range(rng.choice((0, 0, 1, 2)))]
+        yield (
+            _word(rng, i),
+            "".join(rng.choice(_RU_SYLLABLES) for _ in range(rng.randint(2, 4))),
+            rng.choices(_PARTS_OF_SPEECH, _POS_WEIGHTS)[0],
+            json.dumps(examples) if examples else None,
+            rng.randint(0, 6),
+            # примерно треть слов уже пора повторять
+            now + datetime.timedelta(seconds=rng.uniform(-10, 20) * 86400),
+            min(max(rng.lognormvariate(0, 0.6), 0.1), 5.0)
+        )
+
+
+def historyRows(wordCount, perWord=HISTORY_PER_WORD, seed=0, now=None):
+    """
+    (word_id, repeatindex, repeatdate); word_id - от 1 до wordCount, как у свежей таблицы.
+    """
+    rng = random.Random(seed + 1)
+    now = now or datetime.datetime.now()
+    for _ in range(wordCount * perWord):
+        yield (
+            rng.randint(1, wordCount),
+            rng.randint(1, 6),
+            now - datetime.timedelta(seconds=rng.expovariate(1 / 60) * 86400 % (365 * 86400))
+        )
+
+
+async def _copy(conn, table, columns, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK:
+            await conn.copy_records_to_table(table, records=chunk, columns=columns)
+            chunk = []
+    if chunk:
+        await conn.copy_records_to_table(table, records=chunk, columns=columns)
+
+
+async def populate(conn, wordCount, historyPerWord=HISTORY_PER_WORD, seed=0):
+    """
+    Заливает слова и историю в пустые таблицы words/words_history.
+    """
+    now = datetime.datetime.now()
+    await _copy(conn, "words",
+                ("word", "translation", "partofspeech", "example", "repeatindex", "nextrepeattime", "weight"),
+                wordRows(wordCount, seed, now))
+    await _copy(conn, "words_history", ("word_id", "repeatindex", "repeatdate"),
+                historyRows(wordCount, historyPerWord, seed, now))
+    await conn.execute("ANALYZE words")
+    await conn.execute("ANALYZE words_history")
+
+
+def main():
+    import fixture
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="1k", help="1k, 100k, 1m or a number of words")
+    parser.add_argument("--history-per-word", type=int, default=HISTORY_PER_WORD)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    async def run():
+        started = time.perf_counter()
+        settings = await fixture.create(parseSize(args.size), args.history_per_word, args.seed)
+        print(f"{settings['database']}: {parseSize(args.size)} words in {time.perf_counter() - started:.1f}s")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+p50/p99 и rps основных эндпоинтов на синтетических базах разного размера.
+
+Для каждого размера создается база из fixture.py (нужен Postgres, см. BENCH_DSN),
+приложение поднимается на hypercorn с заглушкой LLM, затем сценарии
+прогоняются по очереди:
+
+    python bench/endpoints.py --sizes 1k,100k,1m --llm-latency 1.5 -c 50 -n 500
+    python bench/endpoints.py --sizes 1k --json results.json
+"""
+import argparse
+import asyncio
+import json
+
+import datagen
+import fixture
+import loadtest
+
+DEFAULT_SCENARIOS = ("/repeatWords", "/repeatWords:submit", "/generate_text", "/getStatistics", "/addWord")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,100k", help="comma separated: 1k, 100k, 1m or numbers")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS))
+    parser.add_argument("-c", "--concurrency", type=int, default=50)
+    parser.add_argument("-n", "--requests", type=int, default=500)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--app-dir", default=fixture.ROOT)
+    parser.add_argument("--reuse", action="store_true", help="keep already generated databases")
+    parser.add_argument("--json", metavar="FILE", help="also write results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes.split(","):
+        wordCount = datagen.parseSize(size)
+        settings = asyncio.run(fixture.create(wordCount, reuse=args.reuse))
+        context = {"wordCount": wordCount}
+
+        with loadtest.serve(args.app_dir, "asgi", args.llm_latency, databaseSettings=settings) as url:
+            for scenario in args.scenarios.split(","):
+                result = asyncio.run(loadtest.run(url, scenario, args.concurrency, args.requests, context))
+                results.setdefault(size, {})[scenario] = result
+                loadtest.report(f"[{size}] {scenario}", result)
+
+    print()
+    print(f"{'size':>6}  {'endpoint':<22}{'rps':>9}{'p50 ms':>10}{'p99 ms':>10}{'failed':>8}")
+    for size, scenarios in results.items():
+        for scenario, result in scenarios.items():
+            print(f"{size:>6}  {scenario:<22}{result['rps']:>9.1f}{result['p50'] * 1000:>10.1f}"
+                  f"{result['p99'] * 1000:>10.1f}{result['failed']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
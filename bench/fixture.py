@@ -0,0 +1,102 @@
+"""
+Локальная база Postgres для бенчмарков.
+
+Сервер задается BENCH_DSN (по умолчанию postgresql://postgres@localhost:5432/postgres),
+пользователь должен иметь право CREATE DATABASE. Для каждого размера создается
+отдельная база words_bench_<число слов> с таблицами words/words_history,
+синтетическими данными и схемой приложения (schema.ensureSchema).
+"""
+import os
+import sys
+import urllib.parse
+
+import asyncpg
+
+import datagen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schema  # noqa: E402
+
+DEFAULT_DSN = "postgresql://postgres@localhost:5432/postgres"
+
+# Таблицы, которые в рабочей базе созданы вручную (schema.py их не создает)
+BASE_TABLES = [
+    """
+    CREATE TABLE words (
+        word_id BIGSERIAL PRIMARY KEY,
+        word TEXT NOT NULL,
+        translation TEXT,
+        partofspeech TEXT,
+        example TEXT,
+        repeatindex INT NOT NULL DEFAULT 0,
+        nextrepeattime TIMESTAMP,
+        weight DOUBLE PRECISION DEFAULT 1.0
+    )
+    """,
+    """
+    CREATE TABLE words_history (
+        id BIGSERIAL PRIMARY KEY,
+        word_id BIGINT NOT NULL REFERENCES words (word_id),
+        repeatindex INT,
+        repeatdate TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+    """
+]
+
+
+def dsn():
+    return os.environ.get("BENCH_DSN", DEFAULT_DSN)
+
+
+def settingsFor(database):
+    """
+    Секция "database" config.json для базы бенчмарка.
+    """
+    parsed = urllib.parse.urlsplit(dsn())
+    return {
+        "host": parsed.hostname or "localhost",
+        "port": parsed.port or 5432,
+        "database": database,
+        "user": urllib.parse.unquote(parsed.username or "postgres"),
+        "password": urllib.parse.unquote(parsed.password or "")
+    }
+
+
+async def create(wordCount, historyPerWord=datagen.HISTORY_PER_WORD, seed=0, reuse=False):
+    """
+    Создает (или пересоздает) базу бенчмарка и возвращает настройки подключения к ней.
+    reuse=True оставляет уже существующую базу как есть.
+    """
+    name = f"words_bench_{wordCount}"
+    admin = await asyncpg.connect(dsn())
+    try:
+        exists = await admin.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", name)
+        if exists and reuse:
+            return settingsFor(name)
+        if exists:
+            await admin.execute(f'DROP DATABASE "{name}" WITH (FORCE)')
+        await admin.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await admin.close()
+
+    settings = settingsFor(name)
+    conn = await asyncpg.connect(**settings)
+    try:
+        for statement in BASE_TABLES:
+            await conn.execute(statement)
+        await datagen.populate(conn, wordCount, historyPerWord, seed)
+        # схема после данных: rollup-таблицы заполняются одним проходом, а не триггерами
+        await schema.ensureSchema(conn)
+    finally:
+        await conn.close()
+    return settings
+
+
+async def drop(wordCount):
+    admin = await asyncpg.connect(dsn())
+    try:
+        await admin.execute(f'DROP DATABASE IF EXISTS "words_bench_{wordCount}" WITH (FORCE)')
+    finally:
+        await admin.close()
@@ -0,0 +1,100 @@
+"""
+Admission control (admission.py) против локального mock-сервера LLM: пачка
+одновременных запросов generate_text, следом check_text, по каждому endpoint -
+сколько запросов принято и отклонено и полное время ответа.
+
+    python bench/llmburst.py --generate 60 --check 20 --latency 2 --concurrency 8
+    python bench/llmburst.py --json
+
+Настройки admission берутся из config.json (секция "admission").
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import fixture
+import mockllm
+
+os.chdir(fixture.ROOT)
+
+import eventloop  # noqa: E402
+import llm  # noqa: E402
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def burst(args, admissionSettings):
+    server = mockllm.MockServer(args.latency, args.jitter)
+    port = await server.start()
+    llm.configure({
+        "llm": {"api_key": "mock", "base_url": f"http://127.0.0.1:{port}", "max_retries": 0,
+                "max_concurrency": args.concurrency, "max_connections": args.concurrency},
+        "admission": admissionSettings
+    })
+    outcomes = {}
+
+    async def one(endpoint, userId, delay):
+        await asyncio.sleep(delay)
+        prompt = "Сгенерируй текст из следующего списка: alpha,beta." if endpoint == "generate_text" \
+            else "Пропуск 1: ошибка"
+        started = time.perf_counter()
+        try:
+            await llm.complete(endpoint, prompt, userId=userId)
+            result = "ok"
+        except llm.Rejected:
+            result = "rejected"
+        outcomes.setdefault(endpoint, []).append((result, time.perf_counter() - started))
+
+    # generation requests fill the queue first, interactive checks arrive a moment later
+    await asyncio.gather(
+        *(one("generate_text", i % args.users + 1, 0.0) for i in range(args.generate)),
+        *(one("check_text", i % args.users + 1, 0.05) for i in range(args.check)))
+    await server.close()
+
+    report = []
+    for endpoint, items in outcomes.items():
+        times = [elapsed for result, elapsed in items if result == "ok"]
+        report.append({
+            "endpoint": endpoint,
+            "ok": len(times),
+            "rejected": sum(1 for result, _ in items if result == "rejected"),
+            "p50": _percentile(times, 0.5),
+            "p99": _percentile(times, 0.99),
+            "max_active_upstream": server.maxActive
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generate", type=int, default=60)
+    parser.add_argument("--check", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8, help="llm.max_concurrency")
+    parser.add_argument("--latency", type=float, default=2.0, help="mock server latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    with open(os.path.join(fixture.ROOT, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    report = eventloop.runSync(burst(args, config.get("admission")))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'endpoint':<15}{'ok':>6}{'rejected':>10}{'p50, s':>10}{'p99, s':>10}")
+    for row in report:
+        print(f"{row['endpoint']:<15}{row['ok']:>6}{row['rejected']:>10}{row['p50']:>10.2f}{row['p99']:>10.2f}")
+    print(f"upstream concurrency peak: {report[0]['max_active_upstream'] if report else 0}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Нагрузочный тест HTTP API: N одновременных клиентов шлют запросы к одному
+эндпоинту, в конце печатаются rps и перцентили задержки.
+
+Против уже запущенного сервера:
+    python bench/loadtest.py --url http://127.0.0.1:5000 --path /checkText -c 200 -n 2000
+
+С --serve скрипт сам поднимает приложение из указанного каталога на свободном
+порту, подменив LLM заглушкой с задержкой --llm-latency (ответы DeepSeek не
+нужны, измеряется только то, как сервер держит конкурентные ожидания).
+Сравнение со старым запуском через Flask app.run():
+    git worktree add /tmp/words-flask <коммит до перехода на Quart>
+    python bench/loadtest.py --serve /tmp/words-flask --server wsgi -c 200 -n 2000
+    python bench/loadtest.py --serve . --server asgi -c 200 -n 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Запускается в дочернем процессе: приложение из каталога appDir, LLM - заглушка
+# из bench/stubllm.py, настройки базы (JSON) - поверх config.json приложения.
+_BOOTSTRAP = """
+import json, os, sys
+appDir, benchDir, server, port, latency, concurrency, databaseSettings = sys.argv[1:8]
+os.chdir(appDir)
+sys.path[:0] = [appDir, benchDir]
+sys.stdout = open(os.devnull, "w")
+
+import llm
+import stubllm
+llm.useStub(stubllm.respond, float(latency))
+import app
+import database
+llm.configure(dict(app.config, llm=dict(app.config.get("llm", {}),
+                                        max_concurrency=int(concurrency), max_connections=int(concurrency))))
+if databaseSettings:
+    database.configure(dict(app.config, database=dict(app.config.get("database", {}), **json.loads(databaseSettings))))
+
+if server == "wsgi":
+    app.app.run(host="127.0.0.1", port=int(port), threaded=True)
+else:
+    import asyncio
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    config.backlog = 2048
+    asyncio.run(serve(app.app, config))
+"""
+
+
+def _freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _checkTextBody(context):
+    # случайные ответы, чтобы не попадать в кеш объяснений
+    gaps = random.randint(3, 6)
+    right = [f"word{random.randrange(10 ** 9)}" for _ in range(gaps)]
+    user = [f"guess{random.randrange(10 ** 9)}" for _ in range(gaps)]
+    text = " ".join(f"Sentence {i} with a gap <>." for i in range(gaps))
+    return {"text": text, "rightAnswers": right, "userAnswers": user}
+
+
+def _submitBody(context):
+    # результат повторения WordsPerTry случайных слов (id у синтетической базы - 1..wordCount)
+    wordCount = context.get("wordCount") or 1
+    return {"resultState": {str(random.randint(1, wordCount)): random.random() < 0.7 for _ in range(10)}}
+
+
+def _addWordBody(context):
+    return {"word": f"benchword{random.randrange(10 ** 12)}", "translation": "тест", "examples": ["An example."]}
+
+
+# имя сценария -> (метод, путь, тело запроса по context)
+SCENARIOS = {
+    "/repeatWords": ("GET", "/repeatWords", None),
+    "/repeatWords:submit": ("POST", "/repeatWords", _submitBody),
+    "/generate_text": ("POST", "/generate_text", lambda context: {}),
+    "/checkText": ("POST", "/checkText", _checkTextBody),
+    "/getWords": ("GET", "/getWords", None),
+    "/getStatistics": ("GET", "/getStatistics", None),
+    "/addWord": ("POST", "/addWord", _addWordBody),
+    "/metrics": ("GET", "/metrics", None)
+}
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class _Connection:
+    """
+    Минимальный HTTP/1.1 клиент с keep-alive, по соединению на воркер.
+    httpx при сотнях соединений сам упирается в CPU раньше сервера.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, body=None):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        headers = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+        if body is not None:
+            headers += "Content-Type: application/json\r\n"
+        self._writer.write(headers.encode("ascii") + b"\r\n" + payload)
+        try:
+            return await self._readResponse()
+        except (OSError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+
+    async def _readResponse(self):
+        head = await self._reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await self._reader.readexactly(int(headers["content-length"]))
+        else:
+            await self._reader.read()
+            self.close()
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+async def run(url, scenario, concurrency, total, context=None):
+    """
+    total запросов сценария от concurrency параллельных клиентов.
+    Возвращает сводку: ok, failed, errors, seconds, rps, p50, p99, max (секунды).
+    """
+    method, path, body = SCENARIOS.get(scenario, ("GET", scenario, None))
+    context = context or {}
+    latencies = []
+    errors = {}
+    remaining = iter(range(total))
+    parsed = urllib.parse.urlsplit(url)
+
+    async def worker():
+        connection = _Connection(parsed.hostname, parsed.port or 80)
+        for _ in remaining:
+            payload = body(context) if body is not None else None
+            started = time.perf_counter()
+            try:
+                status = await connection.request(method, path, payload)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            if status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+        connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "ok": len(latencies),
+        "failed": sum(errors.values()),
+        "errors": errors,
+        "seconds": elapsed,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": _percentile(latencies, 0.5),
+        "p99": _percentile(latencies, 0.99),
+        "max": max(latencies, default=0.0)
+    }
+
+
+async def _waitReady(url, process, timeout=30.0):
+    parsed = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        connection = _Connection(parsed.hostname, parsed.port)
+        try:
+            await connection.request("GET", "/metrics")
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+        finally:
+            connection.close()
+    raise RuntimeError("server did not start in time")
+
+
+@contextlib.contextmanager
+def serve(appDir, server="asgi", llmLatency=1.0, llmConcurrency=256, databaseSettings=None):
+    """
+    Поднимает приложение из appDir в дочернем процессе и отдает его URL.
+    """
+    port = _freePort()
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen([
+        sys.executable, "-c", _BOOTSTRAP, os.path.abspath(appDir), BENCH_DIR, server, str(port),
+        str(llmLatency), str(llmConcurrency), json.dumps(databaseSettings) if databaseSettings else ""
+    ])
+    try:
+        asyncio.run(_waitReady(url, process))
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def report(scenario, result):
+    print(f"{scenario}: {result['ok']} ok, {result['failed']} failed in {result['seconds']:.2f}s")
+    print(f"  throughput: {result['rps']:.1f} req/s")
+    print(f"  latency:    p50 {result['p50'] * 1000:.0f} ms, p99 {result['p99'] * 1000:.0f} ms, "
+          f"max {result['max'] * 1000:.0f} ms")
+    if result["errors"]:
+        print(f"  errors:     {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--path", default="/checkText", help="scenario: " + ", ".join(SCENARIOS))
+    parser.add_argument("-c", "--concurrency", type=int, default=100)
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    parser.add_argument("--word-count", type=int, default=1000, help="word ids 1..N used by /repeatWords:submit")
+    parser.add_argument("--serve", metavar="APP_DIR", help="start the app from this directory with a stubbed LLM")
+    parser.add_argument("--server", choices=("asgi", "wsgi"), default="asgi",
+                        help="asgi: hypercorn, wsgi: Flask app.run(threaded=True)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="stubbed LLM response time, seconds")
+    parser.add_argument("--llm-concurrency", type=int, default=256,
+                        help="LLM concurrency limit of the served app (same for both servers)")
+    args = parser.parse_args()
+
+    context = {"wordCount": args.word_count}
+    if args.serve:
+        with serve(args.serve, args.server, args.llm_latency, args.llm_concurrency) as url:
+            result = asyncio.run(run(url, args.path, args.concurrency, args.requests, context))
+    else:
+        result = asyncio.run(run(args.url, args.path, args.concurrency, args.requests, context))
+    print(f"concurrency {args.concurrency}")
+    report(args.path, result)
+
+
+if __name__ == "__main__":
+    main()
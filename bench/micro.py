@@ -0,0 +1,183 @@
+"""
+Микробенчмарки горячих функций без HTTP: взвешенный сэмплер, WordStore,
+индекс вариантов ответа, _generateFirstStage, сериализация ответа
+/repeatWords и (с --db) _selectRepeatWords.
+
+    python bench/micro.py --sizes 1k,100k,1m
+    python bench/micro.py --save baseline.json               # запомнить p50
+    python bench/micro.py --compare baseline.json            # exit 1 при регрессии > --tolerance
+    BENCH_DSN=postgresql://... python bench/micro.py --db    # плюс запросы к Postgres
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+import datagen
+import fixture
+
+os.chdir(fixture.ROOT)
+
+import app  # noqa: E402
+import appconfig  # noqa: E402
+import database  # noqa: E402
+import distractors  # noqa: E402
+import eventloop  # noqa: E402
+import responses  # noqa: E402
+import sampler  # noqa: E402
+import wordstore  # noqa: E402
+
+
+def measure(fn, minTime=0.5, minRuns=5, maxRuns=100000):
+    """
+    Вызывает fn, пока не наберется minTime секунд (и не меньше minRuns раз).
+    Возвращает время отдельных вызовов в секундах.
+    """
+    fn()  # прогрев
+    timings = []
+    deadline = time.perf_counter() + minTime
+    while len(timings) < minRuns or (time.perf_counter() < deadline and len(timings) < maxRuns):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+@contextlib.contextmanager
+def _configured(**values):
+    # app.config is an immutable appconfig.Config: swap in one with the values changed
+    original = app.config
+    app.config = appconfig.Config(dict(original, **values))
+    try:
+        yield
+    finally:
+        app.config = original
+
+
+def _rows(count):
+    return [
+        {"word_id": i, "word": word, "translation": translation, "partofspeech": pos, "example": example,
+         "repeatindex": repeatIndex, "nextrepeattime": nextRepeatTime, "weight": weight}
+        for i, (word, translation, pos, example, repeatIndex, nextRepeatTime, weight)
+        in enumerate(datagen.wordRows(count), 1)
+    ]
+
+
+def memoryBenchmarks(count):
+    rows = _rows(count)
+    weights = [row["weight"] for row in rows]
+
+    weightedSampler = sampler.WeightedSampler()
+    weightedSampler.rebuild(weights)
+
+    store = wordstore.WordStore()
+    store._replaceAll(rows, 0)
+
+    index = distractors.DistractorIndex()
+    index.load(rows)
+
+    words = store.sampleWords(app.config.wordsPerTry)
+
+    def firstStage(similarDistractors):
+        def run():
+            with _configured(SimilarDistractors=similarDistractors):
+                app._generateFirstStage(index, words)
+        return run
+
+    stage1, options = app._generateFirstStage(index, words)
+    payload = {"firstStage": stage1, "words": words, "options": list(options.values())}
+
+    sample = rows[random.randrange(count)]
+    return {
+        "sampler.rebuild": lambda: weightedSampler.rebuild(weights),
+        "sampler.update": lambda: weightedSampler.update(random.randrange(count), random.random() * 5),
+        "sampler.sample(10)": lambda: weightedSampler.sample(10),
+        "wordstore.load": lambda: store._replaceAll(rows, 0),
+        "wordstore.sampleWords(10)": lambda: store.sampleWords(10),
+        "distractors.load": lambda: index.load(rows),
+        "distractors.sample": lambda: index.sample(sample["word"], sample["partofspeech"], 3, {sample["word"]}),
+        "_generateFirstStage": firstStage(False),
+        "_generateFirstStage(similar)": firstStage(True),
+        "responses.dumps(repeatWords)": lambda: responses.dumps(payload),
+        "responses.compress(repeatWords)": lambda: responses.compress(responses.dumps(payload), "gzip")
+    }
+
+
+def databaseBenchmarks(count):
+    database.configure({"database": eventloop.runSync(fixture.create(count, reuse=True))})
+    def select(repeatOrder):
+        def run():
+            with _configured(RepeatOrder=repeatOrder):
+                eventloop.runSync(app._selectRepeatWords(wordstore.DEFAULT_USER_ID))
+        return run
+
+    return {
+        "_selectRepeatWords(random)": select("random"),
+        "_selectRepeatWords(priority)": select("priority")
+    }
+
+
+# полная перестройка на больших размерах слишком долгая для частых прогонов
+_SLOW = ("sampler.rebuild", "wordstore.load", "distractors.load")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1k,100k")
+    parser.add_argument("--db", action="store_true", help="also benchmark queries against the fixture database")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds per benchmark")
+    parser.add_argument("--save", metavar="FILE", help="write p50 timings as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare p50 with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown, 0.25 = +25%%")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print(f"{'size':>6}  {'benchmark':<30}{'runs':>8}{'p50 us':>12}{'p99 us':>12}{'baseline':>10}")
+    for size in args.sizes.split(","):
+        count = datagen.parseSize(size)
+        benchmarks = memoryBenchmarks(count)
+        if args.db:
+            benchmarks.update(databaseBenchmarks(count))
+
+        for name, fn in benchmarks.items():
+            minRuns = 1 if name in _SLOW and count >= 1000000 else 5
+            timings = measure(fn, args.min_time, minRuns)
+            p50 = _percentile(timings, 0.5)
+            key = f"{size}/{name}"
+            results[key] = p50
+
+            change = ""
+            if key in baseline and baseline[key]:
+                ratio = p50 / baseline[key] - 1
+                change = f"{ratio:+.0%}"
+                if ratio > args.tolerance:
+                    regressions.append(key)
+                    change += " !"
+            print(f"{size:>6}  {name:<30}{len(timings):>8}{p50 * 1e6:>12.1f}"
+                  f"{_percentile(timings, 0.99) * 1e6:>12.1f}{change:>10}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if regressions:
+        print(f"\nRegressions over {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Локальный OpenAI-совместимый сервер вместо api.deepseek.com: POST /chat/completions
+(обычный и stream) с ответами bench/stubllm.py и искусственной задержкой.
+В отличие от llm.useStub запросы идут через настоящий клиент, пул соединений и admission.
+
+    python bench/mockllm.py --port 8300 --latency 2 --jitter 0.5
+    # config.json: "llm": {"base_url": "http://127.0.0.1:8300", ...}
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import stubllm
+
+
+class MockServer:
+    """
+    latency - секунды до первого байта ответа (плюс случайные 0..jitter),
+    tokenDelay - пауза между фрагментами потокового ответа.
+    """
+
+    def __init__(self, latency=1.0, jitter=0.0, tokenDelay=0.01):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokenDelay = tokenDelay
+        self.requests = 0
+        self.active = 0
+        self.maxActive = 0
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = {}
+                for line in head.decode("latin-1").split("\r\n")[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = json.loads(await reader.readexactly(int(headers.get("content-length", 0))) or b"{}")
+                await self._respond(writer, body)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, body):
+        self.requests += 1
+        self.active += 1
+        self.maxActive = max(self.maxActive, self.active)
+        try:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+            prompt = body["messages"][-1]["content"]
+            endpoint = "generate_text" if "Сгенерируй" in prompt else "check_text"
+            content = stubllm.respond(endpoint, prompt, body)
+            if body.get("stream"):
+                await self._stream(writer, content)
+            else:
+                payload = json.dumps({
+                    "id": f"mock-{self.requests}", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                              "total_tokens": (len(prompt) + len(content)) // 4}
+                }).encode("utf-8")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             + f"Content-Length: {len(payload)}\r\n\r\n".encode("ascii") + payload)
+                await writer.drain()
+        finally:
+            self.active -= 1
+
+    async def _stream(self, writer, content):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for word in content.split(" "):
+            chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            await self._chunk(writer, f"data: {json.dumps(chunk)}\n\n")
+            await asyncio.sleep(self.tokenDelay)
+        await self._chunk(writer, "data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _chunk(self, writer, text):
+        data = text.encode("utf-8")
+        writer.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        await writer.drain()
+
+
+async def _main(args):
+    server = MockServer(args.latency, args.jitter)
+    port = await server.start(args.host, args.port)
+    print(f"mock LLM on http://{args.host}:{port} (latency {args.latency} s + up to {args.jitter} s)")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,162 @@
+"""
+Сравнение алгоритмов повторения (scheduler.py) на истории words_history:
+каждый алгоритм заново проигрывает все повторения, перед каждым повторением
+его прогноз вероятности вспомнить слово сравнивается с фактическим результатом.
+
+    python bench/replay.py                          # база из config.json
+    python bench/replay.py --algorithms ladder,fsrs
+    python bench/replay.py --synthetic 10000        # без базы, сгенерированная история
+    python bench/replay.py --json
+
+Для строк истории без столбца success результат восстанавливается по лестнице:
+ошибка - repeatindex стал 1 не с нуля. Месяцы, свернутые retention.py
+в words_history_daily, в проигрывание не попадают.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+import fixture
+
+os.chdir(fixture.ROOT)
+
+import database  # noqa: E402
+import eventloop  # noqa: E402
+import scheduler  # noqa: E402
+
+HISTORY_QUERY = "SELECT word_id, repeatindex, repeatdate, success FROM words_history ORDER BY word_id, repeatdate"
+
+
+async def _readHistory():
+    wordIds, repeatIndexes, times, outcomes = [], [], [], []
+    async for row in database.cursor(HISTORY_QUERY, prefetch=10000):
+        wordIds.append(row["word_id"])
+        repeatIndexes.append(row["repeatindex"])
+        times.append(row["repeatdate"])
+        outcomes.append(row["success"])
+    return _history(wordIds, repeatIndexes, times, outcomes)
+
+
+def _history(wordIds, repeatIndexes, times, outcomes):
+    """
+    (word_id, время, успех) массивами NumPy, отсортированные по слову и времени.
+    """
+    wordIds = np.asarray(wordIds, dtype=np.int64)
+    repeatIndexes = np.asarray([0 if r is None else r for r in repeatIndexes], dtype=np.int64)
+    times = np.asarray(times, dtype="datetime64[us]")
+
+    first = np.ones(len(wordIds), dtype=bool)
+    first[1:] = wordIds[1:] != wordIds[:-1]
+    previous = np.where(first, 0, np.roll(repeatIndexes, 1))
+    inferred = (repeatIndexes != 1) | (previous == 0)
+    known = np.array([o is not None for o in outcomes], dtype=bool)
+    success = np.where(known, np.array([bool(o) for o in outcomes], dtype=bool), inferred)
+    return wordIds, times, success
+
+
+def synthetic(words, reviews, seed=1):
+    """
+    История по экспоненциальной модели забывания: у слова своя "память" в днях,
+    она растет после успеха и падает после ошибки, повторения идут с интервалами 1-30 дней.
+    """
+    rng = np.random.default_rng(seed)
+    memory = rng.lognormal(1.0, 0.7, words)
+    time = np.full(words, np.datetime64("2024-01-01T09:00", "us"))
+    wordIds, times, outcomes = [], [], []
+    for _ in range(reviews):
+        gap = rng.integers(1, 31, words).astype(np.float64)
+        time = time + scheduler._days(gap)
+        success = rng.random(words) < np.exp(-gap / memory)
+        memory = np.where(success, memory * 1.8, memory * 0.6)
+        wordIds.append(np.arange(words))
+        times.append(time)
+        outcomes.append(success)
+    order = np.lexsort((np.concatenate(times), np.concatenate(wordIds)))
+    return np.concatenate(wordIds)[order], np.concatenate(times)[order], np.concatenate(outcomes)[order]
+
+
+def replay(algorithm, wordIds, times, success):
+    """
+    Проигрывает историю раундами: в раунде k - k-е повторение каждого слова,
+    так что на весь раунд приходится один векторный вызов review().
+    """
+    first = np.ones(len(wordIds), dtype=bool)
+    first[1:] = wordIds[1:] != wordIds[:-1]
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(wordIds)))
+    state = scheduler.emptyState(len(starts))
+
+    predictions, outcomes, intervals = [], [], []
+    for k in range(int(counts.max()) if len(counts) else 0):
+        words = np.flatnonzero(counts > k)
+        events = starts[words] + k
+        current = scheduler.State(*(column[words] for column in state))
+        now = times[events]
+        if k > 0:
+            predictions.append(algorithm.retrievability(current, now))
+            outcomes.append(success[events])
+        reviewed = algorithm.review(current, success[events], now)
+        interval = (reviewed.nextRepeatTime - now) / scheduler.DAY
+        intervals.append(interval[success[events]])
+        for column, values in zip(state, reviewed):
+            column[words] = values
+
+    predictions = np.clip(np.concatenate(predictions) if predictions else np.zeros(0), 1e-4, 1 - 1e-4)
+    outcomes = np.concatenate(outcomes) if outcomes else np.zeros(0, dtype=bool)
+    intervals = np.concatenate(intervals) if intervals else np.zeros(0)
+
+    # words whose last answer was right are "retained"; their current interval
+    # is how often the algorithm would keep showing them
+    retained = success[starts + counts - 1]
+    lastInterval = np.maximum((state.nextRepeatTime - state.lastRepeatTime) / scheduler.DAY, 1.0)
+
+    result = {"algorithm": algorithm.name, "reviews": len(wordIds), "words": len(starts)}
+    if len(outcomes):
+        result["log_loss"] = float(-np.mean(outcomes * np.log(predictions) + (~outcomes) * np.log(1 - predictions)))
+        result["rmse"] = float(np.sqrt(np.mean((predictions - outcomes) ** 2)))
+    if len(intervals):
+        result["mean_interval_after_success"] = float(intervals.mean())
+    if retained.any():
+        result["reviews_per_retained_word_year"] = float(np.mean(365.0 / lastInterval[retained]))
+    return result
+
+
+def report(results):
+    columns = ["algorithm", "log_loss", "rmse", "mean_interval_after_success", "reviews_per_retained_word_year"]
+    print("  ".join(f"{c:>30}" if i else f"{c:<10}" for i, c in enumerate(columns)))
+    for result in results:
+        cells = [f"{result['algorithm']:<10}"]
+        for column in columns[1:]:
+            value = result.get(column)
+            cells.append(f"{value:>30.3f}" if value is not None else f"{'-':>30}")
+        print("  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--algorithms", default=",".join(scheduler.ALGORITHMS))
+    parser.add_argument("--synthetic", type=int, metavar="WORDS", help="replay generated history instead of the database")
+    parser.add_argument("--reviews", type=int, default=8, help="reviews per word for --synthetic")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    with open(os.path.join(fixture.ROOT, "config.json"), encoding="utf-8") as f:
+        config = json.load(f)
+
+    if args.synthetic:
+        history = synthetic(args.synthetic, args.reviews)
+    else:
+        database.configure(config)
+        history = eventloop.runSync(_readHistory())
+
+    results = [replay(scheduler.create(config, name), *history) for name in args.algorithms.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Холодный старт: время импорта app, время до первого ответа сервера и первого
+запроса к LLM (заглушка bench/stubllm.py без задержки, база не нужна).
+
+    python bench/startup.py -n 5
+    python bench/startup.py --app-dir /tmp/words-old    # сравнение с другим коммитом
+    python bench/startup.py --no-preload                 # openai импортируется в первом запросе
+    python bench/startup.py --pause 0                    # запрос к LLM сразу после старта
+
+Каждый замер - новый процесс. "ready" - от запуска процесса до первого ответа
+GET /metrics, "first LLM" - длительность первого POST /checkText с ошибками
+(объяснение идет через llm.complete, то есть создает клиент openai), отправленного
+через --pause секунд после "ready".
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import loadtest
+
+_IMPORT = """
+import os, sys, time
+os.chdir(sys.argv[1])
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+import app
+print(time.perf_counter() - started)
+"""
+
+# как loadtest._BOOTSTRAP, только hypercorn и с настройкой preload
+_SERVE = """
+import json, os, sys
+appDir, benchDir, port, preloadAfter = sys.argv[1:5]
+os.chdir(appDir)
+sys.path[:0] = [appDir, benchDir]
+
+import llm
+import stubllm
+llm.useStub(stubllm.respond, 0.0)
+import app
+llm.configure(dict(app.config, llm=dict(app.config.get("llm", {}), preload_after=json.loads(preloadAfter))))
+
+import asyncio
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+config = Config()
+config.bind = [f"127.0.0.1:{port}"]
+config.accesslog = None
+asyncio.run(serve(app.app, config))
+"""
+
+_CHECK_TEXT = {"text": "A <> test <>.", "rightAnswers": ["cold", "start"], "userAnswers": ["warm", "stop"]}
+
+
+def importSeconds(appDir):
+    output = subprocess.run([sys.executable, "-c", _IMPORT, appDir], check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def importBreakdown(appDir, top=10):
+    """
+    [(модуль, секунды)] самых долгих импортов верхнего уровня у app (python -X importtime).
+    """
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=appDir,
+                            check=True, capture_output=True, text=True)
+    modules = []
+    for line in output.stderr.splitlines():
+        parts = line.split("|")
+        # app's own imports are indented by exactly two spaces
+        if len(parts) == 3 and parts[2].startswith("   ") and not parts[2].startswith("    "):
+            modules.append((parts[2].strip(), int(parts[1]) / 10 ** 6))
+    return sorted(modules, key=lambda item: -item[1])[:top]
+
+
+async def _firstResponses(url, process, pause, timeout=60.0):
+    # (до первого ответа /metrics, длительность первого /checkText) от запуска процесса
+    started = time.perf_counter()
+    host, port = url.rsplit("/", 1)[1].split(":")
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        if time.perf_counter() - started > timeout:
+            raise RuntimeError("server did not start in time")
+        connection = loadtest._Connection(host, int(port))
+        try:
+            await connection.request("GET", "/metrics")
+            ready = time.perf_counter() - started
+            break
+        except OSError:
+            await asyncio.sleep(0.005)
+        finally:
+            connection.close()
+
+    await asyncio.sleep(pause)
+    connection = loadtest._Connection(host, int(port))
+    try:
+        requestStarted = time.perf_counter()
+        status = await connection.request("POST", "/checkText", _CHECK_TEXT)
+        firstLlm = time.perf_counter() - requestStarted
+    finally:
+        connection.close()
+    return ready, firstLlm, status
+
+
+def serveOnce(appDir, preloadAfter, pause):
+    port = loadtest._freePort()
+    process = subprocess.Popen([sys.executable, "-c", _SERVE, appDir, loadtest.BENCH_DIR, str(port),
+                                json.dumps(preloadAfter)], stderr=subprocess.DEVNULL)
+    try:
+        return asyncio.run(_firstResponses(f"http://127.0.0.1:{port}", process, pause))
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def _summary(values):
+    return f"median {statistics.median(values) * 1000:.0f} ms, min {min(values) * 1000:.0f} ms, max {max(values) * 1000:.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", default=os.path.dirname(loadtest.BENCH_DIR))
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--no-preload", action="store_true", help="do not import openai in the background at startup")
+    parser.add_argument("--preload-after", type=float, default=1.0, help="llm.preload_after of the served app")
+    parser.add_argument("--pause", type=float, default=2.0, help="seconds between ready and the first LLM request")
+    parser.add_argument("--json", metavar="FILE", help="also write results as JSON")
+    args = parser.parse_args()
+    appDir = os.path.abspath(args.app_dir)
+
+    imports = [importSeconds(appDir) for _ in range(args.runs)]
+    print(f"import app:      {_summary(imports)}")
+    for module, seconds in importBreakdown(appDir):
+        print(f"  {module:<16} {seconds * 1000:7.1f} ms")
+
+    preloadAfter = None if args.no_preload else args.preload_after
+    runs = [serveOnce(appDir, preloadAfter, args.pause) for _ in range(args.runs)]
+    ready = [run[0] for run in runs]
+    firstLlm = [run[1] for run in runs]
+    print(f"ready (/metrics): {_summary(ready)}")
+    print(f"first LLM call:   {_summary(firstLlm)} (status {runs[-1][2]})")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"import": imports, "ready": ready, "firstLlm": firstLlm}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
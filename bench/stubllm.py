@@ -0,0 +1,32 @@
+"""
+Заглушка DeepSeek для бенчмарков: отвечает в том формате, который ждут
+/generate_text и /checkText, без обращения к API (см. llm.useStub).
+"""
+import json
+import re
+
+_WORDS_RE = re.compile(r"из следующего списка: ([^\n]*)\.")
+
+
+def _generateText(prompt):
+    match = _WORDS_RE.search(prompt)
+    words = [w for w in match.group(1).split(",") if w] if match else []
+    sentences = [f"The story mentions {word} here." for word in words]
+    return json.dumps({
+        "Header": "Synthetic text",
+        "Text": " ".join(sentences),
+        "RightAnswers": words,
+        "RightIndeces": list(range(len(words)))
+    })
+
+
+def _checkText(prompt):
+    # одна строка на каждую ошибку из списка в промпте
+    mistakes = max(prompt.count("Пропуск "), 1)
+    return "\n".join("Synthetic explanation of the mistake." for _ in range(mistakes))
+
+
+def respond(endpoint, prompt, kwargs):
+    if endpoint in ("generate_text", "text_pool"):
+        return _generateText(prompt)
+    return _checkText(prompt)
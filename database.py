@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import re
+import time
+
+import asyncpg
+
+import eventloop
+import metrics
+import schema
+
+_pool = None
+_poolCreating = None
+_healthTask = None
+_waiting = 0
+
+DEFAULT_SETTINGS = {
+    "host": "localhost",
+    "port": 5432,
+    "database": "English",
+    "user": "nice",
+    "password": "nice",
+    "min_size": 2,
+    "max_size": 10,
+    "acquire_timeout": 5.0,
+    "command_timeout": 30.0,
+    "max_inactive_connection_lifetime": 300.0,
+    "health_check_interval": 30.0
+}
+_settings = dict(DEFAULT_SETTINGS)
+
+ACQUIRE_SECONDS = metrics.histogram("db_pool_acquire_seconds", "Time spent waiting for a pooled connection")
+ACQUIRE_TIMEOUTS = metrics.counter("db_pool_acquire_timeouts_total", "Connection acquires that hit acquire_timeout")
+HEALTH_CHECK_FAILURES = metrics.counter("db_pool_health_check_failures_total", "Failed periodic pool health checks")
+QUERY_SECONDS = metrics.histogram("db_query_seconds", "Query execution time by statement")
+QUERY_ERRORS = metrics.counter("db_query_errors_total", "Failed queries by statement")
+
+log = logging.getLogger(__name__)
+
+# statement label: collapsed SQL text, the same for every call of one query
+_STATEMENT_LENGTH = 80
+_MAX_STATEMENTS = 256
+_statements = {}
+
+
+def _poolSizes():
+    if _pool is None:
+        return {}
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        (("state", "in_use"),): size - idle,
+        (("state", "idle"),): idle,
+        (("state", "max"),): _pool.get_max_size()
+    }
+
+
+def _saturation():
+    if _pool is None or not _pool.get_max_size():
+        return 0
+    return (_pool.get_size() - _pool.get_idle_size()) / _pool.get_max_size()
+
+
+metrics.gauge("db_pool_connections", "Pool connections by state", _poolSizes)
+metrics.gauge("db_pool_saturation", "Share of max_size connections currently checked out", _saturation)
+metrics.gauge("db_pool_waiting", "Callers currently waiting for a connection", lambda: _waiting)
+
+
+def configure(config):
+    """
+    Читает секцию "database" из config.json, недостающие ключи берутся по умолчанию.
+    """
+    global _settings
+    _settings = dict(DEFAULT_SETTINGS)
+    _settings.update(config.get("database", {}))
+
+
+def start():
+    """
+    Создает пул на фоновом loop, не дожидаясь подключения: если база недоступна
+    при старте, пул будет создан при первом запросе.
+    """
+    eventloop.spawn(_getPool())
+
+
+def _connectionArgs():
+    return {
+        "host": _settings["host"],
+        "port": _settings["port"],
+        "database": _settings["database"],
+        "user": _settings["user"],
+        "password": _settings["password"]
+    }
+
+
+def _statementLabel(query):
+    label = _statements.get(query)
+    if label is None:
+        if len(_statements) >= _MAX_STATEMENTS:
+            return "other"
+        label = _statements[query] = re.sub(r"\s+", " ", query).strip()[:_STATEMENT_LENGTH]
+    return label
+
+
+def _logQuery(record):
+    # asyncpg calls this after every query on pooled connections
+    statement = _statementLabel(record.query)
+    QUERY_SECONDS.observe(record.elapsed, statement=statement)
+    if record.exception is not None:
+        QUERY_ERRORS.inc(statement=statement)
+
+
+async def _initConnection(conn):
+    conn.add_query_logger(_logQuery)
+
+
+async def _createPool():
+    pool = await asyncpg.create_pool(
+        **_connectionArgs(),
+        init=_initConnection,
+        min_size=_settings["min_size"],
+        max_size=_settings["max_size"],
+        command_timeout=_settings["command_timeout"],
+        max_inactive_connection_lifetime=_settings["max_inactive_connection_lifetime"]
+    )
+    try:
+        async with pool.acquire() as conn:
+            await schema.ensureSchema(conn)
+    except Exception:
+        await pool.close()
+        raise
+    return pool
+
+
+async def _getPool():
+    global _pool, _poolCreating, _healthTask
+    if _pool is not None:
+        return _pool
+
+    # concurrent first requests share a single create_pool call
+    if _poolCreating is None:
+        _poolCreating = asyncio.ensure_future(_createPool())
+    try:
+        pool = await asyncio.shield(_poolCreating)
+    except Exception as e:
+        _poolCreating = None
+        log.error("Ошибка подключения к базе: %s", e)
+        raise
+
+    if _pool is None:
+        _pool = pool
+        _healthTask = asyncio.ensure_future(_healthCheckLoop())
+    return _pool
+
+
+async def _healthCheckLoop():
+    while True:
+        await asyncio.sleep(_settings["health_check_interval"])
+        try:
+            async with _pool.acquire(timeout=_settings["acquire_timeout"]) as conn:
+                await conn.fetchval("SELECT 1")
+        except Exception as e:
+            HEALTH_CHECK_FAILURES.inc()
+            # drop every idle connection so the next acquire reconnects
+            log.warning("Database health check failed: %s", e)
+            await _pool.expire_connections()
+
+
+async def _acquire(pool):
+    global _waiting
+    started = time.perf_counter()
+    _waiting += 1
+    try:
+        return await pool.acquire(timeout=_settings["acquire_timeout"])
+    except asyncio.TimeoutError:
+        ACQUIRE_TIMEOUTS.inc()
+        raise
+    finally:
+        _waiting -= 1
+        ACQUIRE_SECONDS.observe(time.perf_counter() - started)
+
+
+async def _runInPool(fn, args, kwargs):
+    pool = await _getPool()
+    conn = await _acquire(pool)
+    try:
+        return await fn(conn, *args, **kwargs)
+    finally:
+        await pool.release(conn)
+
+
+async def run(fn, *args, **kwargs):
+    """
+    Выполняет fn(conn, *args, **kwargs) на соединении из общего пула.
+    Можно вызывать из любого event loop, в том числе из async view Flask.
+    """
+    return await eventloop.submit(_runInPool(fn, args, kwargs))
+
+
+async def _cursor(query, args, prefetch):
+    pool = await _getPool()
+    conn = await _acquire(pool)
+    try:
+        # server-side cursors only live inside a transaction
+        async with conn.transaction(readonly=True):
+            async for record in conn.cursor(query, *args, prefetch=prefetch):
+                yield record
+    finally:
+        await pool.release(conn)
+
+
+def cursor(query, *args, prefetch=1000):
+    """
+    Асинхронный генератор строк запроса через серверный курсор: в памяти
+    не больше prefetch строк, соединение занято, пока генератор не дочитан или закрыт.
+    """
+    return eventloop.iterate(_cursor(query, args, prefetch))
+
+
+async def _listen(channel, callback, onTerminate):
+    # schema (and the NOTIFY triggers in it) is applied together with the pool
+    await _getPool()
+    conn = await asyncpg.connect(**_connectionArgs())
+    await conn.add_listener(channel, callback)
+    if onTerminate is not None:
+        conn.add_termination_listener(onTerminate)
+    return conn
+
+
+async def listen(channel, callback, onTerminate=None):
+    """
+    Открывает отдельное (не из пула) соединение, подписанное на LISTEN channel.
+    callback(conn, pid, channel, payload) вызывается на фоновом loop.
+    """
+    return await eventloop.submit(_listen(channel, callback, onTerminate))
+
+
+async def close():
+    global _pool, _poolCreating
+    if _healthTask is not None:
+        _healthTask.cancel()
+    if _pool is not None:
+        await _pool.close()
+    _pool = None
+    _poolCreating = None
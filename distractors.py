@@ -0,0 +1,182 @@
+import random
+import threading
+from array import array
+
+# Parts of speech for which distractors are taken from the same part of speech
+POS_WITH_OWN_OPTIONS = ("v", "n", "adj", "adv")
+PREFIX_LENGTH = 2
+
+_KINDS = ("all", "pos", "length", "prefix")
+
+
+def _bucketKey(kind, word, partOfSpeech):
+    if kind == "all":
+        return None
+    if kind == "pos":
+        return partOfSpeech or None
+    if kind == "length":
+        return len(word)
+    return word[:PREFIX_LENGTH]
+
+
+class DistractorIndex:
+    """
+    Индекс слов для вариантов ответа первого этапа.
+
+    Слова хранятся в слотах (word_id в array, строки в списке), а для каждой
+    части речи, длины и префикса есть массив номеров слотов. Добавление и
+    удаление слова - O(1) (удаление переставляет последний элемент корзины
+    на место удаленного), выборка k вариантов - O(k) в среднем.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self.loaded = False
+
+    def _reset(self):
+        self._ids = array('q')
+        self._words = []
+        self._partsOfSpeech = []
+        self._slotById = {}
+        self._freeSlots = []
+        self._buckets = {kind: {} for kind in _KINDS}
+        self._positions = {kind: array('l') for kind in _KINDS}
+
+    def __len__(self):
+        return len(self._slotById)
+
+    def load(self, rows):
+        """
+        Полная пересборка из строк (word_id, word, partofspeech).
+        """
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._add(row["word_id"], row["word"], row["partofspeech"])
+            self.loaded = True
+
+    def invalidate(self):
+        self.loaded = False
+
+    def add(self, wordId, word, partOfSpeech):
+        with self._lock:
+            if wordId in self._slotById:
+                self._remove(wordId)
+            self._add(wordId, word, partOfSpeech)
+
+    def remove(self, wordId):
+        with self._lock:
+            if wordId in self._slotById:
+                self._remove(wordId)
+
+    def _add(self, wordId, word, partOfSpeech):
+        if self._freeSlots:
+            slot = self._freeSlots.pop()
+            self._ids[slot] = wordId
+            self._words[slot] = word
+            self._partsOfSpeech[slot] = partOfSpeech
+        else:
+            slot = len(self._ids)
+            self._ids.append(wordId)
+            self._words.append(word)
+            self._partsOfSpeech.append(partOfSpeech)
+            for kind in _KINDS:
+                self._positions[kind].append(-1)
+        self._slotById[wordId] = slot
+
+        for kind in _KINDS:
+            bucket = self._buckets[kind].setdefault(_bucketKey(kind, word, partOfSpeech), array('l'))
+            self._positions[kind][slot] = len(bucket)
+            bucket.append(slot)
+
+    def _remove(self, wordId):
+        slot = self._slotById.pop(wordId)
+        word = self._words[slot]
+        partOfSpeech = self._partsOfSpeech[slot]
+
+        for kind in _KINDS:
+            key = _bucketKey(kind, word, partOfSpeech)
+            bucket = self._buckets[kind][key]
+            position = self._positions[kind][slot]
+            last = bucket.pop()
+            if last != slot:
+                bucket[position] = last
+                self._positions[kind][last] = position
+            elif not bucket and kind != "all":
+                del self._buckets[kind][key]
+            self._positions[kind][slot] = -1
+
+        self._ids[slot] = 0
+        self._words[slot] = None
+        self._partsOfSpeech[slot] = None
+        self._freeSlots.append(slot)
+
+    def _option(self, slot):
+        return {
+            "wordId": self._ids[slot],
+            "word": self._words[slot],
+            "partOfSpeech": self._partsOfSpeech[slot]
+        }
+
+    def _sampleBucket(self, bucket, count, excludedWords):
+        """
+        Случайные count слотов с разными словами из корзины, кроме excludedWords.
+        Исключений не больше WordsPerTry, поэтому для больших корзин хватает
+        отбраковки за O(count) попыток, и только маленькие корзины фильтруются целиком.
+        """
+        if len(bucket) > 4 * (count + len(excludedWords)):
+            chosen = []
+            chosenWords = set()
+            for _ in range(count * 20):
+                slot = bucket[random.randrange(len(bucket))]
+                word = self._words[slot]
+                if word in excludedWords or word in chosenWords:
+                    continue
+                chosen.append(slot)
+                chosenWords.add(word)
+                if len(chosen) == count:
+                    return chosen
+
+        candidates = {}
+        for slot in bucket:
+            word = self._words[slot]
+            if word not in excludedWords and word not in candidates:
+                candidates[word] = slot
+        if len(candidates) < count:
+            return None
+        return random.sample(list(candidates.values()), count)
+
+    def sample(self, word, partOfSpeech, count=3, excludedWords=(), similar=False):
+        """
+        Возвращает count вариантов-дистракторов для слова.
+
+        По умолчанию для v/n/adj/adv варианты берутся из той же части речи,
+        иначе из всего словаря. similar=True сначала пробует слова с тем же
+        префиксом, затем той же длины.
+        """
+        excludedWords = set(excludedWords)
+        excludedWords.add(word)
+
+        kinds = []
+        if similar:
+            kinds += [("prefix", word[:PREFIX_LENGTH]), ("length", len(word))]
+        if partOfSpeech in POS_WITH_OWN_OPTIONS:
+            kinds.append(("pos", partOfSpeech))
+        kinds.append(("all", None))
+
+        with self._lock:
+            for kind, key in kinds:
+                bucket = self._buckets[kind].get(key)
+                if not bucket:
+                    continue
+                slots = self._sampleBucket(bucket, count, excludedWords)
+                if slots is not None:
+                    return [self._option(slot) for slot in slots]
+
+            # в словаре меньше count подходящих слов - отдаем сколько есть
+            candidates = {}
+            for slot in self._buckets["all"].get(None, ()):
+                if self._words[slot] not in excludedWords:
+                    candidates.setdefault(self._words[slot], slot)
+            return [self._option(slot) for slot in candidates.values()]
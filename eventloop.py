@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import threading
+
+# Objects bound to an event loop (asyncpg pools, http clients) are shared by
+# the whole process, so they all live on one loop. Under the ASGI server that
+# is the server's own loop (see adopt); scripts and tools that have no running
+# loop get a dedicated background thread instead.
+
+log = logging.getLogger(__name__)
+
+_loop = None
+_loopPid = None
+_lock = threading.Lock()
+# the loop keeps only weak references to tasks: spawned ones are held here until they finish
+_tasks = set()
+
+
+def getLoop():
+    """
+    Возвращает общий фоновый event loop, запуская его поток при первом вызове
+    (и заново после fork, т.к. потоки в дочерний процесс не копируются).
+    """
+    global _loop, _loopPid
+    with _lock:
+        if _loop is None or _loopPid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loopPid = os.getpid()
+            thread = threading.Thread(target=_loop.run_forever, name="background-loop", daemon=True)
+            thread.start()
+        return _loop
+
+
+def adopt(loop):
+    """
+    Делает общим уже работающий loop (например, loop ASGI-сервера),
+    тогда submit выполняет корутины напрямую, без перехода между потоками.
+    """
+    global _loop, _loopPid
+    with _lock:
+        _loop = loop
+        _loopPid = os.getpid()
+
+
+def isBackgroundLoop():
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return running is _loop and _loopPid == os.getpid()
+
+
+async def submit(coro):
+    """
+    Выполняет корутину на общем loop и ждет результат из текущего loop.
+    """
+    loop = getLoop()
+    if isBackgroundLoop():
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def runSync(coro, timeout=None):
+    """
+    Блокирующий вариант submit для кода вне event loop (скрипты, shutdown).
+    """
+    return asyncio.run_coroutine_threadsafe(coro, getLoop()).result(timeout)
+
+
+def _track(task):
+    _tasks.add(task)
+    task.add_done_callback(_finished)
+    return task
+
+
+def _finished(task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Background task %s failed", task.get_coro().__qualname__, exc_info=task.exception())
+
+
+async def _spawned(coro):
+    return await _track(asyncio.ensure_future(coro))
+
+
+def spawn(coro):
+    """
+    Запускает фоновую задачу на общем loop, не дожидаясь результата.
+    Задача не будет собрана сборщиком мусора до завершения, ее ошибка попадет в лог.
+    """
+    if isBackgroundLoop():
+        return _track(asyncio.ensure_future(coro))
+    return asyncio.run_coroutine_threadsafe(_spawned(coro), getLoop())
+
+
+async def iterate(agen):
+    """
+    Асинхронный генератор, созданный для общего loop, можно читать из любого loop.
+    """
+    if isBackgroundLoop():
+        try:
+            async for item in agen:
+                yield item
+        finally:
+            await agen.aclose()
+        return
+
+    loop = getLoop()
+    try:
+        while True:
+            try:
+                item = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.__anext__(), loop))
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(agen.aclose(), loop))
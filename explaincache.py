@@ -0,0 +1,148 @@
+import collections
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import database
+import metrics
+
+DEFAULT_SETTINGS = {
+    "memory_entries": 5000,
+    "ttl": 30 * 24 * 3600.0,
+    "max_rows": 200000,
+    "prune_every": 500
+}
+
+LOOKUPS = metrics.counter("explanation_cache_lookups_total", "Per-mistake explanation lookups by tier (memory, database, miss)")
+
+log = logging.getLogger(__name__)
+
+
+def _normalize(value):
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+
+def mistakeKey(text, gapIndex, rightAnswer, userAnswer):
+    """
+    Ключ объяснения одной ошибки: хеш нормализованного текста, номера пропуска
+    и пары (правильный ответ, ответ пользователя).
+    """
+    normalized = "\x1f".join((
+        _normalize(text),
+        str(gapIndex),
+        _normalize(rightAnswer).lower(),
+        _normalize(userAnswer).lower()
+    ))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def findMistakes(rightAnswers, userAnswers):
+    """
+    [(номер пропуска, правильный ответ, ответ пользователя)] для неверных ответов.
+    """
+    mistakes = []
+    for i, right in enumerate(rightAnswers):
+        user = userAnswers[i] if i < len(userAnswers) else ""
+        if _normalize(right).lower() != _normalize(user).lower():
+            mistakes.append((i, right, user))
+    return mistakes
+
+
+class ExplanationCache:
+    """
+    Двухуровневый кеш объяснений ошибок /checkText: LRU в памяти процесса
+    и таблица explanation_cache в Postgres (общая для всех воркеров).
+    Записи старше ttl не отдаются; таблица периодически подрезается до max_rows.
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _getMemory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            explanation, storedAt = entry
+            if time.time() - storedAt > self.settings["ttl"]:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return explanation
+
+    def _putMemory(self, key, explanation, storedAt=None):
+        with self._lock:
+            self._memory[key] = (explanation, storedAt or time.time())
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.settings["memory_entries"]:
+                self._memory.popitem(last=False)
+
+    async def getMany(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            explanation = self._getMemory(key)
+            if explanation is None:
+                missing.append(key)
+            else:
+                found[key] = explanation
+                LOOKUPS.inc(tier="memory")
+        if not missing:
+            return found
+
+        try:
+            rows = await database.run(lambda conn: conn.fetch("""
+                SELECT key, explanation, EXTRACT(EPOCH FROM created_at) AS stored_at
+                FROM explanation_cache
+                WHERE key = ANY($1::text[]) AND created_at > NOW() - make_interval(secs => $2)
+            """, missing, self.settings["ttl"]))
+        except Exception as e:
+            log.warning("Explanation cache read failed: %s", e)
+            rows = []
+
+        for row in rows:
+            found[row["key"]] = row["explanation"]
+            self._putMemory(row["key"], row["explanation"], float(row["stored_at"]))
+            LOOKUPS.inc(tier="database")
+        LOOKUPS.inc(len(missing) - len(rows), tier="miss")
+        return found
+
+    async def putMany(self, explanations):
+        if not explanations:
+            return
+        for key, explanation in explanations.items():
+            self._putMemory(key, explanation)
+
+        self._writes += len(explanations)
+        prune = self._writes >= self.settings["prune_every"]
+        if prune:
+            self._writes = 0
+
+        async def store(conn):
+            await conn.execute("""
+                INSERT INTO explanation_cache (key, explanation, created_at)
+                SELECT u.key, u.explanation, NOW()
+                FROM unnest($1::text[], $2::text[]) AS u(key, explanation)
+                ON CONFLICT (key) DO UPDATE SET explanation = EXCLUDED.explanation, created_at = EXCLUDED.created_at
+            """, list(explanations.keys()), list(explanations.values()))
+            if prune:
+                await conn.execute("""
+                    DELETE FROM explanation_cache
+                    WHERE created_at < NOW() - make_interval(secs => $1)
+                       OR key IN (
+                           SELECT key FROM explanation_cache
+                           ORDER BY created_at DESC
+                           OFFSET $2
+                       )
+                """, self.settings["ttl"], self.settings["max_rows"])
+
+        try:
+            await database.run(store)
+        except Exception as e:
+            log.warning("Explanation cache write failed: %s", e)
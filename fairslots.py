@@ -0,0 +1,97 @@
+import asyncio
+import collections
+import contextlib
+
+# Concurrency slots shared fairly between keys (learners): at most `total` holders
+# at once and at most `perKey` of them with the same key. A freed slot goes to the
+# waiting keys in turn, so one learner's burst of requests cannot starve the rest.
+
+
+class FairSlots:
+    """
+    hold(key) - контекст, внутри которого держится слот. Ожидающие ключи
+    обслуживаются по кругу. Работает на одном loop (общем, см. eventloop).
+    """
+
+    def __init__(self, total, perKey=1):
+        self.total = total
+        self.perKey = perKey
+        self._active = 0
+        self._activeByKey = collections.Counter()
+        # key -> waiting futures; the order of keys is the turn order
+        self._waiting = collections.OrderedDict()
+
+    @property
+    def active(self):
+        return self._active
+
+    def waiting(self):
+        return sum(len(futures) for futures in self._waiting.values())
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def _free(self, key):
+        return self._active < self.total and self._activeByKey[key] < self.perKey
+
+    def _grant(self, key):
+        self._active += 1
+        self._activeByKey[key] += 1
+
+    async def _acquire(self, key):
+        # a key already waiting queues behind its own earlier requests
+        if key not in self._waiting and self._free(key):
+            self._grant(key)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, collections.deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was handed over just as the caller went away
+                self._release(key)
+            else:
+                self._forget(key, future)
+            raise
+
+    def _forget(self, key, future):
+        futures = self._waiting.get(key)
+        if futures is None:
+            return
+        try:
+            futures.remove(future)
+        except ValueError:
+            pass
+        if not futures:
+            del self._waiting[key]
+
+    def _release(self, key):
+        self._active -= 1
+        self._activeByKey[key] -= 1
+        if not self._activeByKey[key]:
+            del self._activeByKey[key]
+        self._dispatch()
+
+    def _dispatch(self):
+        # one slot per key per turn; a served key moves to the end of the turn order
+        while self._active < self.total:
+            for key, futures in self._waiting.items():
+                if self._activeByKey[key] < self.perKey:
+                    break
+            else:
+                return
+            future = futures.popleft()
+            if not futures:
+                del self._waiting[key]
+            else:
+                self._waiting.move_to_end(key)
+            if not future.done():
+                self._grant(key)
+                future.set_result(None)
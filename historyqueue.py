@@ -0,0 +1,309 @@
+import asyncio
+import datetime
+import fcntl
+import glob
+import itertools
+import json
+import logging
+import os
+import re
+import time
+
+import database
+import eventloop
+import metrics
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # rows per COPY; a flush starts as soon as this many rows are pending
+    "batch_size": 5000,
+    # seconds a row may wait for a batch to fill up
+    "flush_interval": 0.5,
+    # appends wait while this many rows are not yet written (backpressure)
+    "max_pending": 100000,
+    # append-only file keeping unwritten rows across restarts, None - memory only;
+    # every worker process writes its own <spool>.w<pid> files, see _recover
+    "spool": None,
+    "fsync": False,
+    # seconds between attempts while the database rejects a batch
+    "retry_delay": 1.0
+}
+
+# words_history columns in the order rows are queued
+COLUMNS = ("user_id", "word_id", "repeatindex", "repeatdate", "success")
+
+PENDING_WAITS = metrics.counter("history_queue_backpressure_total", "Appends that waited for the history writer")
+WRITTEN = metrics.counter("history_queue_rows_total", "History rows by outcome")
+FLUSH_SECONDS = metrics.histogram("history_queue_flush_seconds", "Time to COPY one batch of history rows")
+
+log = logging.getLogger(__name__)
+
+
+def _lockFile(path, blocking=True):
+    """
+    Открытый файл path с исключительной flock-блокировкой или None, если она занята
+    (blocking=False). Файл, удаленный прежним владельцем, пока мы ждали, открывается заново.
+    """
+    while True:
+        f = open(path, "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+
+def _files(prefix):
+    # the live file of a spool prefix and its rotated segments, not the lock
+    return [name for name in [prefix] + glob.glob(glob.escape(prefix) + ".*")
+            if not name.endswith(".lock") and os.path.exists(name)]
+
+_segmentNumbers = itertools.count()
+# spool files of the single-process layout: <spool> and rotated <spool>.<time_ns>
+_LEGACY_SEGMENT = re.compile(r"\.\d+")
+
+
+def _encode(row):
+    userId, wordId, repeatIndex, repeatDate, success = row
+    return json.dumps([userId, wordId, repeatIndex, repeatDate.isoformat(), success])
+
+
+def _decode(line):
+    userId, wordId, repeatIndex, repeatDate, success = json.loads(line)
+    return userId, wordId, repeatIndex, datetime.datetime.fromisoformat(repeatDate), success
+
+
+class HistoryQueue:
+    """
+    Очередь строк words_history: /repeatWords только добавляет строки (append),
+    фоновый писатель на общем loop записывает их в базу пачками через COPY.
+
+    Со spool строки сначала дописываются в файл и удаляются из него только после
+    COMMIT их пачки, после падения процесса его файлы дочитывает start() следующего
+    запущенного процесса (у каждого процесса свои файлы spool).
+    Без spool строки, не записанные к моменту падения, теряются (close() при
+    штатной остановке дописывает все).
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self._pending = []
+        # spool files whose rows are all in _pending (or in the batch being written)
+        self._segments = []
+        self._spool = None
+        self._ownerLock = None
+        self._changed = None
+        self._writer = None
+        self._closing = False
+        metrics.gauge("history_queue_pending", "History rows not yet written", lambda: len(self._pending))
+
+    @property
+    def enabled(self):
+        return self.settings["enabled"]
+
+    def start(self):
+        """
+        Поднимает строки из spool, оставшиеся от прошлого запуска, и запускает писатель.
+        """
+        if self.enabled:
+            eventloop.spawn(self._start())
+
+    async def _start(self):
+        self._recover()
+        self._ensureWriter()
+
+    async def append(self, rows):
+        """
+        Ставит строки (user_id, word_id, repeatindex, repeatdate, success) в очередь.
+        Ждет, пока писатель не разгрузит очередь до max_pending.
+        """
+        if rows:
+            await eventloop.submit(self._append(rows))
+
+    async def _append(self, rows):
+        self._ensureWriter()
+        if len(self._pending) >= self.settings["max_pending"]:
+            PENDING_WAITS.inc()
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self._pending) < self.settings["max_pending"])
+
+        if self.settings["spool"]:
+            self._writeSpool(rows)
+        self._pending.extend(rows)
+        if len(self._pending) >= self.settings["batch_size"]:
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def close(self):
+        """
+        Останавливает писатель, дописав в базу все накопленные строки.
+        """
+        if self._writer is None:
+            return
+        await eventloop.submit(self._close())
+
+    async def _close(self):
+        self._closing = True
+        async with self._changed:
+            self._changed.notify_all()
+        await self._writer
+        self._writer = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if self._ownerLock is not None:
+            if not self._segments:
+                os.remove(self._ownerLock.name)
+            self._ownerLock.close()
+            self._ownerLock = None
+
+    # ---- spool
+
+    def _spoolPath(self, pid=None):
+        # the live file of a worker; rotated segments are <it>.<time_ns>-<n>, the owner
+        # holds an exclusive lock on <it>.lock for as long as it runs
+        return f"{self.settings['spool']}.w{os.getpid() if pid is None else pid}"
+
+    def _segmentPath(self):
+        return f"{self._spoolPath()}.{time.time_ns()}-{next(_segmentNumbers)}"
+
+    def _openSpool(self):
+        if self._spool is None:
+            path = self._spoolPath()
+            self._spool = open(path, "a", encoding="utf-8")
+            self._segments.append(path)
+
+    def _writeSpool(self, rows):
+        self._openSpool()
+        self._spool.write("".join(_encode(row) + "\n" for row in rows))
+        self._spool.flush()
+        if self.settings["fsync"]:
+            os.fsync(self._spool.fileno())
+
+    def _rotateSpool(self):
+        # rows appended from now on go to a new file, the current one is
+        # deleted once the batch that holds its rows has been committed
+        if self._spool is None:
+            return
+        self._spool.close()
+        self._spool = None
+        path = self._spoolPath()
+        rotated = self._segmentPath()
+        os.replace(path, rotated)
+        self._segments[self._segments.index(path)] = rotated
+
+    def _recover(self):
+        """
+        Забирает файлы spool процессов, которые уже не работают (их блокировка
+        <файл>.lock свободна), и старые файлы без владельца; файлы работающих
+        процессов не трогаются. Взятые файлы переименовываются в свои и
+        перечитываются в очередь.
+        """
+        spool = self.settings["spool"]
+        if not spool:
+            return
+        own = self._spoolPath()
+        self._ownerLock = _lockFile(own + ".lock")
+
+        adopted = []
+        # one worker at a time, so a dead worker's files are taken over only once
+        with _lockFile(spool + ".lock"):
+            # rows a previous process with this pid left behind are ours as well
+            orphans = _files(own) + [name for name in glob.glob(glob.escape(spool) + ".*")
+                                     if _LEGACY_SEGMENT.fullmatch(name[len(spool):])]
+            if os.path.isfile(spool):
+                orphans.append(spool)
+            for lockPath in glob.glob(glob.escape(spool) + ".w*.lock"):
+                if lockPath == own + ".lock":
+                    continue
+                owner = _lockFile(lockPath, blocking=False)
+                if owner is None:
+                    continue  # the worker is running
+                with owner:
+                    orphans += _files(lockPath[:-len(".lock")])
+                    os.remove(lockPath)
+            for name in sorted(set(orphans)):
+                segment = self._segmentPath()
+                os.replace(name, segment)
+                adopted.append(segment)
+
+        rows = []
+        for segment in adopted:
+            with open(segment, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rows.append(_decode(line))
+                    except ValueError:
+                        # a line cut off by a crash in the middle of a write
+                        log.warning("Skipping damaged history spool line in %s", segment)
+            self._segments.append(segment)
+        if rows:
+            log.info("Recovered %d history rows from %d spool files of %s", len(rows), len(adopted), spool)
+            self._pending[:0] = rows
+
+    # ---- writer
+
+    def _ensureWriter(self):
+        if self._writer is None:
+            self._changed = asyncio.Condition()
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def _write(self):
+        while True:
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(
+                            lambda: self._closing or len(self._pending) >= self.settings["batch_size"]),
+                        self.settings["flush_interval"])
+                except asyncio.TimeoutError:
+                    pass
+
+            if self._pending:
+                await self._flush()
+            if self._closing:
+                return
+
+    async def _flush(self):
+        # everything pending goes in one transaction, so a spool segment is
+        # either committed as a whole or kept for the next attempt
+        self._rotateSpool()
+        batch, self._pending = self._pending, []
+        segments, self._segments = self._segments, []
+        size = self.settings["batch_size"]
+
+        async def copy(conn):
+            async with conn.transaction():
+                for start in range(0, len(batch), size):
+                    await conn.copy_records_to_table("words_history", records=batch[start:start + size],
+                                                     columns=COLUMNS)
+
+        started = time.perf_counter()
+        try:
+            await database.run(copy)
+        except Exception as e:
+            WRITTEN.inc(len(batch), outcome="retried")
+            log.warning("Writing %d history rows failed: %s", len(batch), e)
+            self._pending[:0] = batch
+            self._segments[:0] = segments
+            if self._closing:
+                if not self.settings["spool"]:
+                    log.error("%d history rows are lost", len(self._pending))
+                    WRITTEN.inc(len(self._pending), outcome="lost")
+                return
+            await asyncio.sleep(self.settings["retry_delay"])
+            return
+        FLUSH_SECONDS.observe(time.perf_counter() - started)
+        WRITTEN.inc(len(batch), outcome="written")
+
+        for segment in segments:
+            os.remove(segment)
+        async with self._changed:
+            self._changed.notify_all()
@@ -0,0 +1,84 @@
+import asyncio
+import collections
+
+import database
+import eventloop
+
+# Every change of a learner's words_history bumps their row in history_versions
+# and publishes "user_id:version" on history_changed (schema migration 4). A worker
+# that listens to the channel knows the current version of each learner's history
+# it has seen and answers conditional /getStatistics requests without a query.
+
+CHANNEL = "history_changed"
+
+VERSION_QUERY = "SELECT COALESCE((SELECT version FROM history_versions WHERE user_id = $1), 0)"
+
+
+async def readVersion(conn, userId):
+    """
+    Версия истории повторений пользователя в базе (0 - истории еще не было).
+    """
+    return await conn.fetchval(VERSION_QUERY, userId)
+
+
+class HistoryVersions:
+    """
+    Последние известные процессу версии истории пользователей: прочитанные из
+    базы после подписки на history_changed (remember) или пришедшие уведомлением.
+    Без LISTEN-соединения версии неизвестны; помнится не больше maxUsers пользователей.
+    """
+
+    def __init__(self, maxUsers=10000):
+        self.maxUsers = maxUsers
+        self._versions = collections.OrderedDict()
+        self._listenConn = None
+        self._subscribing = None
+
+    def get(self, userId):
+        if self._listenConn is None or self._listenConn.is_closed():
+            return None
+        return self._versions.get(userId)
+
+    def remember(self, userId, version):
+        """
+        Версия, прочитанная из базы после listen(); более новая из уведомления не затирается.
+        """
+        if self._listenConn is not None:
+            self._put(userId, version)
+
+    def _put(self, userId, version):
+        self._versions[userId] = max(version, self._versions.get(userId, 0))
+        self._versions.move_to_end(userId)
+        while len(self._versions) > self.maxUsers:
+            self._versions.popitem(last=False)
+
+    async def listen(self):
+        """
+        Подписка на history_changed; до чтения версии из базы, чтобы не пропустить изменения.
+        """
+        if self._listenConn is not None and not self._listenConn.is_closed():
+            return
+        await eventloop.submit(self._subscribe())
+
+    async def _subscribe(self):
+        if self._listenConn is not None and not self._listenConn.is_closed():
+            return
+        if self._subscribing is None:
+            self._subscribing = asyncio.ensure_future(database.listen(CHANNEL, self._onNotify, self._onListenerLost))
+        try:
+            self._listenConn = await asyncio.shield(self._subscribing)
+        finally:
+            self._subscribing = None
+
+    def _onListenerLost(self, conn):
+        # notifications may have been missed, nothing known can be trusted
+        self._listenConn = None
+        self._versions.clear()
+
+    def _onNotify(self, conn, pid, channel, payload):
+        userId, _, version = payload.partition(":")
+        try:
+            userId, version = int(userId), int(version)
+        except ValueError:
+            return
+        self._put(userId, version)
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+
+import admission
+import eventloop
+import metrics
+
+# One AsyncOpenAI client per process, living on the background loop so its
+# keep-alive connection pool is reused by every request.
+# The openai package takes longer to import than the rest of the app together,
+# so it is imported with the first client: the server starts without it and
+# preload() brings it in on a worker thread shortly after requests are served.
+
+_client = None
+_scheduler = None
+_stub = None
+
+# the API key is a secret and is not kept in the "llm" section of config.json
+API_KEY_VARIABLE = "DEEPSEEK_API_KEY"
+
+DEFAULT_SETTINGS = {
+    "base_url": "https://api.deepseek.com",
+    "model": "deepseek-chat",
+    "timeout": 60.0,
+    "connect_timeout": 5.0,
+    "max_retries": 2,
+    # requests sent at once; admission (section "admission") decides which request gets a free slot
+    "max_concurrency": 256,
+    "max_connections": 256,
+    "keepalive_expiry": 30.0,
+    # seconds after startup to import the client library on a thread, so the first
+    # LLM request does not pay for it; None - import in the first request.
+    # Importing right away would slow the very first responses (the GIL is shared)
+    "preload_after": 1.0
+}
+_settings = dict(DEFAULT_SETTINGS)
+_admissionSettings = None
+
+# raised by complete() and stream() when a request cannot start in time
+Rejected = admission.Rejected
+
+SYSTEM_PROMPT = "Ты опытный преподаватель английского языка, поэтому ищешь индивидуальный подход к каждому ученику, анализируя его сильные и слабые стороны, предлагаешь такие задание, чтобы изучение английского шло максимально эффективно."
+
+REQUEST_SECONDS = metrics.histogram("llm_request_seconds", "LLM completion latency by endpoint (full response)",
+                                    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0))
+FIRST_TOKEN_SECONDS = metrics.histogram("llm_first_token_seconds", "Time to the first streamed token by endpoint",
+                                        buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+ERRORS = metrics.counter("llm_errors_total", "Failed LLM requests by endpoint")
+IN_FLIGHT = metrics.gauge("llm_in_flight", "LLM requests currently holding a concurrency slot")
+TOKENS = metrics.counter("llm_tokens_total", "Tokens reported by the API by endpoint and kind (prompt, completion)")
+
+
+def configure(config):
+    """
+    Секция "llm" из config.json. Ключ API - переменная окружения DEEPSEEK_API_KEY,
+    без нее - deepseek_api_key из config.json.
+    Бюджеты и приоритеты запросов - секция "admission".
+    """
+    global _settings, _admissionSettings, _client, _scheduler
+    _settings = dict(DEFAULT_SETTINGS)
+    _settings.update(config.get("llm", {}))
+    _settings["api_key"] = os.environ.get(API_KEY_VARIABLE) or config.get("deepseek_api_key")
+    _admissionSettings = config.get("admission")
+    _client = None
+    _scheduler = None
+
+
+def useStub(responder, latency=0.0):
+    """
+    Подменяет внешний API локальной функцией responder(endpoint, prompt, kwargs) -> str
+    с искусственной задержкой latency (для тестов и бенчмарков). None - вернуть API.
+    """
+    global _stub
+    _stub = None if responder is None else (responder, latency)
+
+
+async def _stubComplete(endpoint, prompt, kwargs):
+    responder, latency = _stub
+    await asyncio.sleep(latency)
+    return responder(endpoint, prompt, kwargs)
+
+
+def _importClient():
+    import openai  # noqa: F401
+
+
+async def preload():
+    """
+    Импортирует openai заранее, через preload_after секунд после старта.
+    """
+    if _settings["preload_after"] is None:
+        return
+    await asyncio.sleep(_settings["preload_after"])
+    await asyncio.get_running_loop().run_in_executor(None, _importClient)
+
+
+def _getClient():
+    global _client, _scheduler
+    if _client is None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI(
+            api_key=_settings["api_key"],
+            base_url=_settings["base_url"],
+            max_retries=_settings["max_retries"],
+            timeout=httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"]),
+            http_client=httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=_settings["max_connections"],
+                max_keepalive_connections=_settings["max_connections"],
+                keepalive_expiry=_settings["keepalive_expiry"]
+            ))
+        )
+        if _scheduler is None:
+            _scheduler = admission.Scheduler(_settings["max_concurrency"], _admissionSettings)
+    return _client
+
+
+def _countUsage(endpoint, usage):
+    if usage is None:
+        return
+    TOKENS.inc(usage.prompt_tokens or 0, endpoint=endpoint, kind="prompt")
+    TOKENS.inc(usage.completion_tokens or 0, endpoint=endpoint, kind="completion")
+
+
+def _messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+async def _complete(endpoint, prompt, userId, kwargs):
+    client = _getClient()
+    async with _scheduler.admit(endpoint, userId):
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            if _stub is not None:
+                return await _stubComplete(endpoint, prompt, kwargs)
+            response = await client.chat.completions.create(
+                model=_settings["model"],
+                messages=_messages(prompt),
+                stream=False,
+                **kwargs
+            )
+        except Exception:
+            ERRORS.inc(endpoint=endpoint)
+            raise
+        finally:
+            IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    _countUsage(endpoint, response.usage)
+    return response.choices[0].message.content
+
+
+async def complete(endpoint, prompt, userId=None, **kwargs):
+    """
+    Отправляет prompt (с общим системным промптом) и возвращает текст ответа.
+    Повторы с экспоненциальной задержкой делает сам клиент (max_retries).
+    endpoint и userId - бюджеты и приоритет запроса (admission.py); Rejected,
+    если запрос не может начаться за max_wait своего endpoint.
+    """
+    return await eventloop.submit(_complete(endpoint, prompt, userId, kwargs))
+
+
+async def _stream(endpoint, prompt, userId, kwargs):
+    client = _getClient()
+    async with _scheduler.admit(endpoint, userId):
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        firstToken = True
+        try:
+            if _stub is not None:
+                content = await _stubComplete(endpoint, prompt, kwargs)
+                FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+                words = content.split(" ")
+                for i, word in enumerate(words):
+                    yield word if i == len(words) - 1 else word + " "
+                return
+            response = await client.chat.completions.create(
+                model=_settings["model"],
+                messages=_messages(prompt),
+                stream=True,
+                # usage arrives in a final chunk without choices
+                stream_options={"include_usage": True},
+                **kwargs
+            )
+            async for chunk in response:
+                _countUsage(endpoint, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if firstToken:
+                        firstToken = False
+                        FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+                    yield delta
+        except Exception:
+            ERRORS.inc(endpoint=endpoint)
+            raise
+        finally:
+            IN_FLIGHT.dec()
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+
+
+def stream(endpoint, prompt, userId=None, **kwargs):
+    """
+    Асинхронный генератор фрагментов ответа по мере их прихода от модели
+    (слот занят до конца ответа).
+    """
+    return eventloop.iterate(_stream(endpoint, prompt, userId, kwargs))
@@ -0,0 +1,62 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Records are formatted in the calling thread only if their level is enabled;
+# the actual write to stderr/file happens on the QueueListener thread, so a
+# request never blocks on log I/O.
+
+DEFAULT_SETTINGS = {
+    "level": "INFO",
+    "format": "%(asctime)s %(levelname)s %(name)s: %(message)s",
+    "file": None,
+    # per-logger levels, e.g. httpx logs every API call at INFO
+    "loggers": {"httpx": "WARNING"}
+}
+
+_listener = None
+
+
+def configure(config):
+    """
+    Секция "logging" из config.json: уровень, формат и файл (по умолчанию stderr).
+    """
+    global _listener
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("logging", {}))
+
+    stop()
+    if settings["file"]:
+        handler = logging.FileHandler(settings["file"], encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(settings["format"]))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(settings["level"])
+    for name, level in settings["loggers"].items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+
+def stop():
+    """
+    Дописывает накопленные записи и останавливает поток записи.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop)
@@ -0,0 +1,147 @@
+import bisect
+import threading
+
+# Minimal in-process metrics registry rendered in the Prometheus text format.
+
+_registry = []
+_lock = threading.Lock()
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatLabels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _labelKey(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_labelKey(labels), 0)
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in list(self._values.items())]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, description, callback=None):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._callback = callback
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[_labelKey(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _labelKey(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        return self._values.get(_labelKey(labels), 0)
+
+    def samples(self):
+        if self._callback is not None:
+            # callback returns either a number or {labels dict as tuple: value}
+            value = self._callback()
+            if isinstance(value, dict):
+                return [(self.name, _labelKey(dict(k)), v) for k, v in value.items()]
+            return [(self.name, (), value)]
+        return [(self.name, key, value) for key, value in list(self._values.items())]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _labelKey(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(_labelKey(labels))
+        return state[2] if state else 0
+
+    def samples(self):
+        result = []
+        for key, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets, counts):
+                cumulative += bucketCount
+                result.append((self.name + "_bucket", key + (("le", bound),), cumulative))
+            result.append((self.name + "_bucket", key + (("le", "+Inf"),), count))
+            result.append((self.name + "_sum", key, total))
+            result.append((self.name + "_count", key, count))
+        return result
+
+
+def _register(metric):
+    with _lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, description):
+    return _register(Counter(name, description))
+
+
+def gauge(name, description, callback=None):
+    return _register(Gauge(name, description, callback))
+
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, description, buckets))
+
+
+def render():
+    """
+    Возвращает все метрики в текстовом формате Prometheus.
+    """
+    lines = []
+    for metric in list(_registry):
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_formatLabels(key)} {value}")
+    return "\n".join(lines) + "\n"
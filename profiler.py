@@ -0,0 +1,61 @@
+import collections
+import sys
+import threading
+import time
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "interval": 0.005,
+    "max_seconds": 60.0
+}
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SamplingProfiler:
+    """
+    Статистический профайлер: отдельный поток раз в interval секунд снимает
+    стеки всех остальных потоков (sys._current_frames) и считает их.
+    Сам процесс не инструментируется, поэтому накладные расходы - только
+    на снятие стеков. Результат - collapsed stacks для flamegraph.pl/speedscope.
+    """
+
+    def __init__(self, interval=DEFAULT_SETTINGS["interval"]):
+        self.interval = interval
+        self.samples = 0
+        self._counts = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.is_set():
+            for threadId, frame in sys._current_frames().items():
+                if threadId != own:
+                    self._counts[_collapse(frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        """
+        Строки "frame;frame;frame count", самые частые стеки первыми.
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self._counts.most_common()) + "\n"
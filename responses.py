@@ -0,0 +1,163 @@
+import gzip
+import zlib
+
+import orjson
+from quart import Response
+from quart.wrappers.response import DataBody, IterableBody
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional: without it responses are gzip-compressed only
+    brotli = None
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # smaller bodies are sent as is, compression would not pay for itself
+    "min_size": 1024,
+    "gzip_level": 5,
+    "brotli_quality": 4
+}
+
+# numpy values from the word store and the schedulers, int keys such as word ids;
+# datetimes are written as RFC 3339 strings
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/plain", "text/html")
+
+RESPONSE_BYTES = metrics.counter("http_response_bytes_total", "Bytes of non-streamed response bodies, by content encoding")
+
+_settings = dict(DEFAULT_SETTINGS)
+
+
+def configure(config):
+    """
+    Секция "compression" из config.json.
+    """
+    global _settings
+    _settings = dict(DEFAULT_SETTINGS)
+    _settings.update(config.get("compression", {}))
+
+
+def dumps(value):
+    """
+    JSON в bytes (UTF-8); Word и другие dataclass сериализуются напрямую.
+    """
+    return orjson.dumps(value, option=OPTIONS)
+
+
+def json(value, status=200, headers=None):
+    return Response(dumps(value), status, headers, mimetype="application/json")
+
+
+def error(message, status, headers=None):
+    return json({"success": False, "error": message}, status, headers)
+
+
+def etag(*parts):
+    """
+    Значение ETag из частей версии ответа, например etag("words", userId, version).
+    """
+    return "-".join(str(part) for part in parts)
+
+
+def tagged(response, tag):
+    """
+    Ответ для условных запросов (If-None-Match). ETag слабый: тело может быть
+    сжато или нет; no-cache - браузер переспрашивает каждый раз и получает 304.
+    """
+    response.set_etag(tag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def notModified(tag):
+    return tagged(Response(b"", 304), tag)
+
+
+def negotiate(acceptEncoding):
+    """
+    Кодирование по заголовку Accept-Encoding: "br", "gzip" или None.
+    """
+    accepted = {}
+    for item in (acceptEncoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    wildcard = accepted.get("*", 0.0)
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def _compressor(encoding):
+    # (process, flush, finish) of a streaming compressor
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=_settings["brotli_quality"])
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(_settings["gzip_level"], zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=_settings["brotli_quality"])
+    return gzip.compress(data, compresslevel=_settings["gzip_level"])
+
+
+async def _compressStream(chunks, encoding):
+    # every chunk is flushed, so streamed responses still arrive chunk by chunk
+    process, flush, finish = _compressor(encoding)
+    try:
+        async for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            data = process(chunk) + flush()
+            if data:
+                yield data
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+    yield finish()
+
+
+async def encode(response, acceptEncoding):
+    """
+    Сжимает ответ (after_request), если клиент это принимает и тип ответа подходит.
+    Потоковые ответы сжимаются по частям; SSE не сжимается.
+    """
+    if not _settings["enabled"] or "Content-Encoding" in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_TYPES or response.status_code in (204, 304):
+        return response
+
+    encoding = negotiate(acceptEncoding)
+    response.vary.add("Accept-Encoding")
+    if isinstance(response.response, IterableBody):
+        if encoding is not None:
+            response.response = IterableBody(_compressStream(response.response.iter, encoding))
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = encoding
+        return response
+    if not isinstance(response.response, DataBody):
+        return response
+
+    data = await response.get_data()
+    if encoding is not None and len(data) >= _settings["min_size"]:
+        data = compress(data, encoding)
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+    RESPONSE_BYTES.inc(len(data), encoding=response.headers.get("Content-Encoding", "identity"))
+    return response
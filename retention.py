@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import logging
+import re
+
+import database
+import eventloop
+import metrics
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # seconds between maintenance runs
+    "interval": 3600.0,
+    # monthly words_history partitions created in advance
+    "months_ahead": 2,
+    # partitions older than this many months are compacted into words_history_daily, None - never
+    "compact_after_months": 12,
+    # words_deleted tombstones are kept this many days; a word snapshot older
+    # than that can no longer be caught up (snapshot.py max_age must be shorter)
+    "tombstone_days": 7
+}
+
+COMPACTED = metrics.counter("history_partitions_compacted_total", "Monthly history partitions compacted into daily aggregates")
+MAINTENANCE_SECONDS = metrics.histogram("history_maintenance_seconds", "Time of one history maintenance run")
+
+log = logging.getLogger(__name__)
+
+_PARTITION_RE = re.compile(r"^words_history_p(\d{4})(\d{2})$")
+_LOCK = "hashtext('words-repeater-history-maintenance')"
+
+_task = None
+
+
+def _addMonths(day, months):
+    month = day.year * 12 + day.month - 1 + months
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+async def partitions(conn):
+    """
+    [(первый день месяца, имя партиции)] помесячных партиций words_history по порядку.
+    """
+    rows = await conn.fetch("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'words_history'::regclass
+    """)
+    result = []
+    for row in rows:
+        match = _PARTITION_RE.match(row["relname"])
+        if match:
+            result.append((datetime.date(int(match.group(1)), int(match.group(2)), 1), row["relname"]))
+    return sorted(result)
+
+
+async def compactPartition(conn, name):
+    """
+    Сворачивает партицию в строки words_history_daily (пользователь, слово, день,
+    repeatindex) и удаляет ее. Итоги в history_* не меняются.
+    """
+    async with conn.transaction():
+        await conn.execute(f"""
+            INSERT INTO words_history_daily (user_id, word_id, day, repeatindex, repetitions, successes)
+            SELECT user_id, word_id, repeatdate::date, COALESCE(repeatindex, 0),
+                   COUNT(*), COUNT(*) FILTER (WHERE success)
+            FROM "{name}"
+            GROUP BY user_id, word_id, repeatdate::date, COALESCE(repeatindex, 0)
+            ON CONFLICT (user_id, word_id, day, repeatindex) DO UPDATE
+            SET repetitions = words_history_daily.repetitions + EXCLUDED.repetitions,
+                successes = words_history_daily.successes + EXCLUDED.successes
+        """)
+        # dropping a partition fires no DELETE triggers, the rollups keep its rows
+        await conn.execute(f'ALTER TABLE words_history DETACH PARTITION "{name}"')
+        await conn.execute(f'DROP TABLE "{name}"')
+
+
+async def maintain(conn, settings, today=None):
+    """
+    Создает партиции на months_ahead месяцев вперед, сворачивает старые
+    и удаляет устаревшие записи words_deleted.
+    Если обслуживание уже идет в другом процессе, ничего не делает.
+    Возвращает имена свернутых партиций.
+    """
+    today = today or datetime.date.today()
+    if not await conn.fetchval(f"SELECT pg_try_advisory_lock({_LOCK})"):
+        return []
+    try:
+        await conn.execute("SELECT words_history_create_partitions($1, $2)",
+                           today, _addMonths(today, settings["months_ahead"]))
+
+        compacted = []
+        if settings["compact_after_months"] is not None:
+            cutoff = _addMonths(today, -settings["compact_after_months"])
+            for month, name in await partitions(conn):
+                if month < cutoff:
+                    await compactPartition(conn, name)
+                    COMPACTED.inc()
+                    compacted.append(name)
+
+        # clients that synced before the newest pruned tombstone get the whole dictionary (/getWords?since=)
+        await conn.execute("""
+            WITH pruned AS (
+                DELETE FROM words_deleted WHERE deleted_at < NOW() - make_interval(days => $1)
+                RETURNING version
+            )
+            INSERT INTO words_deleted_horizon (id, version)
+            SELECT TRUE, MAX(version) FROM pruned HAVING COUNT(*) > 0
+            ON CONFLICT (id) DO UPDATE SET version = GREATEST(words_deleted_horizon.version, EXCLUDED.version)
+        """, settings["tombstone_days"])
+        return compacted
+    finally:
+        await conn.execute(f"SELECT pg_advisory_unlock({_LOCK})")
+
+
+async def _maintenanceLoop(settings):
+    while True:
+        started = asyncio.get_running_loop().time()
+        try:
+            compacted = await database.run(maintain, settings)
+            if compacted:
+                log.info("Compacted history partitions: %s", ", ".join(compacted))
+        except Exception as e:
+            log.warning("History maintenance failed: %s", e)
+        MAINTENANCE_SECONDS.observe(asyncio.get_running_loop().time() - started)
+        await asyncio.sleep(settings["interval"])
+
+
+def start(config):
+    """
+    Запускает периодическое обслуживание words_history по секции "history_retention".
+    """
+    global _task
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("history_retention", {}))
+    if settings["enabled"] and _task is None:
+        _task = eventloop.spawn(_maintenanceLoop(settings))
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
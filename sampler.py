@@ -0,0 +1,131 @@
+import random
+
+import numpy as np
+
+
+def cleanWeights(weights):
+    # negative, NaN and infinite weights are never sampled
+    weights = np.ascontiguousarray(weights, dtype=np.float64).copy()
+    weights[~np.isfinite(weights) | (weights < 0)] = 0
+    return weights
+
+
+def fenwickTree(weights):
+    """
+    Дерево Фенвика (size + 1 элементов, tree[0] не используется) по очищенным весам.
+    """
+    # tree[i] = sum(weights[i - lowbit(i) .. i - 1]) for 1-based i
+    size = len(weights)
+    prefix = np.concatenate(([0.0], np.cumsum(weights)))
+    indexes = np.arange(1, size + 1)
+    lowBits = indexes & -indexes
+    tree = np.zeros(size + 1, dtype=np.float64)
+    tree[1:] = prefix[indexes] - prefix[indexes - lowBits]
+    return tree
+
+
+class WeightedSampler:
+    """
+    Взвешенная выборка без возвращения по дереву Фенвика.
+
+    Веса лежат в непрерывном float64 массиве, индекс - номер слота WordStore.
+    Полная перестройка векторизована (O(n) в numpy), изменение одного веса
+    и выбор одного элемента - O(log n).
+    """
+
+    def __init__(self, capacity=0):
+        self.weights = np.zeros(capacity, dtype=np.float64)
+        self._tree = np.zeros(capacity + 1, dtype=np.float64)
+        self._topBit = 1 << max(capacity, 1).bit_length()
+
+    def __len__(self):
+        return len(self.weights)
+
+    def rebuild(self, weights):
+        weights = cleanWeights(weights)
+        self.attach(weights, fenwickTree(weights))
+
+    def attach(self, weights, tree):
+        """
+        Готовые weights (уже очищенные) и дерево fenwickTree(weights) без копирования,
+        например отображенные из снимка (snapshot.py).
+        """
+        self.weights = weights
+        self._tree = tree
+        self._topBit = 1 << max(len(weights), 1).bit_length()
+
+    def resize(self, capacity):
+        if capacity <= len(self.weights):
+            return
+        weights = np.zeros(capacity, dtype=np.float64)
+        weights[:len(self.weights)] = self.weights
+        self.rebuild(weights)
+
+    def _add(self, slot, delta):
+        tree = self._tree
+        size = len(tree)
+        i = slot + 1
+        while i < size:
+            tree[i] += delta
+            i += i & -i
+
+    def update(self, slot, weight):
+        if not weight > 0:
+            weight = 0.0
+        delta = weight - self.weights[slot]
+        if delta:
+            self.weights[slot] = weight
+            self._add(slot, delta)
+
+    def total(self):
+        # sum of the whole array, O(log n)
+        tree = self._tree
+        i = len(tree) - 1
+        result = 0.0
+        while i > 0:
+            result += tree[i]
+            i -= i & -i
+        return result
+
+    def _find(self, target):
+        """
+        Наименьший слот, для которого сумма весов до него включительно > target.
+        """
+        tree = self._tree
+        size = len(tree)
+        position = 0
+        bit = self._topBit
+        while bit:
+            nextPosition = position + bit
+            if nextPosition < size and tree[nextPosition] <= target:
+                position = nextPosition
+                target -= tree[nextPosition]
+            bit >>= 1
+        return position
+
+    def sample(self, count):
+        """
+        count разных слотов с вероятностью, пропорциональной весу (без возвращения).
+        Выбранные слоты временно обнуляются и затем восстанавливаются.
+        """
+        chosen = []
+        removed = []
+        try:
+            while len(chosen) < count:
+                total = self.total()
+                if total <= 0:
+                    break
+                slot = self._find(random.random() * total)
+                if slot >= len(self.weights) or self.weights[slot] <= 0:
+                    # rounding at the very end of the range
+                    slot = int(np.flatnonzero(self.weights)[-1])
+                chosen.append(slot)
+                weight = float(self.weights[slot])
+                removed.append((slot, weight))
+                self.weights[slot] = 0.0
+                self._add(slot, -weight)
+        finally:
+            for slot, weight in removed:
+                self.weights[slot] = weight
+                self._add(slot, weight)
+        return chosen
@@ -0,0 +1,257 @@
+import collections
+
+import numpy as np
+
+# Spaced-repetition schedulers with a batch API: every call takes NumPy arrays
+# for a whole submission (or a whole replay round) and returns arrays, so the
+# cost per word is a handful of vector operations regardless of the algorithm.
+
+DAY = np.timedelta64(86400 * 10 ** 6, "us")
+NO_TIME = np.datetime64("NaT", "us")
+
+DEFAULT_SETTINGS = {
+    "algorithm": "ladder",
+    "ladder_days": [0, 1, 2, 3, 7, 14],
+    "sm2": {
+        "initial_ease": 2.5,
+        "min_ease": 1.3,
+        "maximum_interval": 36500
+    },
+    "fsrs": {
+        "desired_retention": 0.9,
+        "maximum_interval": 36500,
+        # FSRS-4.5 default parameters
+        "weights": [0.4872, 1.4003, 3.7145, 13.8206, 5.1618, 1.2298, 0.8975, 0.031, 1.6474,
+                    0.1367, 1.0461, 2.1072, 0.0793, 0.3246, 1.587, 0.2272, 2.8755]
+    }
+}
+
+# Scheduling state of a batch of words, one array per field:
+# repeatIndex - consecutive successful reviews (the ladder step for "ladder"),
+# ease - SM-2 easiness factor, stability - memory stability / current interval in days,
+# difficulty - FSRS difficulty (0 = never reviewed), lapses - failed reviews,
+# lastRepeatTime / nextRepeatTime - datetime64[us], NaT if unknown.
+State = collections.namedtuple(
+    "State", "repeatIndex ease stability difficulty lapses lastRepeatTime nextRepeatTime")
+
+# columns of the words table holding State, in State field order
+COLUMNS = ("repeatindex", "ease", "stability", "difficulty", "lapses", "lastrepeattime", "nextrepeattime")
+
+
+def emptyState(count, ease=2.5):
+    return State(
+        repeatIndex=np.zeros(count, dtype=np.int32),
+        ease=np.full(count, ease, dtype=np.float64),
+        stability=np.zeros(count, dtype=np.float64),
+        difficulty=np.zeros(count, dtype=np.float64),
+        lapses=np.zeros(count, dtype=np.int32),
+        lastRepeatTime=np.full(count, NO_TIME),
+        nextRepeatTime=np.full(count, NO_TIME)
+    )
+
+
+def stateFromRows(rows, ease=2.5):
+    """
+    State из строк таблицы words (None в столбцах - значения по умолчанию).
+    """
+    def column(name, dtype, default):
+        return np.array([default if row[name] is None else row[name] for row in rows], dtype=dtype)
+
+    return State(
+        repeatIndex=column("repeatindex", np.int32, 0),
+        ease=column("ease", np.float64, ease),
+        stability=column("stability", np.float64, 0.0),
+        difficulty=column("difficulty", np.float64, 0.0),
+        lapses=column("lapses", np.int32, 0),
+        lastRepeatTime=column("lastrepeattime", "datetime64[us]", NO_TIME),
+        nextRepeatTime=column("nextrepeattime", "datetime64[us]", NO_TIME)
+    )
+
+
+def toColumns(state):
+    """
+    Списки Python по COLUMNS для передачи в asyncpg (datetime, NaT -> None).
+    """
+    return [array.tolist() for array in state]
+
+
+def updateWeights(weights, success, settings):
+    """
+    Веса для выбора слов в тексты: ошибка увеличивает вес, успех уменьшает.
+    settings - appconfig.TextGeneration.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = np.where(np.isnan(weights), settings.defaultWeight, weights)
+    return np.where(
+        success,
+        np.maximum(weights * settings.weightDecreaseSuccess, settings.minWeight),
+        np.minimum(1 + weights * settings.weightIncreaseFail, settings.maxWeight)
+    )
+
+
+def _days(days):
+    return np.rint(np.asarray(days, dtype=np.float64) * 86400 * 10 ** 6).astype("timedelta64[us]")
+
+
+def _elapsedDays(state, now):
+    elapsed = (now - state.lastRepeatTime) / DAY
+    return np.where(np.isnat(state.lastRepeatTime), 0.0, np.maximum(elapsed, 0.0))
+
+
+class Scheduler:
+    """
+    Общий интерфейс алгоритмов.
+
+    review(state, success, now, keepDue, keepProgress) -> (новый State):
+    success - bool массив результатов, now - datetime64[us] (скаляр или массив).
+    keepProgress - успехи не продвигают состояние (повтор вне расписания),
+    keepDue - время следующего повторения не меняется.
+
+    retrievability(state, now) - прогноз вероятности вспомнить слово, для replay.
+    """
+
+    name = None
+
+    def __init__(self, settings=None):
+        self.settings = settings or {}
+
+    def _advance(self, state, success, now):
+        raise NotImplementedError
+
+    def review(self, state, success, now, keepDue=False, keepProgress=False):
+        success = np.asarray(success, dtype=bool)
+        now = np.broadcast_to(np.asarray(now, dtype="datetime64[us]"), success.shape)
+        advanced = self._advance(state, success, now)
+        if keepProgress:
+            advanced = State(*(np.where(success, old, new) for old, new in zip(state, advanced)))
+        if keepDue:
+            advanced = advanced._replace(nextRepeatTime=state.nextRepeatTime.copy())
+        return advanced
+
+    def retrievability(self, state, now):
+        # interval schedulers aim at ~90% recall when a word becomes due
+        interval = np.maximum(state.stability, 1.0)
+        return np.where(state.stability > 0, 0.9 ** (_elapsedDays(state, now) / interval), 0.0)
+
+
+class LadderScheduler(Scheduler):
+    """
+    Исходная лестница: шаг repeatIndex -> интервал ladder_days[шаг] дней,
+    ошибка возвращает на шаг 1, последний интервал повторяется дальше.
+    """
+
+    name = "ladder"
+
+    def _advance(self, state, success, now):
+        ladder = np.asarray(self.settings.get("ladder_days", DEFAULT_SETTINGS["ladder_days"]), dtype=np.float64)
+        repeatIndex = np.where(success, state.repeatIndex + 1, 1).astype(np.int32)
+        interval = ladder[np.minimum(repeatIndex, len(ladder) - 1)]
+        return state._replace(
+            repeatIndex=repeatIndex,
+            stability=interval,
+            lapses=state.lapses + (~success),
+            lastRepeatTime=now.copy(),
+            nextRepeatTime=now + _days(interval)
+        )
+
+
+class SM2Scheduler(Scheduler):
+    """
+    SuperMemo SM-2 с двоичной оценкой: успех = качество 4, ошибка = 1.
+    stability хранит текущий интервал в днях.
+    """
+
+    name = "sm2"
+
+    def _advance(self, state, success, now):
+        minEase = self.settings.get("min_ease", 1.3)
+        quality = np.where(success, 4, 1)
+        ease = np.maximum(state.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02), minEase)
+
+        interval = np.where(
+            state.repeatIndex == 0, 1.0,
+            np.where(state.repeatIndex == 1, 6.0, np.rint(np.maximum(state.stability, 1.0) * state.ease)))
+        interval = np.where(success, interval, 1.0)
+        interval = np.minimum(interval, self.settings.get("maximum_interval", 36500))
+
+        return state._replace(
+            repeatIndex=np.where(success, state.repeatIndex + 1, 0).astype(np.int32),
+            ease=ease,
+            stability=interval,
+            lapses=state.lapses + (~success),
+            lastRepeatTime=now.copy(),
+            nextRepeatTime=now + _days(interval)
+        )
+
+
+class FSRSScheduler(Scheduler):
+    """
+    FSRS-4.5 с двоичной оценкой (Again / Good). Интервал подбирается так,
+    чтобы к следующему повторению вероятность вспомнить была desired_retention.
+    """
+
+    name = "fsrs"
+    DECAY = -0.5
+    FACTOR = 19 / 81
+
+    def __init__(self, settings=None):
+        super().__init__(settings)
+        self.w = np.asarray(self.settings.get("weights", DEFAULT_SETTINGS["fsrs"]["weights"]), dtype=np.float64)
+        self.retention = self.settings.get("desired_retention", 0.9)
+
+    def _retrievability(self, elapsed, stability):
+        return (1 + self.FACTOR * elapsed / np.maximum(stability, 1e-6)) ** self.DECAY
+
+    def retrievability(self, state, now):
+        return np.where(state.difficulty > 0,
+                        self._retrievability(_elapsedDays(state, now), state.stability), 0.0)
+
+    def _initialDifficulty(self, grade):
+        return np.clip(self.w[4] - (grade - 3) * self.w[5], 1, 10)
+
+    def _advance(self, state, success, now):
+        w = self.w
+        grade = np.where(success, 3, 1)
+        new = state.difficulty <= 0
+        elapsed = _elapsedDays(state, now)
+        recall = self._retrievability(elapsed, state.stability)
+
+        difficulty = state.difficulty - w[6] * (grade - 3)
+        difficulty = w[7] * self._initialDifficulty(3) + (1 - w[7]) * difficulty
+        difficulty = np.where(new, self._initialDifficulty(grade), np.clip(difficulty, 1, 10))
+
+        stability = np.maximum(state.stability, 1e-6)
+        recalled = stability * (np.exp(w[8]) * (11 - state.difficulty) * stability ** -w[9]
+                                * (np.exp(w[10] * (1 - recall)) - 1) + 1)
+        forgotten = np.minimum(w[11] * np.maximum(state.difficulty, 1) ** -w[12]
+                               * ((stability + 1) ** w[13] - 1) * np.exp(w[14] * (1 - recall)), stability)
+        stability = np.where(new, w[grade - 1], np.where(success, recalled, forgotten))
+
+        interval = stability / self.FACTOR * (self.retention ** (1 / self.DECAY) - 1)
+        interval = np.clip(np.rint(interval), 1, self.settings.get("maximum_interval", 36500))
+
+        return state._replace(
+            repeatIndex=np.where(success, state.repeatIndex + 1, 0).astype(np.int32),
+            stability=stability,
+            difficulty=difficulty,
+            lapses=state.lapses + (~success),
+            lastRepeatTime=now.copy(),
+            nextRepeatTime=now + _days(interval)
+        )
+
+
+ALGORITHMS = {cls.name: cls for cls in (LadderScheduler, SM2Scheduler, FSRSScheduler)}
+
+
+def create(config, algorithm=None):
+    """
+    Планировщик по секции "scheduler" config.json (или явно указанному алгоритму).
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("scheduler", {}))
+    algorithm = algorithm or settings["algorithm"]
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown scheduler '{algorithm}', expected one of {', '.join(ALGORITHMS)}")
+    if algorithm == "ladder":
+        return LadderScheduler(settings)
+    return ALGORITHMS[algorithm](dict(DEFAULT_SETTINGS[algorithm], **settings.get(algorithm, {})))
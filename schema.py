@@ -0,0 +1,596 @@
+import logging
+
+# Schema changes are numbered migrations (MIGRATIONS), applied in order when the
+# connection pool is created; applied versions are recorded in schema_migrations.
+# New changes go into a new migration, applied ones are never edited.
+
+log = logging.getLogger(__name__)
+
+_HISTORY_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS words_history_rollup_insert ON words_history",
+    """
+    CREATE TRIGGER words_history_rollup_insert
+    AFTER INSERT ON words_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION words_history_rollup_insert()
+    """,
+    "DROP TRIGGER IF EXISTS words_history_rollup_delete ON words_history",
+    """
+    CREATE TRIGGER words_history_rollup_delete
+    AFTER DELETE ON words_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION words_history_rollup_delete()
+    """,
+]
+
+# Baseline: idempotent DDL from before schema_migrations existed, so it is also
+# safe on databases that already have all of it.
+STATEMENTS = [
+    # every row belongs to a learner; rows written before multi-user support
+    # belong to learner 1, which is also the default for requests without a user.
+    # words_history repeats user_id so the statistics rollups need no join.
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS user_id BIGINT NOT NULL DEFAULT 1",
+    "ALTER TABLE words_history ADD COLUMN IF NOT EXISTS user_id BIGINT NOT NULL DEFAULT 1",
+
+    # spaced-repetition state for the SM-2 / FSRS schedulers (scheduler.py);
+    # the ladder keeps using repeatindex only. success lets replay.py score
+    # the algorithms against real outcomes.
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS ease DOUBLE PRECISION NOT NULL DEFAULT 2.5",
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS stability DOUBLE PRECISION NOT NULL DEFAULT 0",
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS difficulty DOUBLE PRECISION NOT NULL DEFAULT 0",
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS lapses INT NOT NULL DEFAULT 0",
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS lastrepeattime TIMESTAMP",
+    "ALTER TABLE words_history ADD COLUMN IF NOT EXISTS success BOOLEAN",
+
+    # due-word selection in /repeatWords: WHERE user_id = $1 AND nextrepeattime < now.
+    # user_id leads every index, so one learner's queries only touch their own rows
+    "CREATE INDEX IF NOT EXISTS words_user_nextrepeattime_idx ON words (user_id, nextrepeattime)",
+    "DROP INDEX IF EXISTS words_nextrepeattime_idx",
+    "CREATE INDEX IF NOT EXISTS words_user_word_id_idx ON words (user_id, word_id)",
+    "CREATE INDEX IF NOT EXISTS words_history_user_repeatdate_idx ON words_history (user_id, repeatdate)",
+
+    # /addWord and /importWords skip spellings the learner already has; the unique
+    # index lets ON CONFLICT DO NOTHING settle concurrent inserts. A database that
+    # still holds duplicate spellings gets a plain index until they are cleaned up.
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('words_user_word_key') IS NULL THEN
+            IF NOT EXISTS (SELECT 1 FROM words GROUP BY user_id, word HAVING COUNT(*) > 1) THEN
+                CREATE UNIQUE INDEX words_user_word_key ON words (user_id, word);
+                DROP INDEX IF EXISTS words_user_word_idx;
+            ELSIF to_regclass('words_user_word_idx') IS NULL THEN
+                CREATE INDEX words_user_word_idx ON words (user_id, word);
+            END IF;
+        END IF;
+        DROP INDEX IF EXISTS words_word_key;
+        DROP INDEX IF EXISTS words_word_idx;
+    END
+    $$
+    """,
+
+    # "user_id:word_id" of every changed row is published on the words_changed
+    # channel, the learner's in-memory WordStore of every worker refreshes just those rows
+    """
+    CREATE OR REPLACE FUNCTION words_notify_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('words_changed', OLD.user_id || ':' || OLD.word_id);
+        ELSE
+            PERFORM pg_notify('words_changed', NEW.user_id || ':' || NEW.word_id);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS words_notify_change ON words",
+    """
+    CREATE TRIGGER words_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON words
+    FOR EACH ROW EXECUTE FUNCTION words_notify_change()
+    """,
+
+    # /getWords?q= substring search on word and translation; pg_trgm may be
+    # unavailable (no contrib or no privilege), then search is a plain scan
+    """
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'pg_trgm is not available: %', SQLERRM;
+    END
+    $$
+    """,
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+            CREATE INDEX IF NOT EXISTS words_word_trgm_idx ON words USING gin (word gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS words_translation_trgm_idx ON words USING gin (translation gin_trgm_ops);
+        END IF;
+    END
+    $$
+    """,
+
+    # persistent tier of the /checkText explanation cache
+    """
+    CREATE TABLE IF NOT EXISTS explanation_cache (
+        key TEXT PRIMARY KEY,
+        explanation TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS explanation_cache_created_at_idx ON explanation_cache (created_at)",
+
+    # /getStatistics rollups per learner, maintained by statement-level triggers on
+    # words_history. Rollups from before multi-user support are dropped and rebuilt
+    # by the backfill below.
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('history_daily') IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'history_daily' AND column_name = 'user_id'
+        ) THEN
+            DROP TABLE IF EXISTS history_daily, history_word, history_index;
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history_daily (
+        user_id BIGINT NOT NULL,
+        day DATE NOT NULL,
+        repetitions BIGINT NOT NULL,
+        PRIMARY KEY (user_id, day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS history_word (
+        user_id BIGINT NOT NULL,
+        word_id BIGINT NOT NULL,
+        repetitions BIGINT NOT NULL,
+        PRIMARY KEY (user_id, word_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS history_word_user_repetitions_idx ON history_word (user_id, repetitions DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS history_index (
+        user_id BIGINT NOT NULL,
+        repeatindex INT NOT NULL,
+        repetitions BIGINT NOT NULL,
+        PRIMARY KEY (user_id, repeatindex)
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_history_rollup_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO history_daily (user_id, day, repetitions)
+        SELECT user_id, DATE(repeatdate), COUNT(*) FROM new_rows GROUP BY user_id, DATE(repeatdate)
+        ON CONFLICT (user_id, day) DO UPDATE SET repetitions = history_daily.repetitions + EXCLUDED.repetitions;
+
+        INSERT INTO history_word (user_id, word_id, repetitions)
+        SELECT user_id, word_id, COUNT(*) FROM new_rows GROUP BY user_id, word_id
+        ON CONFLICT (user_id, word_id) DO UPDATE SET repetitions = history_word.repetitions + EXCLUDED.repetitions;
+
+        INSERT INTO history_index (user_id, repeatindex, repetitions)
+        SELECT user_id, repeatindex, COUNT(*) FROM new_rows GROUP BY user_id, repeatindex
+        ON CONFLICT (user_id, repeatindex) DO UPDATE SET repetitions = history_index.repetitions + EXCLUDED.repetitions;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_history_rollup_delete() RETURNS trigger AS $$
+    BEGIN
+        UPDATE history_daily h SET repetitions = h.repetitions - d.repetitions
+        FROM (SELECT user_id, DATE(repeatdate) AS day, COUNT(*) AS repetitions
+              FROM old_rows GROUP BY user_id, DATE(repeatdate)) d
+        WHERE h.user_id = d.user_id AND h.day = d.day;
+
+        UPDATE history_word h SET repetitions = h.repetitions - d.repetitions
+        FROM (SELECT user_id, word_id, COUNT(*) AS repetitions FROM old_rows GROUP BY user_id, word_id) d
+        WHERE h.user_id = d.user_id AND h.word_id = d.word_id;
+
+        UPDATE history_index h SET repetitions = h.repetitions - d.repetitions
+        FROM (SELECT user_id, repeatindex, COUNT(*) AS repetitions FROM old_rows GROUP BY user_id, repeatindex) d
+        WHERE h.user_id = d.user_id AND h.repeatindex = d.repeatindex;
+
+        DELETE FROM history_daily WHERE repetitions <= 0;
+        DELETE FROM history_word WHERE repetitions <= 0;
+        DELETE FROM history_index WHERE repetitions <= 0;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    *_HISTORY_TRIGGERS,
+    # one-time backfill; the triggers above lock words_history until commit,
+    # so no insert can slip between the backfill and the triggers
+    """
+    INSERT INTO history_daily (user_id, day, repetitions)
+    SELECT user_id, DATE(repeatdate), COUNT(*) FROM words_history
+    WHERE NOT EXISTS (SELECT 1 FROM history_daily)
+    GROUP BY user_id, DATE(repeatdate)
+    """,
+    """
+    INSERT INTO history_word (user_id, word_id, repetitions)
+    SELECT user_id, word_id, COUNT(*) FROM words_history
+    WHERE NOT EXISTS (SELECT 1 FROM history_word)
+    GROUP BY user_id, word_id
+    """,
+    """
+    INSERT INTO history_index (user_id, repeatindex, repetitions)
+    SELECT user_id, repeatindex, COUNT(*) FROM words_history
+    WHERE NOT EXISTS (SELECT 1 FROM history_index)
+    GROUP BY user_id, repeatindex
+    """,
+]
+
+
+# words_history range-partitioned by month of repeatdate. Rows already in the
+# history_* rollups are copied without firing the rollup triggers, which are
+# created on the new table afterwards. Rows without repeatdate, or outside every
+# monthly partition, land in words_history_default.
+HISTORY_PARTITIONS = [
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass('words_history') AND relkind = 'r') THEN
+            ALTER TABLE words_history RENAME TO words_history_unpartitioned;
+        END IF;
+    END
+    $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS words_history (
+        user_id BIGINT NOT NULL DEFAULT 1,
+        word_id BIGINT NOT NULL,
+        repeatindex INT,
+        repeatdate TIMESTAMP DEFAULT NOW(),
+        success BOOLEAN
+    ) PARTITION BY RANGE (repeatdate)
+    """,
+    "CREATE TABLE IF NOT EXISTS words_history_default PARTITION OF words_history DEFAULT",
+
+    # words_history_pYYYYMM for every month from from_day to to_day; rows of that month
+    # already in the default partition are moved into the new partition
+    """
+    CREATE OR REPLACE FUNCTION words_history_create_partitions(from_day DATE, to_day DATE) RETURNS void AS $$
+    DECLARE
+        month_start DATE := date_trunc('month', from_day)::date;
+        month_end DATE;
+        partition_name TEXT;
+    BEGIN
+        WHILE month_start <= to_day LOOP
+            month_end := (month_start + INTERVAL '1 month')::date;
+            partition_name := 'words_history_p' || to_char(month_start, 'YYYYMM');
+            IF to_regclass(partition_name) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I (LIKE words_history INCLUDING DEFAULTS)', partition_name);
+                EXECUTE format('INSERT INTO %I SELECT * FROM words_history_default '
+                               'WHERE repeatdate >= %L AND repeatdate < %L', partition_name, month_start, month_end);
+                EXECUTE format('DELETE FROM words_history_default WHERE repeatdate >= %L AND repeatdate < %L',
+                               month_start, month_end);
+                EXECUTE format('ALTER TABLE words_history ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+            END IF;
+            month_start := month_end;
+        END LOOP;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('words_history_unpartitioned') IS NOT NULL THEN
+            PERFORM words_history_create_partitions(
+                COALESCE((SELECT MIN(repeatdate) FROM words_history_unpartitioned)::date, CURRENT_DATE),
+                CURRENT_DATE + 62);
+            INSERT INTO words_history (user_id, word_id, repeatindex, repeatdate, success)
+            SELECT user_id, word_id, repeatindex, repeatdate, success FROM words_history_unpartitioned;
+            DROP TABLE words_history_unpartitioned;
+        ELSE
+            PERFORM words_history_create_partitions(CURRENT_DATE, CURRENT_DATE + 62);
+        END IF;
+    END
+    $$
+    """,
+
+    # indexes on the parent are created on every partition, including future ones:
+    # /deleteWord and the rollup triggers look rows up by (user_id, word_id);
+    # history is appended in time order, so a BRIN index serves date ranges
+    # (retention, replay) at a few pages per partition
+    "CREATE INDEX IF NOT EXISTS words_history_user_word_idx ON words_history (user_id, word_id)",
+    "CREATE INDEX IF NOT EXISTS words_history_user_repeatdate_idx ON words_history (user_id, repeatdate)",
+    "CREATE INDEX IF NOT EXISTS words_history_repeatdate_brin ON words_history USING brin (repeatdate)",
+    *_HISTORY_TRIGGERS,
+
+    # compacted history (retention.py): months older than compact_after_months
+    # become one row per learner, word, day and repeatindex. Their rows stay in
+    # the rollups; deleting compacted rows takes them out like deleting history does
+    """
+    CREATE TABLE IF NOT EXISTS words_history_daily (
+        user_id BIGINT NOT NULL,
+        word_id BIGINT NOT NULL,
+        day DATE NOT NULL,
+        repeatindex INT NOT NULL,
+        repetitions BIGINT NOT NULL,
+        successes BIGINT NOT NULL,
+        PRIMARY KEY (user_id, word_id, day, repeatindex)
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_history_daily_rollup_delete() RETURNS trigger AS $$
+    BEGIN
+        UPDATE history_daily h SET repetitions = h.repetitions - d.repetitions
+        FROM (SELECT user_id, day, SUM(repetitions) AS repetitions FROM old_rows GROUP BY user_id, day) d
+        WHERE h.user_id = d.user_id AND h.day = d.day;
+
+        UPDATE history_word h SET repetitions = h.repetitions - d.repetitions
+        FROM (SELECT user_id, word_id, SUM(repetitions) AS repetitions FROM old_rows GROUP BY user_id, word_id) d
+        WHERE h.user_id = d.user_id AND h.word_id = d.word_id;
+
+        UPDATE history_index h SET repetitions = h.repetitions - d.repetitions
+        FROM (SELECT user_id, repeatindex, SUM(repetitions) AS repetitions FROM old_rows GROUP BY user_id, repeatindex) d
+        WHERE h.user_id = d.user_id AND h.repeatindex = d.repeatindex;
+
+        DELETE FROM history_daily WHERE repetitions <= 0;
+        DELETE FROM history_word WHERE repetitions <= 0;
+        DELETE FROM history_index WHERE repetitions <= 0;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS words_history_daily_rollup_delete ON words_history_daily",
+    """
+    CREATE TRIGGER words_history_daily_rollup_delete
+    AFTER DELETE ON words_history_daily
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION words_history_daily_rollup_delete()
+    """,
+]
+
+# Every insert and update of a words row takes the next value of words_version_seq
+# into words.version, every delete leaves a tombstone with its own version in
+# words_deleted. A reader that saw the table as of version V catches up with the
+# rows and tombstones whose version is greater than V (snapshot.py).
+WORD_VERSIONS = [
+    "CREATE SEQUENCE IF NOT EXISTS words_version_seq",
+    "ALTER TABLE words ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('words_version_seq')",
+    "CREATE INDEX IF NOT EXISTS words_user_version_idx ON words (user_id, version)",
+    """
+    CREATE TABLE IF NOT EXISTS words_deleted (
+        user_id BIGINT NOT NULL,
+        word_id BIGINT NOT NULL,
+        version BIGINT NOT NULL,
+        deleted_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS words_deleted_user_version_idx ON words_deleted (user_id, version)",
+    "CREATE INDEX IF NOT EXISTS words_deleted_deleted_at_idx ON words_deleted (deleted_at)",
+    """
+    CREATE OR REPLACE FUNCTION words_set_version() RETURNS trigger AS $$
+    BEGIN
+        NEW.version := nextval('words_version_seq');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS words_set_version ON words",
+    """
+    CREATE TRIGGER words_set_version
+    BEFORE INSERT OR UPDATE ON words
+    FOR EACH ROW EXECUTE FUNCTION words_set_version()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_record_delete() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO words_deleted (user_id, word_id, version)
+        SELECT user_id, word_id, nextval('words_version_seq') FROM deleted_words;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS words_record_delete ON words",
+    """
+    CREATE TRIGGER words_record_delete
+    AFTER DELETE ON words
+    REFERENCING OLD TABLE AS deleted_words
+    FOR EACH STATEMENT EXECUTE FUNCTION words_record_delete()
+    """,
+]
+
+# Notifications carry versions, so a worker knows which version of a learner's
+# dictionary and history it holds without asking the database (ETags, delta sync):
+# words_changed gets "user_id:word_id:version" for inserts, updates and deletes
+# (the latter from the tombstone trigger), history_changed gets "user_id:version"
+# with the learner's history_versions row, bumped by every change of words_history.
+# Versions drawn here could commit out of order; migrations 5 and 6 order them.
+CHANGE_VERSIONS = [
+    """
+    CREATE OR REPLACE FUNCTION words_notify_change() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('words_changed', NEW.user_id || ':' || NEW.word_id || ':' || NEW.version);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS words_notify_change ON words",
+    """
+    CREATE TRIGGER words_notify_change
+    AFTER INSERT OR UPDATE ON words
+    FOR EACH ROW EXECUTE FUNCTION words_notify_change()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_record_delete() RETURNS trigger AS $$
+    DECLARE
+        tombstone RECORD;
+    BEGIN
+        FOR tombstone IN
+            INSERT INTO words_deleted (user_id, word_id, version)
+            SELECT user_id, word_id, nextval('words_version_seq') FROM deleted_words
+            RETURNING user_id, word_id, version
+        LOOP
+            PERFORM pg_notify('words_changed', tombstone.user_id || ':' || tombstone.word_id || ':' || tombstone.version);
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+
+    # tombstones up to this version are already pruned (retention.py): a client
+    # that synced before it cannot be caught up with deletions and gets everything
+    """
+    CREATE TABLE IF NOT EXISTS words_deleted_horizon (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL
+    )
+    """,
+
+    """
+    CREATE TABLE IF NOT EXISTS history_versions (
+        user_id BIGINT PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_history_version() RETURNS trigger AS $$
+    DECLARE
+        changed RECORD;
+    BEGIN
+        FOR changed IN
+            INSERT INTO history_versions (user_id, version)
+            SELECT user_id, nextval('words_version_seq') FROM (SELECT DISTINCT user_id FROM changed_rows) AS users
+            ON CONFLICT (user_id) DO UPDATE SET version = EXCLUDED.version
+            RETURNING user_id, version
+        LOOP
+            PERFORM pg_notify('history_changed', changed.user_id || ':' || changed.version);
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS words_history_version_insert ON words_history",
+    """
+    CREATE TRIGGER words_history_version_insert
+    AFTER INSERT ON words_history
+    REFERENCING NEW TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION words_history_version()
+    """,
+    "DROP TRIGGER IF EXISTS words_history_version_delete ON words_history",
+    """
+    CREATE TRIGGER words_history_version_delete
+    AFTER DELETE ON words_history
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION words_history_version()
+    """,
+]
+
+# Versions of one learner's words follow the commit order: a transaction takes the
+# learner's row in words_version_locks before it draws its first version and holds
+# it until it commits, so a later writer of the learner waits and draws larger
+# versions. The newest committed version of a learner is then a safe cursor, no
+# transaction still open can commit a smaller one (snapshot.py, /getWords?since=).
+# Writers that lock words rows before changing them call words_lock_versions first
+# (wordstore.lockVersions), otherwise two of them could wait for each other.
+WORD_VERSION_LOCKS = [
+    """
+    CREATE TABLE IF NOT EXISTS words_version_locks (
+        user_id BIGINT PRIMARY KEY
+    )
+    """,
+    "INSERT INTO words_version_locks (user_id) SELECT DISTINCT user_id FROM words ON CONFLICT DO NOTHING",
+    """
+    CREATE OR REPLACE FUNCTION words_lock_versions(learner BIGINT) RETURNS void AS $$
+    BEGIN
+        PERFORM 1 FROM words_version_locks WHERE user_id = learner FOR UPDATE;
+        IF NOT FOUND THEN
+            -- a concurrent first writer of the learner holds the new row until it commits
+            INSERT INTO words_version_locks (user_id) VALUES (learner) ON CONFLICT DO NOTHING;
+            PERFORM 1 FROM words_version_locks WHERE user_id = learner FOR UPDATE;
+        END IF;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_set_version() RETURNS trigger AS $$
+    BEGIN
+        PERFORM words_lock_versions(NEW.user_id);
+        NEW.version := nextval('words_version_seq');
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION words_record_delete() RETURNS trigger AS $$
+    DECLARE
+        tombstone RECORD;
+    BEGIN
+        PERFORM words_lock_versions(user_id) FROM (SELECT DISTINCT user_id FROM deleted_words ORDER BY user_id) AS users;
+        FOR tombstone IN
+            INSERT INTO words_deleted (user_id, word_id, version)
+            SELECT user_id, word_id, nextval('words_version_seq') FROM deleted_words
+            RETURNING user_id, word_id, version
+        LOOP
+            PERFORM pg_notify('words_changed', tombstone.user_id || ':' || tombstone.word_id || ':' || tombstone.version);
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# The history version is drawn only once the learner's history_versions row is
+# locked: the value in VALUES is drawn before the insert waits for a concurrent
+# writer of the row, so the later commit could get the smaller version and an
+# ETag of the changed statistics would still match.
+HISTORY_VERSION_ORDER = [
+    """
+    CREATE OR REPLACE FUNCTION words_history_version() RETURNS trigger AS $$
+    DECLARE
+        changed RECORD;
+    BEGIN
+        FOR changed IN
+            INSERT INTO history_versions (user_id, version)
+            SELECT user_id, nextval('words_version_seq') FROM (SELECT DISTINCT user_id FROM changed_rows) AS users
+            ON CONFLICT (user_id) DO UPDATE SET version = nextval('words_version_seq')
+            RETURNING user_id, version
+        LOOP
+            PERFORM pg_notify('history_changed', changed.user_id || ':' || changed.version);
+        END LOOP;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# (version, description, statements)
+MIGRATIONS = [
+    (1, "baseline", STATEMENTS),
+    (2, "partition words_history by month", HISTORY_PARTITIONS),
+    (3, "words change versions and delete tombstones", WORD_VERSIONS),
+    (4, "versioned change notifications and history versions", CHANGE_VERSIONS),
+    (5, "commit-ordered word versions per learner", WORD_VERSION_LOCKS),
+    (6, "commit-ordered history versions", HISTORY_VERSION_ORDER),
+]
+
+
+async def ensureSchema(conn):
+    # several workers may start at once; the advisory lock serializes them
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('words-repeater-schema'))")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """)
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, description, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            log.info("Applying schema migration %d: %s", version, description)
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute("INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                               version, description)
@@ -0,0 +1,96 @@
+import asyncio
+import collections
+import time
+
+import eventloop
+import metrics
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # seconds a finished result is handed out to identical calls, by group;
+    # groups not listed only share calls that are still running
+    "reuse": {
+        "statistics": 2.0,
+        "words": 1.0
+    },
+    # finished results kept per group
+    "max_entries": 1024
+}
+
+CALLS = metrics.counter("single_flight_calls_total", "Calls executed by coalescing group")
+SUPPRESSED = metrics.counter("single_flight_suppressed_total",
+                             "Duplicate calls answered without executing, by group and kind (in_flight, reused)")
+
+
+class Group:
+    """
+    Схлопывание одинаковых вызовов: пока вызов с ключом key выполняется, такие же
+    вызовы ждут его результат, а не выполняются заново; еще reuse секунд после
+    завершения результат отдается без вызова. Ошибки не запоминаются.
+
+    Результат общий для всех ожидающих, изменять его нельзя.
+    Ключи групп словаря и статистики начинаются с user_id (см. forget).
+    """
+
+    def __init__(self, name, settings=None):
+        self.name = name
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.reuse = self.settings["reuse"].get(name, 0.0)
+        self._calls = {}
+        self._results = collections.OrderedDict()
+
+    async def do(self, key, fn, *args):
+        """
+        Результат fn(*args) (корутина-функция), общий для одновременных вызовов с тем же key.
+        """
+        if not self.settings["enabled"]:
+            return await fn(*args)
+        return await eventloop.submit(self._do(key, fn, args))
+
+    async def _do(self, key, fn, args):
+        cached = self._results.get(key)
+        if cached is not None:
+            result, expiresAt = cached
+            if expiresAt > time.monotonic():
+                SUPPRESSED.inc(group=self.name, kind="reused")
+                return result
+            del self._results[key]
+
+        call = self._calls.get(key)
+        if call is None:
+            CALLS.inc(group=self.name)
+            call = self._calls[key] = asyncio.ensure_future(self._run(key, fn, args))
+        else:
+            SUPPRESSED.inc(group=self.name, kind="in_flight")
+        # a waiter that goes away does not cancel the call the others are waiting for
+        return await asyncio.shield(call)
+
+    async def _run(self, key, fn, args):
+        task = asyncio.current_task()
+        try:
+            result = await fn(*args)
+        finally:
+            # after forget() the call is no longer current: it neither stays shared nor is reused
+            current = self._calls.get(key) is task
+            if current:
+                del self._calls[key]
+        if current and self.reuse > 0:
+            self._results[key] = (result, time.monotonic() + self.reuse)
+            self._results.move_to_end(key)
+            while len(self._results) > self.settings["max_entries"]:
+                self._results.popitem(last=False)
+        return result
+
+    async def forget(self, userId):
+        """
+        Данные пользователя изменились: его запомненные результаты сбрасываются,
+        а следующие вызовы не присоединяются к уже идущим.
+        """
+        if self.settings["enabled"]:
+            await eventloop.submit(self._forget(userId))
+
+    async def _forget(self, userId):
+        for table in (self._results, self._calls):
+            for key in [key for key in table if key[0] == userId]:
+                del table[key]
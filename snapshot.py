@@ -0,0 +1,487 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import time
+
+import numpy as np
+
+import appconfig
+import database
+import eventloop
+import metrics
+import sampler
+
+# Read-only snapshot of the words table shared by all worker processes.
+#
+# <path>/<name>/ holds one .npy file per column, rows ordered by (user_id, word_id)
+# and followed by free slots of the same learner, and strings.bin with the word, translation, part of speech and example of every
+# row, UTF-8 back to back. <path>/current is a symlink to the latest snapshot and
+# is switched with os.replace, so a reader sees either the old or the new one.
+#
+# Workers map the files copy-on-write: pages stay shared between processes until
+# a worker changes a value in its WordStore, and only that page becomes private.
+# A worker attaching a learner reads only the rows changed since the snapshot
+# (words.version / words_deleted, schema migration 3) instead of the whole dictionary.
+# The snapshot remembers the newest version of every learner it holds: versions of
+# one learner follow the commit order (schema migration 5), so everything the
+# learner commits later has a larger one.
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "path": "snapshots",
+    # this process rebuilds the snapshot every interval seconds; several builders
+    # take turns through an advisory lock, so every worker may have it on
+    "build": False,
+    "interval": 300.0,
+    # snapshots kept on disk, the current one included
+    "keep": 3,
+    # an older snapshot is not used: tombstones it depends on may have been pruned
+    # (history_retention.tombstone_days)
+    "max_age": 86400.0,
+    # seconds between checks of the current symlink
+    "check_interval": 1.0,
+    # free slots after every learner's rows, as a share of their words (at least
+    # MIN_SPARE_SLOTS): words added later take them instead of copying the columns
+    "spare_slots": 0.125
+}
+MIN_SPARE_SLOTS = 16
+
+FIELDS = ("word", "translation", "partofspeech", "example")
+# empty strings of these fields are stored as NULL in the words table
+_NULLABLE = (False, False, True, True)
+
+QUERY = """
+    SELECT user_id, word_id, version, weight, repeatindex, nextrepeattime, word, translation, partofspeech, example
+    FROM words
+    ORDER BY user_id, word_id
+"""
+CHANGES_QUERY = "SELECT {columns} FROM words WHERE user_id = $1 AND version > $2"
+DELETES_QUERY = "SELECT word_id FROM words_deleted WHERE user_id = $1 AND version > $2"
+
+BUILD_SECONDS = metrics.histogram("word_snapshot_build_seconds", "Time to build one words snapshot")
+ATTACHES = metrics.counter("word_snapshot_attaches_total", "Learner dictionaries attached to a snapshot by result")
+
+log = logging.getLogger(__name__)
+
+_LOCK = "hashtext('words-repeater-snapshot')"
+_LINK = "current"
+
+_settings = dict(DEFAULT_SETTINGS)
+_current = None
+_checkedAt = 0.0
+_task = None
+
+
+def configure(config):
+    """
+    Секция "snapshot" из config.json.
+    """
+    global _settings, _current
+    _settings = dict(DEFAULT_SETTINGS)
+    _settings.update(config.get("snapshot", {}))
+    _current = None
+
+
+def _readMeta(directory):
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _age(created):
+    return (datetime.datetime.now(datetime.timezone.utc) - created).total_seconds()
+
+
+# ---- чтение
+
+class Snapshot:
+    """
+    Снимок, открытый в этом процессе. Числовые колонки отображаются один раз на
+    процесс (copy-on-write), словари пользователей получают срезы (claim).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        meta = _readMeta(directory)
+        self.version = meta["version"]
+        self.created = datetime.datetime.fromisoformat(meta["created"])
+        self.users = self._load("users", "r")
+        self.starts = self._load("starts", "r")
+        self.userVersions = self._load("user_versions", "r")
+        self.counts = self._load("counts", "r")
+        # word ids for lookups; the copy-on-write ids below change when a word is dropped
+        self.keys = self._load("ids", "r")
+        self.offsets = self._load("offsets", "r")
+        self._arena = b""
+        if os.path.getsize(os.path.join(directory, "strings.bin")):
+            with open(os.path.join(directory, "strings.bin"), "rb") as f:
+                self._arena = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._columns = None
+        self._claimed = set()
+
+    def _load(self, name, mode):
+        return np.load(os.path.join(self.directory, name + ".npy"), mmap_mode=mode)
+
+    def columns(self):
+        if self._columns is None:
+            self._columns = {name: self._load(name, "c")
+                             for name in ("ids", "weights", "repeat_indexes", "next_repeat_times", "tree")}
+            # the sampler zeroes picked weights while sampling, so it gets its own mapping
+            self._columns["sampler_weights"] = self._load("sampler_weights", "c")
+        return self._columns
+
+    def string(self, row, field):
+        index = row * len(FIELDS) + field
+        value = self._arena[int(self.offsets[index]):int(self.offsets[index + 1])].decode("utf-8")
+        return None if not value and _NULLABLE[field] else value
+
+    def _userIndex(self, userId):
+        index = int(np.searchsorted(self.users, userId))
+        if index == len(self.users) or self.users[index] != userId:
+            return None
+        return index
+
+    def versionOf(self, userId):
+        """
+        Версия, до которой изменения пользователя есть в снимке; 0, если его слов в снимке нет.
+        """
+        index = self._userIndex(userId)
+        return 0 if index is None else int(self.userVersions[index])
+
+    def claim(self, userId):
+        """
+        Срез пользователя (UserSlice) или None, если при построении снимка слов у него не было.
+        Повторный claim (словарь вытеснен и загружается снова) получает свежие
+        отображения: прежние страницы среза уже изменены тем словарем.
+        """
+        index = self._userIndex(userId)
+        if index is None:
+            return None
+        if userId in self._claimed:
+            return Snapshot(self.directory).claim(userId)
+        self._claimed.add(userId)
+        return UserSlice(self, index)
+
+
+class UserSlice:
+    """
+    Строки одного пользователя в снимке: колонки - срезы отображенных массивов без копирования.
+    Первые count слотов заняты словами, остальные свободны.
+    """
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.start = int(snapshot.starts[index])
+        self.end = int(snapshot.starts[index + 1])
+        self.count = int(snapshot.counts[index])
+        columns = snapshot.columns()
+        self.ids = columns["ids"][self.start:self.end]
+        self.weights = columns["weights"][self.start:self.end]
+        self.repeatIndexes = columns["repeat_indexes"][self.start:self.end]
+        self.nextRepeatTimes = columns["next_repeat_times"][self.start:self.end]
+        self.samplerWeights = columns["sampler_weights"][self.start:self.end]
+        # every learner's tree has its own unused element 0 in front
+        self.tree = columns["tree"][self.start + index:self.end + index + 1]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def strings(self, field):
+        return ArenaColumn(self.snapshot, self.start, field, self.count, len(self))
+
+    def slots(self):
+        return SlotMap(self.snapshot.keys[self.start:self.start + self.count])
+
+
+class ArenaColumn:
+    """
+    Строковая колонка WordStore поверх снимка: исходные значения читаются из
+    strings.bin при обращении, записанные после загрузки лежат в словаре.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, snapshot, start, field, base, size):
+        self._snapshot = snapshot
+        self._start = start
+        self._field = field
+        self._base = base
+        self._size = size
+        self._changed = {}
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, slot):
+        value = self._changed.get(slot, self._MISSING)
+        if value is not self._MISSING:
+            return value
+        if slot >= self._base:
+            return None
+        return self._snapshot.string(self._start + slot, self._field)
+
+    def __setitem__(self, slot, value):
+        self._changed[slot] = value
+
+    def __iter__(self):
+        return (self[slot] for slot in range(self._size))
+
+    def changedValues(self):
+        # values held by this process, not by the shared snapshot
+        return self._changed.values()
+
+    def extend(self, values):
+        for value in values:
+            if value is not None:
+                self._changed[self._size] = value
+            self._size += 1
+
+
+class SlotMap:
+    """
+    word_id -> слот для словаря из снимка: исходные слова ищутся двоичным поиском
+    по отсортированным id, добавленные и удаленные после загрузки хранятся отдельно.
+    """
+
+    def __init__(self, keys):
+        self._keys = keys
+        self._added = {}
+        self._removed = set()
+
+    def _base(self, wordId):
+        slot = int(np.searchsorted(self._keys, wordId))
+        if slot < len(self._keys) and self._keys[slot] == wordId and slot not in self._removed:
+            return slot
+        return None
+
+    def get(self, wordId, default=None):
+        slot = self._added.get(wordId)
+        if slot is None:
+            slot = self._base(wordId)
+        return default if slot is None else slot
+
+    def __setitem__(self, wordId, slot):
+        self._added[wordId] = slot
+
+    def pop(self, wordId, default=None):
+        slot = self._added.pop(wordId, None)
+        if slot is not None:
+            return slot
+        slot = self._base(wordId)
+        if slot is None:
+            return default
+        self._removed.add(slot)
+        return slot
+
+    def __len__(self):
+        return len(self._keys) - len(self._removed) + len(self._added)
+
+    def values(self):
+        base = np.ones(len(self._keys), dtype=bool)
+        base[list(self._removed)] = False
+        return np.flatnonzero(base).tolist() + list(self._added.values())
+
+
+def current():
+    """
+    Текущий снимок или None (снимки выключены, еще не построены или устарели).
+    Симлинк проверяется не чаще check_interval секунд, без ввода-вывода на каждый запрос.
+    """
+    global _current, _checkedAt
+    if not _settings["enabled"]:
+        return None
+    now = time.monotonic()
+    if now - _checkedAt >= _settings["check_interval"]:
+        _checkedAt = now
+        try:
+            directory = os.path.realpath(os.path.join(_settings["path"], _LINK))
+            if _current is None or _current.directory != directory:
+                _current = Snapshot(directory)
+        except (OSError, ValueError, KeyError) as e:
+            if _current is not None:
+                log.warning("Word snapshot is unavailable: %s", e)
+            _current = None
+    if _current is None or _age(_current.created) > _settings["max_age"]:
+        return None
+    return _current
+
+
+async def readChanges(conn, userId, version, columns):
+    """
+    Строки пользователя, измененные после снимка, и id удаленных после него слов.
+    """
+    rows = await conn.fetch(CHANGES_QUERY.format(columns=columns), userId, version)
+    deleted = [row["word_id"] for row in await conn.fetch(DELETES_QUERY, userId, version)]
+    return rows, deleted
+
+
+# ---- построение
+
+async def build(conn, path, defaultWeight=1.0, spareSlots=DEFAULT_SETTINGS["spare_slots"]):
+    """
+    Строит снимок всей таблицы words в каталоге path и делает его текущим.
+    Возвращает каталог снимка.
+    """
+    os.makedirs(path, exist_ok=True)
+    staging = os.path.join(path, f".build-{os.getpid()}-{time.time_ns()}")
+    os.makedirs(staging)
+    try:
+        users, userVersions, starts, counts, ids, weights, repeatIndexes, nextRepeatTimes, offsets = \
+            [], [], [], [], [], [], [], [], [0]
+
+        def reserve():
+            # free slots after the previous learner's rows; their strings are empty
+            counts.append(len(ids) - starts[-1])
+            spare = max(MIN_SPARE_SLOTS, math.ceil(counts[-1] * spareSlots))
+            ids.extend([0] * spare)
+            weights.extend([0.0] * spare)
+            repeatIndexes.extend([0] * spare)
+            nextRepeatTimes.extend([None] * spare)
+            offsets.extend([offsets[-1]] * (spare * len(FIELDS)))
+
+        with open(os.path.join(staging, "strings.bin"), "wb") as arena:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                # a learner's newest row version read here is a safe cursor for them: their
+                # transactions still open now can only commit larger versions. Tombstones
+                # are not looked at, the newer ones are simply applied again on attach
+                async for row in conn.cursor(QUERY, prefetch=10000):
+                    if not users or users[-1] != row["user_id"]:
+                        if users:
+                            reserve()
+                        users.append(row["user_id"])
+                        userVersions.append(0)
+                        starts.append(len(ids))
+                    userVersions[-1] = max(userVersions[-1], row["version"])
+                    ids.append(row["word_id"])
+                    weights.append(defaultWeight if row["weight"] is None else row["weight"])
+                    repeatIndexes.append(row["repeatindex"] or 0)
+                    nextRepeatTimes.append(row["nextrepeattime"])
+                    for field in FIELDS:
+                        data = (row[field] or "").encode("utf-8")
+                        arena.write(data)
+                        offsets.append(offsets[-1] + len(data))
+        if users:
+            reserve()
+        starts.append(len(ids))
+
+        weights = np.array(weights, dtype=np.float64)
+        samplerWeights = sampler.cleanWeights(weights)
+        trees = [sampler.fenwickTree(samplerWeights[start:end]) for start, end in zip(starts, starts[1:])]
+        columns = {
+            "users": np.array(users, dtype=np.int64),
+            "user_versions": np.array(userVersions, dtype=np.int64),
+            "starts": np.array(starts, dtype=np.int64),
+            "counts": np.array(counts, dtype=np.int64),
+            "ids": np.array(ids, dtype=np.int64),
+            "weights": weights,
+            "sampler_weights": samplerWeights,
+            "repeat_indexes": np.array(repeatIndexes, dtype=np.int32),
+            "next_repeat_times": np.array([np.datetime64("NaT") if t is None else t for t in nextRepeatTimes],
+                                          dtype="datetime64[us]"),
+            "tree": np.concatenate(trees) if trees else np.zeros(0, dtype=np.float64),
+            "offsets": np.array(offsets, dtype=np.int64)
+        }
+        for name, values in columns.items():
+            np.save(os.path.join(staging, name + ".npy"), values)
+        created = datetime.datetime.now(datetime.timezone.utc)
+        version = max(userVersions, default=0)
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "created": created.isoformat(), "rows": sum(counts), "users": len(users)}, f)
+
+        name = f"{created:%Y%m%dT%H%M%S%f}-{version}"
+        directory = os.path.join(path, name)
+        os.rename(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    publish(path, name)
+    return directory
+
+
+def publish(path, name):
+    """
+    Атомарно переключает path/current на снимок name.
+    """
+    link = os.path.join(path, f".{_LINK}-{os.getpid()}")
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(name, link)
+    os.replace(link, os.path.join(path, _LINK))
+
+
+def prune(path, keep):
+    """
+    Удаляет старые снимки, кроме keep последних. Процессы, которые еще держат их
+    отображенными, продолжают читать: файлы исчезают только с последним отображением.
+    """
+    active = os.path.basename(os.path.realpath(os.path.join(path, _LINK)))
+    names = sorted(name for name in os.listdir(path)
+                   if not name.startswith(".") and name != _LINK and os.path.isdir(os.path.join(path, name)))
+    for name in names[:-keep] if keep > 0 else names:
+        if name != active:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+async def refresh(conn, settings, defaultWeight=1.0):
+    """
+    Строит новый снимок, если текущий старше interval и никто другой сейчас не строит.
+    Возвращает каталог нового снимка или None.
+    """
+    try:
+        meta = _readMeta(os.path.join(settings["path"], _LINK))
+        if _age(datetime.datetime.fromisoformat(meta["created"])) < settings["interval"]:
+            return None
+    except (OSError, ValueError, KeyError):
+        pass  # no snapshot yet
+    if not await conn.fetchval(f"SELECT pg_try_advisory_lock({_LOCK})"):
+        return None
+    try:
+        directory = await build(conn, settings["path"], defaultWeight, settings["spare_slots"])
+        prune(settings["path"], settings["keep"])
+        return directory
+    finally:
+        await conn.execute(f"SELECT pg_advisory_unlock({_LOCK})")
+
+
+async def _buildLoop(settings, defaultWeight):
+    while True:
+        started = time.perf_counter()
+        try:
+            directory = await database.run(refresh, settings, defaultWeight)
+            if directory is not None:
+                BUILD_SECONDS.observe(time.perf_counter() - started)
+                log.info("Built words snapshot %s", directory)
+        except Exception as e:
+            log.warning("Building words snapshot failed: %s", e)
+        await asyncio.sleep(min(settings["interval"], 60.0))
+
+
+def start(config):
+    """
+    Запускает периодическое построение снимков, если в секции "snapshot" build = true.
+    """
+    global _task
+    if _settings["enabled"] and _settings["build"] and _task is None:
+        _task = eventloop.spawn(_buildLoop(_settings, config.textGeneration.defaultWeight))
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+
+if __name__ == "__main__":
+    # sidecar instead of build = true in the workers, e.g. from cron:
+    # python snapshot.py  - builds a snapshot now and prunes old ones
+    _config = appconfig.parse("config.json")
+    logging.basicConfig(level=logging.INFO)
+    database.configure(_config)
+    configure(_config)
+    print(eventloop.runSync(database.run(
+        refresh, dict(_settings, interval=0), _config.textGeneration.defaultWeight)))
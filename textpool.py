@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import logging
+import time
+
+import eventloop
+import metrics
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    # texts generated ahead per key
+    "depth": 2,
+    # a take refills the pool only when fewer texts than this are left
+    "low_water": 1,
+    # keys are per learner: about the number of learners generating texts within max_age.
+    # Keys idle for max_age are dropped first, their texts would be too old anyway
+    "max_keys": 1000,
+    "max_age": 3600.0,
+    "max_weight_drift": 0.5,
+    "refill_concurrency": 2
+}
+
+HITS = metrics.counter("text_pool_requests_total", "/generate_text requests by result (hit = served from the pool)")
+GENERATION_SECONDS = metrics.histogram("text_generation_seconds", "Cloze text generation latency by source",
+                                       buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0))
+DISCARDED = metrics.counter("text_pool_discarded_total", "Pooled texts dropped before use, by reason")
+
+log = logging.getLogger(__name__)
+
+_Item = collections.namedtuple("_Item", "payload weights createdAt")
+
+
+class TextPool:
+    """
+    Заранее сгенерированные тексты для /generate_text по ключу настроек
+    (уровень, стиль, тип, тема...). Запрос забирает готовый текст, а пул
+    пополняется в фоне на общем loop, когда в нем остается меньше low_water текстов.
+    Ключ получает пул со второго запроса: разовые настройки не генерируются впрок.
+
+    generate(key) -> (payload, {wordId: weight}) | None - генерация одного текста,
+    currentWeight(key, wordId) -> float | None - текущий вес слова; если веса слов
+    текста заметно изменились (или слово удалено), текст считается устаревшим.
+    """
+
+    def __init__(self, generate, currentWeight, settings=None):
+        self._generate = generate
+        self._currentWeight = currentWeight
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self._pools = collections.OrderedDict()
+        self._lastUsed = {}
+        self._refilling = set()
+        self._semaphore = None
+        metrics.gauge("text_pool_depth", "Ready texts per pool key", self._depths)
+
+    def _depths(self):
+        return {(("key", "|".join(map(str, key))),): len(queue) for key, queue in list(self._pools.items())}
+
+    def _isFresh(self, key, item):
+        if time.monotonic() - item.createdAt > self.settings["max_age"]:
+            DISCARDED.inc(reason="age")
+            return False
+
+        before = 0.0
+        drift = 0.0
+        for wordId, weight in item.weights.items():
+            current = self._currentWeight(key, wordId)
+            if current is None:
+                DISCARDED.inc(reason="word_deleted")
+                return False
+            before += weight
+            drift += abs(current - weight)
+        if before and drift / before > self.settings["max_weight_drift"]:
+            DISCARDED.inc(reason="weights_changed")
+            return False
+        return True
+
+    async def take(self, key):
+        """
+        Готовый текст для ключа или None (тогда вызывающий генерирует сам).
+        Если текстов осталось меньше low_water, пул пополняется в фоне.
+        """
+        if not self.settings["enabled"]:
+            return None
+        return await eventloop.submit(self._take(key))
+
+    def _evict(self, now):
+        # least recently used first; idle keys go even below max_keys
+        while self._pools:
+            oldest = next(iter(self._pools))
+            if len(self._pools) <= self.settings["max_keys"] and now - self._lastUsed[oldest] <= self.settings["max_age"]:
+                break
+            del self._pools[oldest]
+            del self._lastUsed[oldest]
+
+    async def _take(self, key):
+        now = time.monotonic()
+        queue = self._pools.get(key)
+        known = queue is not None
+        if not known:
+            queue = self._pools[key] = collections.deque()
+        self._pools.move_to_end(key)
+        self._lastUsed[key] = now
+        self._evict(now)
+
+        payload = None
+        while queue:
+            item = queue.popleft()
+            if self._isFresh(key, item):
+                payload = item.payload
+                break
+
+        HITS.inc(result="hit" if payload is not None else "miss")
+        if known and len(queue) < self.settings["low_water"]:
+            self._scheduleRefill(key)
+        return payload
+
+    def _scheduleRefill(self, key):
+        if key in self._refilling:
+            return
+        self._refilling.add(key)
+        eventloop.spawn(self._refill(key))
+
+    async def _refill(self, key):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.settings["refill_concurrency"])
+        try:
+            async with self._semaphore:
+                while key in self._pools and len(self._pools[key]) < self.settings["depth"]:
+                    started = time.perf_counter()
+                    generated = await self._generate(key)
+                    GENERATION_SECONDS.observe(time.perf_counter() - started, source="pool")
+                    if generated is None:
+                        break
+                    payload, weights = generated
+                    queue = self._pools.get(key)
+                    if queue is not None:
+                        queue.append(_Item(payload, weights, time.monotonic()))
+        except Exception as e:
+            log.warning("Text pool refill failed for %s: %s", key, e)
+        finally:
+            self._refilling.discard(key)
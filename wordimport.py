@@ -0,0 +1,229 @@
+import codecs
+import csv
+import json
+import re
+
+import wordstore
+
+FORMATS = ("csv", "tsv", "txt")
+BATCH_SIZE = 5000
+MAX_ERRORS = 1000
+MAX_WORD_LENGTH = 200
+
+# "word (pos) = translation; example; example" - формат старого input.txt
+_POS_RE = re.compile(r"\(([A-Za-z]+)\.?\)")
+
+_COLUMN_ALIASES = {
+    "word": "word",
+    "translation": "translation",
+    "partofspeech": "partOfSpeech",
+    "part_of_speech": "partOfSpeech",
+    "pos": "partOfSpeech",
+    "example": "example",
+    "examples": "example"
+}
+_DEFAULT_COLUMNS = ("word", "translation", "partOfSpeech", "example")
+
+
+def detectFormat(requested, contentType, filename=""):
+    """
+    Формат из параметра format, расширения файла или Content-Type; по умолчанию txt.
+    """
+    if requested:
+        if requested not in FORMATS:
+            raise ValueError(f"Unknown format '{requested}', expected one of {', '.join(FORMATS)}")
+        return requested
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension in FORMATS:
+        return extension
+    contentType = (contentType or "").lower()
+    if "csv" in contentType:
+        return "csv"
+    if "tab-separated" in contentType:
+        return "tsv"
+    return "txt"
+
+
+async def _lines(chunks):
+    """
+    Строки из потока байтов по мере их прихода (UTF-8, BOM допускается).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def _word(word, translation, partOfSpeech, examples):
+    word = word.strip().lower()
+    translation = translation.strip()
+    if not word or not translation:
+        raise ValueError("Word and translation are required")
+    if len(word) > MAX_WORD_LENGTH:
+        raise ValueError(f"Word is longer than {MAX_WORD_LENGTH} characters")
+    examples = [e.strip() for e in examples if e and e.strip()]
+    return {
+        "word": word,
+        "translation": translation,
+        "partOfSpeech": (partOfSpeech or "").strip().replace(".", "").lower() or None,
+        "example": examples
+    }
+
+
+def parseTxtLine(line):
+    """
+    Строка input.txt: "word (pos) = translation; example; example".
+    """
+    if "=" not in line:
+        raise ValueError("Expected 'word (pos) = translation; example'")
+    word, rest = line.split("=", 1)
+    partOfSpeech = None
+    match = _POS_RE.search(word)
+    if match:
+        partOfSpeech = match.group(1)
+        word = word[:match.start()] + word[match.end():]
+    translation, *examples = rest.split(";")
+    return _word(word, translation, partOfSpeech, examples)
+
+
+class _TableParser:
+    """
+    CSV/TSV: первая строка - заголовок, если в ней есть колонки word и translation,
+    иначе колонки по порядку word, translation, partOfSpeech, example.
+    Каждая запись - одна строка (переводы строк внутри кавычек не поддерживаются).
+    """
+
+    def __init__(self, delimiter):
+        self.delimiter = delimiter
+        self.columns = None
+
+    def parse(self, line):
+        fields = next(csv.reader([line], delimiter=self.delimiter))
+        if self.columns is None:
+            names = [_COLUMN_ALIASES.get(f.strip().lower()) for f in fields]
+            if "word" in names and "translation" in names:
+                self.columns = names
+                return None
+            self.columns = _DEFAULT_COLUMNS
+        if len(fields) > len(self.columns):
+            raise ValueError(f"Expected at most {len(self.columns)} columns, got {len(fields)}")
+        values = {}
+        for name, value in zip(self.columns, fields):
+            if name is not None:
+                values[name] = value
+        return _word(values.get("word", ""), values.get("translation", ""),
+                     values.get("partOfSpeech"), [values.get("example")])
+
+
+async def parse(chunks, format):
+    """
+    Асинхронный генератор (номер строки, слово | None, ошибка | None) по потоку байтов.
+    Пустые строки и строки-комментарии (#) пропускаются.
+    """
+    if format == "txt":
+        parseLine = parseTxtLine
+    else:
+        parseLine = _TableParser("," if format == "csv" else "\t").parse
+
+    lineNumber = 0
+    async for line in _lines(chunks):
+        lineNumber += 1
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        try:
+            word = parseLine(line)
+        except (ValueError, csv.Error) as e:
+            yield lineNumber, None, str(e)
+            continue
+        if word is not None:
+            yield lineNumber, word, None
+
+
+class Upload:
+    """
+    Разобранный файл импорта: записи для COPY пачками по BATCH_SIZE и ошибки разбора.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.errors = []
+        self.errorCount = 0
+        self.firstLine = {}
+
+    def fail(self, lineNumber, word, message):
+        self.errorCount += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": lineNumber, "word": word, "error": message})
+
+
+async def read(rows):
+    """
+    Читает асинхронный генератор parse() до конца, без соединения с базой:
+    медленный клиент не держит соединение из пула. Размер тела ограничен
+    MAX_CONTENT_LENGTH приложения, так что записи помещаются в памяти.
+    """
+    upload = Upload()
+    batch = []
+    async for lineNumber, word, error in rows:
+        if error is not None:
+            upload.fail(lineNumber, None, error)
+            continue
+        if word["word"] in upload.firstLine:
+            upload.fail(lineNumber, word["word"], f"Duplicate of line {upload.firstLine[word['word']]}")
+            continue
+        upload.firstLine[word["word"]] = lineNumber
+        batch.append((lineNumber, word["word"], word["translation"], word["partOfSpeech"],
+                      json.dumps(word["example"]) if word["example"] else None))
+        if len(batch) >= BATCH_SIZE:
+            upload.batches.append(batch)
+            batch = []
+    if batch:
+        upload.batches.append(batch)
+    return upload
+
+
+async def importWords(conn, upload, userId, defaultWeight):
+    """
+    Загружает слова пользователя из прочитанного read(): пачки идут через COPY
+    во временную таблицу, затем одним INSERT ... SELECT переносятся в words,
+    уже существующие у пользователя слова пропускаются.
+    Возвращает (отчет, строки новых слов в формате wordstore.COLUMNS).
+    """
+    async with conn.transaction():
+        await conn.execute("""
+            CREATE TEMP TABLE words_import (
+                line INT, word TEXT, translation TEXT, partofspeech TEXT, example TEXT
+            ) ON COMMIT DROP
+        """)
+        for batch in upload.batches:
+            await conn.copy_records_to_table("words_import", records=batch)
+
+        inserted = await conn.fetch(f"""
+            INSERT INTO words (user_id, word, translation, partofspeech, example, nextrepeattime, repeatindex, weight)
+            SELECT $2, i.word, i.translation, i.partofspeech, i.example, NOW(), 0, $1
+            FROM words_import i
+            WHERE NOT EXISTS (SELECT 1 FROM words w WHERE w.user_id = $2 AND w.word = i.word)
+            ORDER BY i.line
+            ON CONFLICT DO NOTHING
+            RETURNING {wordstore.COLUMNS}
+        """, defaultWeight, userId)
+
+    insertedWords = {row["word"] for row in inserted}
+    for word, lineNumber in upload.firstLine.items():
+        if word not in insertedWords:
+            upload.fail(lineNumber, word, "Word already exists")
+    upload.errors.sort(key=lambda e: e["line"])
+
+    return {
+        "success": True,
+        "imported": len(inserted),
+        "failed": upload.errorCount,
+        "errors": upload.errors,
+        "errorsTruncated": upload.errorCount > len(upload.errors)
+    }, inserted
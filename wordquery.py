@@ -0,0 +1,115 @@
+import collections
+import datetime
+import json
+
+# API field -> column of the words table
+FIELDS = collections.OrderedDict([
+    ("wordId", "word_id"),
+    ("nextRepeatTime", "nextrepeattime"),
+    ("repeatIndex", "repeatindex"),
+    ("word", "word"),
+    ("translation", "translation"),
+    ("example", "example"),
+    ("partOfSpeech", "partofspeech"),
+    ("weight", "weight")
+])
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+WordQuery = collections.namedtuple("WordQuery", "after limit due partsOfSpeech minWeight maxWeight text fields")
+
+
+def _number(args, name, kind):
+    value = args.get(name)
+    if value is None or value == "":
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f"Parameter '{name}' must be a number")
+
+
+def parseArgs(args):
+    """
+    Параметры /getWords: after, limit, due, pos, minWeight, maxWeight, q, fields.
+    Некорректные значения - ValueError с текстом для ответа 400.
+    """
+    limit = _number(args, "limit", int)
+    if limit is None:
+        limit = DEFAULT_LIMIT
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"Parameter 'limit' must be between 1 and {MAX_LIMIT}")
+
+    fields = list(FIELDS)
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    return WordQuery(
+        after=_number(args, "after", int),
+        limit=limit,
+        due=args.get("due", "").lower() in ("1", "true", "yes"),
+        partsOfSpeech=[p.strip() for p in args.get("pos", "").split(",") if p.strip()],
+        minWeight=_number(args, "minWeight", float),
+        maxWeight=_number(args, "maxWeight", float),
+        text=args.get("q", "").strip(),
+        fields=fields
+    )
+
+
+def _like(text):
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def build(query, userId, defaultWeight, paged=True):
+    """
+    (SQL, параметры) для выборки слов пользователя по query в порядке word_id.
+    paged=False - без keyset-страницы (для выгрузки через курсор).
+    """
+    conditions = []
+    params = []
+
+    def param(value):
+        params.append(value)
+        return f"${len(params)}"
+
+    # keyset pages walk the (user_id, word_id) index
+    conditions.append(f"user_id = {param(userId)}")
+    if query.after is not None:
+        conditions.append(f"word_id > {param(query.after)}")
+    if query.due:
+        conditions.append(f"nextrepeattime < {param(datetime.datetime.now())}")
+    if query.partsOfSpeech:
+        conditions.append(f"partofspeech = ANY({param(query.partsOfSpeech)}::text[])")
+    if query.minWeight is not None:
+        conditions.append(f"COALESCE(weight, {param(defaultWeight)}) >= {param(query.minWeight)}")
+    if query.maxWeight is not None:
+        conditions.append(f"COALESCE(weight, {param(defaultWeight)}) <= {param(query.maxWeight)}")
+    if query.text:
+        # served by the pg_trgm indexes on word and translation
+        pattern = param(_like(query.text))
+        conditions.append(f"(word ILIKE {pattern} OR translation ILIKE {pattern})")
+
+    columns = ["word_id"] + [FIELDS[f] for f in query.fields if f != "wordId"]
+    sql = f"SELECT {', '.join(columns)} FROM words WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY word_id"
+    if paged:
+        # one extra row tells whether there is a next page
+        sql += f" LIMIT {param(query.limit + 1)}"
+    return sql, params
+
+
+def project(row, fields):
+    """
+    Слово в формате API только с запрошенными полями.
+    """
+    word = {}
+    for field in fields:
+        value = row[FIELDS[field]]
+        if field == "example":
+            value = json.loads(value) if value else None
+        word[field] = value
+    return word
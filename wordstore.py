@@ -0,0 +1,550 @@
+import asyncio
+import collections
+import dataclasses
+import json
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+
+import database
+import eventloop
+import metrics
+import sampler
+import snapshot
+
+CHANNEL = "words_changed"
+COLUMNS = "word_id, word, translation, partofspeech, example, repeatindex, nextrepeattime, weight"
+
+# the newest change of a learner's words, tombstones included (schema migration 3)
+VERSION_QUERY = """
+    SELECT GREATEST(
+        (SELECT MAX(version) FROM words WHERE user_id = $1),
+        (SELECT MAX(version) FROM words_deleted WHERE user_id = $1),
+        0)
+"""
+
+# notifications are collected for a short while and refreshed with one query
+REFRESH_DELAY = 0.05
+
+# user_id of requests that do not name a learner (the single-user setup)
+DEFAULT_USER_ID = 1
+
+DEFAULT_SETTINGS = {
+    # dictionaries kept in memory at once; least recently used learners are evicted
+    "max_users": 1000,
+    "max_words": 2000000
+}
+
+REQUESTS = metrics.counter("word_store_requests_total", "Vocabulary reads by result (hit = served from memory)")
+REFRESH_SECONDS = metrics.histogram("word_store_refresh_seconds", "Vocabulary refresh latency by kind")
+EVICTIONS = metrics.counter("word_store_evictions_total", "Learner dictionaries dropped from memory by reason")
+
+log = logging.getLogger(__name__)
+
+_NO_TIME = np.datetime64("NaT", "us")
+
+
+async def readVersion(conn, userId):
+    """
+    Версия словаря пользователя в базе: номер последнего изменения его слов.
+    Версии пользователя идут в порядке фиксации (schema migration 5): изменение,
+    которое еще не зафиксировано, получит номер больше этого.
+    """
+    return await conn.fetchval(VERSION_QUERY, userId)
+
+
+async def lockVersions(conn, userId):
+    """
+    Занимает выдачу версий слов пользователя до конца транзакции. Транзакция,
+    которая меняет или удаляет строки words, вызывает ее до первого изменения.
+    """
+    await conn.execute("SELECT words_lock_versions($1)", userId)
+
+
+async def _readAll(conn, userId):
+    # rows and version from one snapshot of the database
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        rows = await conn.fetch(f"SELECT {COLUMNS} FROM words WHERE user_id = $1", userId)
+        return rows, await readVersion(conn, userId)
+
+
+async def _readChanges(conn, userId, version):
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        rows, deleted = await snapshot.readChanges(conn, userId, version, COLUMNS)
+        return rows, deleted, await readVersion(conn, userId)
+
+
+@dataclasses.dataclass
+class Word:
+    """
+    Слово в формате API; responses.dumps сериализует его без промежуточного dict.
+    """
+    __slots__ = ("wordId", "nextRepeatTime", "repeatIndex", "word", "translation", "example", "partOfSpeech", "weight")
+    wordId: int
+    nextRepeatTime: object
+    repeatIndex: int
+    word: str
+    translation: str
+    example: object
+    partOfSpeech: str
+    weight: float
+
+    @classmethod
+    def fromRow(cls, row):
+        return cls(
+            wordId=row["word_id"],
+            nextRepeatTime=row["nextrepeattime"],
+            repeatIndex=row["repeatindex"],
+            word=row["word"],
+            translation=row["translation"],
+            example=json.loads(row["example"]) if row["example"] else None,
+            partOfSpeech=row["partofspeech"],
+            weight=row["weight"]
+        )
+
+
+class WordStore:
+    """
+    Словарь одного пользователя в памяти процесса, разложенный по колонкам.
+
+    Числовые поля - numpy массивы, строки слова и части речи интернированы,
+    examples хранятся исходной JSON строкой и разбираются только при выдаче.
+    Слово живет в постоянном слоте; освобожденные слоты переиспользуются.
+    После первой полной загрузки изменения приходят через LISTEN words_changed
+    (markDirty) и перечитываются только измененные строки.
+    Если есть снимок (snapshot.py), колонки - его отображенные срезы, общие
+    для всех процессов, а из базы читаются только строки, измененные после него.
+
+    listen - корутина-функция, подписывающая на words_changed перед полной
+    загрузкой (WordStores.listen); без нее словарь не следит за изменениями.
+
+    version - версия базы (readVersion), до которой изменения уже в словаре;
+    изменения, сделанные через upsertRows/updateState, могут быть в нем и раньше.
+    """
+
+    def __init__(self, defaultWeight=1.0, capacity=1024, userId=DEFAULT_USER_ID, listen=None):
+        self.defaultWeight = defaultWeight
+        self.userId = userId
+        self.loaded = False
+        self.version = 0
+        self._listen = listen
+        self._lock = threading.RLock()
+        self._subscribers = []
+        # word_id -> newest notified version (0 - unknown, payloads before schema migration 4)
+        self._dirty = {}
+        self._refreshScheduled = False
+        self._loading = None
+        self._bulkLoading = False
+        self.sampler = sampler.WeightedSampler(capacity)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.weights = np.zeros(capacity, dtype=np.float64)
+        self.repeatIndexes = np.zeros(capacity, dtype=np.int32)
+        self.nextRepeatTimes = np.full(capacity, _NO_TIME, dtype="datetime64[us]")
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.words = [None] * capacity
+        self.translations = [None] * capacity
+        self.partsOfSpeech = [None] * capacity
+        self.examples = [None] * capacity
+        self._slotById = {}
+        self._freeSlots = list(range(capacity - 1, -1, -1))
+
+    def _grow(self):
+        capacity = len(self.ids)
+        extra = max(capacity, 1024)
+        self.ids = np.concatenate([self.ids, np.zeros(extra, dtype=np.int64)])
+        self.weights = np.concatenate([self.weights, np.zeros(extra, dtype=np.float64)])
+        self.repeatIndexes = np.concatenate([self.repeatIndexes, np.zeros(extra, dtype=np.int32)])
+        self.nextRepeatTimes = np.concatenate([self.nextRepeatTimes, np.full(extra, _NO_TIME, dtype="datetime64[us]")])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        for column in (self.words, self.translations, self.partsOfSpeech, self.examples):
+            column.extend([None] * extra)
+        self._freeSlots.extend(range(capacity + extra - 1, capacity - 1, -1))
+        if not self._bulkLoading:
+            self.sampler.resize(capacity + extra)
+
+    def __len__(self):
+        return len(self._slotById)
+
+    @property
+    def capacity(self):
+        return len(self.ids)
+
+    def subscribe(self, subscriber):
+        """
+        subscriber получает load(rows), add(wordId, word, partOfSpeech) и remove(wordId)
+        (интерфейс DistractorIndex).
+        """
+        self._subscribers.append(subscriber)
+        if self.loaded:
+            subscriber.load(self._indexRows())
+
+    def slotOf(self, wordId):
+        return self._slotById.get(wordId)
+
+    # ---- изменение
+
+    def _put(self, row):
+        wordId = row["word_id"]
+        slot = self._slotById.get(wordId)
+        if slot is None:
+            if not self._freeSlots:
+                self._grow()
+            slot = self._freeSlots.pop()
+            self._slotById[wordId] = slot
+
+        weight = row["weight"]
+        self.ids[slot] = wordId
+        self.weights[slot] = self.defaultWeight if weight is None else weight
+        self.repeatIndexes[slot] = row["repeatindex"] or 0
+        self.nextRepeatTimes[slot] = row["nextrepeattime"] if row["nextrepeattime"] is not None else _NO_TIME
+        self.alive[slot] = True
+        self.words[slot] = sys.intern(row["word"]) if row["word"] is not None else None
+        self.translations[slot] = row["translation"]
+        self.partsOfSpeech[slot] = sys.intern(row["partofspeech"]) if row["partofspeech"] else None
+        self.examples[slot] = row["example"]
+        if not self._bulkLoading:
+            self.sampler.update(slot, self.weights[slot])
+        return slot
+
+    def _drop(self, wordId):
+        slot = self._slotById.pop(wordId, None)
+        if slot is None:
+            return None
+        self.alive[slot] = False
+        self.ids[slot] = 0
+        self.weights[slot] = 0
+        self.sampler.update(slot, 0.0)
+        self.nextRepeatTimes[slot] = _NO_TIME
+        self.words[slot] = self.translations[slot] = self.partsOfSpeech[slot] = self.examples[slot] = None
+        self._freeSlots.append(slot)
+        return slot
+
+    def upsertRows(self, rows):
+        with self._lock:
+            for row in rows:
+                slot = self._put(row)
+                for subscriber in self._subscribers:
+                    subscriber.add(row["word_id"], self.words[slot], self.partsOfSpeech[slot])
+
+    def remove(self, wordId):
+        with self._lock:
+            if self._drop(wordId) is not None:
+                for subscriber in self._subscribers:
+                    subscriber.remove(wordId)
+
+    def updateState(self, wordIds, repeatIndexes, nextRepeatTimes, weights):
+        """
+        Обновление после сохранения результатов повторения, без чтения из базы.
+        """
+        with self._lock:
+            for wordId, repeatIndex, nextRepeatTime, weight in zip(wordIds, repeatIndexes, nextRepeatTimes, weights):
+                slot = self._slotById.get(wordId)
+                if slot is None:
+                    continue
+                self.repeatIndexes[slot] = repeatIndex
+                self.nextRepeatTimes[slot] = nextRepeatTime
+                self.weights[slot] = weight
+                self.sampler.update(slot, weight)
+
+    def _replaceAll(self, rows, version):
+        with self._lock:
+            self._allocate(max(1024, len(rows) * 5 // 4))
+            self._bulkLoading = True
+            try:
+                for row in rows:
+                    self._put(row)
+            finally:
+                self._bulkLoading = False
+            self.sampler.rebuild(self.weights)
+            self.version = version
+            self.loaded = True
+            indexRows = self._indexRows()
+            for subscriber in self._subscribers:
+                subscriber.load(indexRows)
+
+    def _attach(self, view, rows, deleted, version):
+        part = view.claim(self.userId)
+        if part is None:
+            # the learner had no words when the snapshot was built, all of them are changes
+            snapshot.ATTACHES.inc(result="absent")
+            self._replaceAll(rows, version)
+            return
+        with self._lock:
+            self.ids, self.weights = part.ids, part.weights
+            self.repeatIndexes, self.nextRepeatTimes = part.repeatIndexes, part.nextRepeatTimes
+            self.alive = np.zeros(len(part), dtype=bool)
+            self.alive[:part.count] = True
+            self.words, self.translations, self.partsOfSpeech, self.examples = (
+                part.strings(field) for field in range(len(snapshot.FIELDS)))
+            self._slotById = part.slots()
+            # new words go to the slots the snapshot reserved, the columns grow only after them
+            self._freeSlots = list(range(len(part) - 1, part.count - 1, -1))
+            self.sampler.attach(part.samplerWeights, part.tree)
+            for row in rows:
+                self._put(row)
+            for wordId in deleted:
+                self._drop(wordId)
+            self.version = version
+            self.loaded = True
+            indexRows = self._indexRows()
+            for subscriber in self._subscribers:
+                subscriber.load(indexRows)
+        snapshot.ATTACHES.inc(result="attached")
+
+    def _indexRows(self):
+        return [{"word_id": int(self.ids[slot]), "word": self.words[slot], "partofspeech": self.partsOfSpeech[slot]}
+                for slot in self._slotById.values()]
+
+    # ---- чтение
+
+    def wordAt(self, slot):
+        """
+        Слово (Word) в том виде, в каком его отдает API.
+        """
+        nextRepeatTime = self.nextRepeatTimes[slot]
+        example = self.examples[slot]
+        return Word(
+            wordId=int(self.ids[slot]),
+            nextRepeatTime=None if np.isnat(nextRepeatTime) else nextRepeatTime.item(),
+            repeatIndex=int(self.repeatIndexes[slot]),
+            word=self.words[slot],
+            translation=self.translations[slot],
+            example=json.loads(example) if example else None,
+            partOfSpeech=self.partsOfSpeech[slot],
+            weight=float(self.weights[slot])
+        )
+
+    def get(self, wordId):
+        with self._lock:
+            slot = self._slotById.get(wordId)
+            return None if slot is None else self.wordAt(slot)
+
+    def allWords(self):
+        with self._lock:
+            return [self.wordAt(slot) for slot in sorted(self._slotById.values())]
+
+    def iterWords(self, batchSize=1000):
+        """
+        Все слова пачками по batchSize: в памяти одновременно только одна пачка
+        (удаленные за время обхода слова пропускаются).
+        """
+        with self._lock:
+            slots = np.flatnonzero(self.alive)
+        for start in range(0, len(slots), batchSize):
+            with self._lock:
+                yield [self.wordAt(slot) for slot in slots[start:start + batchSize] if self.alive[slot]]
+
+    def sampleWords(self, count):
+        """
+        До count разных слов, вероятность выбора пропорциональна весу.
+        """
+        with self._lock:
+            return [self.wordAt(slot) for slot in self.sampler.sample(count)]
+
+    def memoryUsage(self):
+        """
+        Приблизительный размер колонок в байтах (без интернированных строк-дублей;
+        колонки из снимка считаются целиком, строки снимка - нет).
+        """
+        with self._lock:
+            total = self.ids.nbytes + self.weights.nbytes + self.repeatIndexes.nbytes \
+                + self.nextRepeatTimes.nbytes + self.alive.nbytes + self.sampler.weights.nbytes * 2
+            total += sum(sys.getsizeof(column) for column in (self.words, self.translations, self.partsOfSpeech, self.examples))
+            seen = set()
+            for column in (self.words, self.translations, self.partsOfSpeech, self.examples):
+                if isinstance(column, snapshot.ArenaColumn):
+                    column = column.changedValues()
+                for value in column:
+                    if value is not None and id(value) not in seen:
+                        seen.add(id(value))
+                        total += sys.getsizeof(value)
+            return total
+
+    # ---- загрузка и обновление из базы
+
+    async def ensureLoaded(self):
+        if self.loaded:
+            REQUESTS.inc(result="hit")
+            return self
+        REQUESTS.inc(result="miss")
+        await eventloop.submit(self._loadOnce())
+        return self
+
+    async def _loadOnce(self):
+        # runs on the background loop: concurrent misses share one load
+        if self.loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+        try:
+            await asyncio.shield(self._loading)
+        finally:
+            self._loading = None
+
+    async def _load(self):
+        started = time.perf_counter()
+        # subscribe first so that nothing committed during the full read is lost
+        if self._listen is not None:
+            await self._listen()
+        view = snapshot.current()
+        if view is not None:
+            rows, deleted, version = await database.run(_readChanges, self.userId, view.versionOf(self.userId))
+            self._clearDirty(version)
+            self._attach(view, rows, deleted, version)
+            REFRESH_SECONDS.observe(time.perf_counter() - started, kind="snapshot")
+        else:
+            rows, version = await database.run(_readAll, self.userId)
+            self._clearDirty(version)
+            self._replaceAll(rows, version)
+            REFRESH_SECONDS.observe(time.perf_counter() - started, kind="full")
+        # changes committed while the read ran may be missing from it
+        if self._dirty:
+            self._scheduleRefresh()
+
+    def invalidate(self):
+        # notifications may have been missed: reload everything on next access
+        self.loaded = False
+
+    def _clearDirty(self, version):
+        # marks up to the loaded version are in the rows just read; versions of a
+        # learner follow the commit order, the newer ones may not be
+        self._dirty = {wordId: marked for wordId, marked in self._dirty.items() if not 0 < marked <= version}
+
+    def markDirty(self, wordId, version=0):
+        """
+        Слово изменено в базе (изменением с номером version); вызывается на общем loop,
+        строки перечитываются пачкой.
+        """
+        self._dirty[wordId] = max(self._dirty.get(wordId, 0), version)
+        self._scheduleRefresh()
+
+    def _scheduleRefresh(self):
+        if not self._refreshScheduled:
+            self._refreshScheduled = True
+            asyncio.get_running_loop().call_later(REFRESH_DELAY, lambda: eventloop.spawn(self._refreshDirty()))
+
+    async def _refreshDirty(self):
+        self._refreshScheduled = False
+        # while the store is (re)loading the marks stay, the load refreshes what it did not read
+        if not self._dirty or not self.loaded:
+            return
+        marks, self._dirty = self._dirty, {}
+        wordIds = list(marks)
+        version = max(marks.values())
+
+        started = time.perf_counter()
+        try:
+            rows = await database.run(lambda conn: conn.fetch(
+                f"SELECT {COLUMNS}, version FROM words WHERE word_id = ANY($1::bigint[]) AND user_id = $2",
+                wordIds, self.userId))
+        except Exception as e:
+            log.warning("Word store refresh failed: %s", e)
+            self.loaded = False
+            return
+
+        self.upsertRows(rows)
+        found = {row["word_id"] for row in rows}
+        for wordId in wordIds:
+            if wordId not in found:
+                self.remove(wordId)
+        # the version moves only once the rows are in, an ETag never runs ahead of the data
+        self.version = max([self.version, version] + [row["version"] for row in rows])
+        REFRESH_SECONDS.observe(time.perf_counter() - started, kind="incremental")
+
+
+
+class WordStores:
+    """
+    Словари пользователей: WordStore на каждый user_id, создается при первом
+    обращении. В памяти не больше max_users словарей и примерно max_words слов,
+    давно не использованные словари вытесняются (и при следующем обращении
+    загружаются заново). Одно LISTEN-соединение на процесс раздает уведомления
+    words_changed ("user_id:word_id:version") словарям, которые сейчас в памяти.
+
+    onCreate(store) вызывается для каждого нового словаря (подписка индексов).
+    """
+
+    def __init__(self, defaultWeight=1.0, settings=None, onCreate=None):
+        self.defaultWeight = defaultWeight
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self._onCreate = onCreate
+        self._stores = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._listenConn = None
+        self._subscribing = None
+
+    def __len__(self):
+        return len(self._stores)
+
+    def wordCount(self):
+        with self._lock:
+            return sum(len(store) for store in self._stores.values())
+
+    def peek(self, userId):
+        """
+        Словарь пользователя, если он сейчас в памяти (без загрузки и без продления LRU).
+        """
+        return self._stores.get(userId)
+
+    def get(self, userId):
+        with self._lock:
+            store = self._stores.get(userId)
+            if store is None:
+                store = self._stores[userId] = WordStore(self.defaultWeight, userId=userId, listen=self.listen)
+                if self._onCreate is not None:
+                    self._onCreate(store)
+            self._stores.move_to_end(userId)
+            self._evict()
+            return store
+
+    async def ensureLoaded(self, userId):
+        return await self.get(userId).ensureLoaded()
+
+    def _evict(self):
+        # the store just requested is the most recent one and is never evicted
+        while len(self._stores) > self.settings["max_users"]:
+            self._stores.popitem(last=False)
+            EVICTIONS.inc(reason="users")
+        total = sum(len(store) for store in self._stores.values())
+        while total > self.settings["max_words"] and len(self._stores) > 1:
+            _, store = self._stores.popitem(last=False)
+            total -= len(store)
+            EVICTIONS.inc(reason="words")
+
+    async def listen(self):
+        """
+        Подписка на words_changed (одна на все словари), выполняется на общем loop.
+        """
+        if self._listenConn is not None and not self._listenConn.is_closed():
+            return
+        if self._subscribing is None:
+            self._subscribing = asyncio.ensure_future(database.listen(CHANNEL, self._onNotify, self._onListenerLost))
+        try:
+            self._listenConn = await asyncio.shield(self._subscribing)
+        finally:
+            self._subscribing = None
+
+    def _onListenerLost(self, conn):
+        self._listenConn = None
+        with self._lock:
+            stores = list(self._stores.values())
+        for store in stores:
+            store.invalidate()
+
+    def _onNotify(self, conn, pid, channel, payload):
+        # payloads from before schema migration 4 have no version
+        userId, wordId, version = (payload.split(":") + ["0"])[:3]
+        try:
+            userId, wordId, version = int(userId), int(wordId), int(version)
+        except ValueError:
+            return
+        store = self._stores.get(userId)
+        if store is not None:
+            store.markDirty(wordId, version)